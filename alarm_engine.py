@@ -0,0 +1,190 @@
+import heapq
+import itertools
+import threading
+import time
+import traceback
+import zlib
+
+import metrics
+import recurrence
+import wallclock
+
+TICK_SECONDS = metrics.histogram('wakeup_scheduler_tick_seconds',
+                                 "Time to pop and fire everything due in one scheduler wake-up", ['engine'])
+FIRE_LAG_SECONDS = metrics.histogram('wakeup_alarm_fire_lag_seconds', "Actual minus scheduled fire time",
+                                     ['engine'], buckets=(0.001, 0.005, 0.01, 0.05, 0.1, 0.5, 1.0, 5.0,
+                                                          30.0, 60.0, 300.0))
+
+
+def next_deadline(alarm_time, now=None, tz=None):
+    # Epoch seconds of the next daily occurrence of an "HH:MM:SS" (or "HH:MM")
+    # local alarm time; see recurrence.next_fire for repeat rules
+    if now is None:
+        now = wallclock.now()
+    return recurrence.next_fire({'time': alarm_time}, tz or recurrence.timezone(), now)
+
+
+class AlarmEngine:
+    # Keeps pending alarms in a min-heap ordered by deadline and sleeps until the
+    # earliest one is due. Cancelled entries are dropped lazily when they reach the top.
+
+    def __init__(self, on_fire, on_missed=None, clock=wallclock.now, max_wait=30.0,
+                 catch_up_window=300.0):
+        self.on_fire = on_fire
+        self.on_missed = on_missed
+        self.clock = clock
+        self.max_wait = max_wait  # re-check the wall clock at least this often
+        self.catch_up_window = catch_up_window
+        self._heap = []
+        self._entries = {}
+        self._by_user = {}
+        self._counter = itertools.count()
+        self._cond = threading.Condition()
+        self._thread = None
+        self._stopped = False
+        self.name = 'alarm-engine'
+
+    def schedule(self, user_id, alarm_id, deadline):
+        with self._cond:
+            self._discard(user_id, alarm_id)
+            entry = [deadline, next(self._counter), user_id, alarm_id, True]
+            self._entries[(user_id, alarm_id)] = entry
+            self._by_user.setdefault(user_id, set()).add(alarm_id)
+            heapq.heappush(self._heap, entry)
+            if self._heap[0] is entry:
+                self._cond.notify()
+
+    def cancel(self, user_id, alarm_id):
+        with self._cond:
+            self._discard(user_id, alarm_id)
+
+    def cancel_user(self, user_id):
+        with self._cond:
+            for alarm_id in list(self._by_user.get(user_id, ())):
+                self._discard(user_id, alarm_id)
+
+    def pending(self):
+        with self._cond:
+            return len(self._entries)
+
+    def next_due(self):
+        with self._cond:
+            self._drop_cancelled()
+            return self._heap[0][0] if self._heap else None
+
+    def users(self):
+        with self._cond:
+            return len(self._by_user)
+
+    def start(self, name='alarm-engine'):
+        if self._thread is None:
+            self.name = name
+            self._thread = threading.Thread(target=self._run, name=name, daemon=True)
+            self._thread.start()
+
+    def stop(self):
+        with self._cond:
+            self._stopped = True
+            self._cond.notify()
+        if self._thread is not None:
+            self._thread.join()
+            self._thread = None
+
+    def run_due(self):
+        # Pop and fire every alarm whose deadline has passed. Alarms missed during a
+        # stall are fired late (in deadline order) as long as they are within the
+        # catch-up window, and reported otherwise.
+        started = time.perf_counter()
+        due = []
+        with self._cond:
+            now = self.clock()
+            self._drop_cancelled()
+            while self._heap and self._heap[0][0] <= now:
+                entry = heapq.heappop(self._heap)
+                self._discard(entry[2], entry[3])
+                due.append(entry)
+                self._drop_cancelled()
+
+        for deadline, _, user_id, alarm_id, _ in due:
+            lag = self.clock() - deadline
+            FIRE_LAG_SECONDS.observe(lag, engine=self.name)
+            try:
+                if lag <= self.catch_up_window:
+                    self.on_fire(user_id, alarm_id, deadline, lag)
+                else:
+                    print(f"⚠️ Alarm {alarm_id} for user {user_id} missed by {lag:.0f}s - not firing")
+                    if self.on_missed is not None:
+                        self.on_missed(user_id, alarm_id, deadline, lag)
+            except Exception:
+                traceback.print_exc()
+        if due:
+            TICK_SECONDS.observe(time.perf_counter() - started, engine=self.name)
+        return len(due)
+
+    def _run(self):
+        while True:
+            with self._cond:
+                if self._stopped:
+                    return
+                self._drop_cancelled()
+                delay = self._heap[0][0] - self.clock() if self._heap else self.max_wait
+                if delay > 0:
+                    self._cond.wait(min(delay, self.max_wait))
+                    continue
+            self.run_due()
+
+    def _discard(self, user_id, alarm_id):
+        entry = self._entries.pop((user_id, alarm_id), None)
+        if entry is not None:
+            entry[4] = False
+            alarm_ids = self._by_user[user_id]
+            alarm_ids.discard(alarm_id)
+            if not alarm_ids:
+                del self._by_user[user_id]
+
+    def _drop_cancelled(self):
+        while self._heap and not self._heap[0][4]:
+            heapq.heappop(self._heap)
+
+
+class ShardedAlarmEngine:
+    # Spreads users over several AlarmEngine shards by a stable hash of the UID.
+    # Each shard has its own heap and thread, so a slow fire handler for one
+    # household never delays alarms that live on another shard.
+
+    def __init__(self, on_fire, on_missed=None, shards=4, **engine_options):
+        self.shards = [AlarmEngine(on_fire, on_missed=on_missed, **engine_options)
+                       for _ in range(max(1, shards))]
+
+    def shard_for(self, user_id):
+        return self.shards[zlib.crc32(str(user_id).encode()) % len(self.shards)]
+
+    def schedule(self, user_id, alarm_id, deadline):
+        self.shard_for(user_id).schedule(user_id, alarm_id, deadline)
+
+    def cancel(self, user_id, alarm_id):
+        self.shard_for(user_id).cancel(user_id, alarm_id)
+
+    def cancel_user(self, user_id):
+        self.shard_for(user_id).cancel_user(user_id)
+
+    def pending(self):
+        return sum(shard.pending() for shard in self.shards)
+
+    def users(self):
+        return sum(shard.users() for shard in self.shards)
+
+    def next_due(self):
+        deadlines = [d for d in (shard.next_due() for shard in self.shards) if d is not None]
+        return min(deadlines) if deadlines else None
+
+    def run_due(self):
+        return sum(shard.run_due() for shard in self.shards)
+
+    def start(self):
+        for index, shard in enumerate(self.shards):
+            shard.start(name=f'alarm-engine-{index}')
+
+    def stop(self):
+        for shard in self.shards:
+            shard.stop()
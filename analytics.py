@@ -0,0 +1,156 @@
+from datetime import date, datetime, timedelta, timezone
+
+import numpy as np
+
+from insights import QUALITY_LEVELS, LOWEST_QUALITY, session_start
+
+# Batch sleep analytics over a user's whole session history. Sessions are loaded
+# once into NumPy arrays and every statistic is computed with array operations,
+# so multi-year histories cost a few milliseconds instead of Python loops.
+
+# Quality thresholds in ascending order for np.searchsorted
+QUALITY_THRESHOLDS = np.array(sorted(minimum for minimum, _ in QUALITY_LEVELS), dtype=float)
+QUALITY_SCORES = np.array([LOWEST_QUALITY] + [q for _, q in sorted(QUALITY_LEVELS)], dtype=float)
+
+PERCENTILES = (10, 25, 50, 75, 90)
+WEEKDAYS = ['Mon', 'Tue', 'Wed', 'Thu', 'Fri', 'Sat', 'Sun']
+DAY_SECONDS = 24 * 60 * 60
+EPOCH = date(1970, 1, 1)
+
+
+def load_sessions(sessions):
+    # Returns (starts, durations): float arrays in chronological order, with NaN
+    # starts for sessions that carry no date
+    keys = sorted((sessions or {}).keys())
+    starts = np.empty(len(keys))
+    durations = np.empty(len(keys))
+    for i, key in enumerate(keys):
+        value = sessions[key]
+        start = session_start(key, value)
+        starts[i] = np.nan if start is None else start
+        duration = value.get('duration') if isinstance(value, dict) else value
+        durations[i] = np.nan if duration is None else float(duration)
+    valid = ~np.isnan(durations)
+    starts, durations = starts[valid], durations[valid]
+    order = np.argsort(np.where(np.isnan(starts), -np.inf, starts), kind='stable')
+    return starts[order], durations[order]
+
+
+def quality_scores(durations):
+    return QUALITY_SCORES[np.searchsorted(QUALITY_THRESHOLDS, durations, side='right')]
+
+
+def _rolling_mean(totals, counts, window):
+    # Trailing mean over calendar days that have data, via cumulative sums
+    total_sums = np.cumsum(totals)
+    count_sums = np.cumsum(counts)
+    total_sums[window:] = total_sums[window:] - total_sums[:-window].copy()
+    count_sums[window:] = count_sums[window:] - count_sums[:-window].copy()
+    with np.errstate(invalid='ignore', divide='ignore'):
+        means = total_sums / count_sums
+    return means
+
+
+def _streaks(flags):
+    # (current, longest) run of consecutive True values
+    if not flags.size:
+        return 0, 0
+    padded = np.concatenate(([False], flags, [False])).astype(np.int8)
+    edges = np.flatnonzero(np.diff(padded))
+    runs = edges[1::2] - edges[::2]
+    longest = int(runs.max()) if runs.size else 0
+    current = int(runs[-1]) if runs.size and edges[-1] == flags.size else 0
+    return current, longest
+
+
+def _round(values, digits=1):
+    return [None if np.isnan(v) else round(float(v), digits) for v in values]
+
+
+def utc_offsets(starts, tz):
+    # Seconds east of UTC in tz at each start, NaN for undated sessions. One
+    # conversion per session, so nights either side of a DST change each get
+    # their own offset.
+    offsets = np.full(len(starts), np.nan)
+    for n, start in enumerate(starts):
+        if not np.isnan(start):
+            offsets[n] = datetime.fromtimestamp(start, tz).utcoffset().total_seconds()
+    return offsets
+
+
+def analyze(sessions, start=None, end=None, goal_minutes=420, tz=None):
+    # start/end are inclusive datetime.date bounds in local time in tz (a tzinfo,
+    # default UTC). Undated legacy sessions only count when no range is requested.
+    starts, durations = load_sessions(sessions)
+    local_days = np.floor((starts + utc_offsets(starts, tz or timezone.utc)) / DAY_SECONDS)
+    dated = ~np.isnan(starts)
+
+    if start is not None or end is not None:
+        keep = dated.copy()
+        if start is not None:
+            keep &= local_days >= (start - EPOCH).days
+        if end is not None:
+            keep &= local_days <= (end - EPOCH).days
+        starts, durations, local_days, dated = starts[keep], durations[keep], local_days[keep], dated[keep]
+
+    qualities = quality_scores(durations)
+    result = {
+        'count': int(durations.size),
+        'range': {
+            'start': start.isoformat() if start else None,
+            'end': end.isoformat() if end else None,
+        },
+    }
+    if not durations.size:
+        return result
+
+    result['summary'] = {
+        'total_minutes': float(durations.sum()),
+        'average_minutes': round(float(durations.mean()), 1),
+        'min_minutes': float(durations.min()),
+        'max_minutes': float(durations.max()),
+        'average_quality': round(float(qualities.mean()), 1),
+        'quality_histogram': {str(int(q)): int(n) for q, n in
+                              zip(QUALITY_SCORES, np.bincount(np.searchsorted(QUALITY_SCORES, qualities),
+                                                              minlength=QUALITY_SCORES.size))},
+    }
+    result['percentiles'] = {f'p{p}': round(float(v), 1)
+                             for p, v in zip(PERCENTILES, np.percentile(durations, PERCENTILES))}
+
+    days = local_days[dated].astype(np.int64)
+    if not days.size:
+        return result
+
+    # Dense calendar from the first to the last dated session
+    first_day = int(days.min())
+    index = days - first_day
+    span = int(index.max()) + 1
+    day_totals = np.bincount(index, weights=durations[dated], minlength=span)
+    day_counts = np.bincount(index, minlength=span).astype(float)
+    has_data = day_counts > 0
+    with np.errstate(invalid='ignore', divide='ignore'):
+        day_quality = quality_scores(day_totals)
+    day_quality[~has_data] = np.nan
+
+    weekday = (days + 3) % 7  # 1970-01-01 was a Thursday
+    weekday_totals = np.bincount(weekday, weights=durations[dated], minlength=7)
+    weekday_counts = np.bincount(weekday, minlength=7)
+    with np.errstate(invalid='ignore', divide='ignore'):
+        weekday_means = weekday_totals / weekday_counts
+
+    current, longest = _streaks(day_totals >= goal_minutes)
+    dates = [(EPOCH + timedelta(days=first_day + i)).isoformat() for i in range(span)]
+    daily_minutes = np.where(has_data, day_totals, np.nan)
+
+    result['weekdays'] = {name: {'average_minutes': _round([weekday_means[i]])[0],
+                                 'sessions': int(weekday_counts[i])}
+                          for i, name in enumerate(WEEKDAYS)}
+    result['streaks'] = {'goal_minutes': goal_minutes, 'current': current, 'longest': longest}
+    result['daily'] = {
+        'dates': dates,
+        'minutes': _round(daily_minutes),
+        'quality': _round(day_quality),
+        'rolling_7': _round(_rolling_mean(day_totals, day_counts, 7)),
+        'rolling_30': _round(_rolling_mean(day_totals, day_counts, 30)),
+    }
+    return result
@@ -0,0 +1,152 @@
+import queue
+import threading
+import time
+import traceback
+from collections import deque
+
+import numpy as np
+import speech_recognition as sr
+
+# Long-lived microphone capture for the voice agent.
+#
+# One thread keeps the microphone open and reads fixed-size chunks into a ring
+# buffer. The noise floor is tracked continuously from quiet chunks (no more
+# adjust_for_ambient_noise before every listen), and an energy-based segmenter
+# cuts the stream into utterances. Each utterance starts with a short pre-roll
+# taken from the ring buffer, so the first syllable of a command is never lost,
+# and it is ready the moment the speaker stops.
+
+SAMPLE_RATE = 16000
+CHUNK_SECONDS = 0.03
+SAMPLE_TYPES = {1: np.int8, 2: np.int16, 4: np.int32}
+
+
+def rms(chunk, sample_width):
+    # Root-mean-square of a chunk of signed native-endian PCM samples (what
+    # audioop.rms computed before it was removed from Python 3.13)
+    samples = np.frombuffer(chunk, dtype=SAMPLE_TYPES[sample_width],
+                            count=len(chunk) // sample_width).astype(np.float64)
+    if not len(samples):
+        return 0
+    return int(np.sqrt(np.dot(samples, samples) / len(samples)))
+
+
+class MicrophoneStream:
+    def __init__(self, device_index=None, sample_rate=SAMPLE_RATE, chunk_seconds=CHUNK_SECONDS,
+                 buffer_seconds=10.0, pre_roll=0.3, hangover=0.6, min_speech=0.15,
+                 max_utterance=10.0, min_energy=300, speech_ratio=3.0, noise_adapt=0.05,
+                 source=None):
+        self.sample_rate = sample_rate
+        self.chunk_size = int(sample_rate * chunk_seconds)
+        self.chunk_seconds = chunk_seconds
+        self._source = source or sr.Microphone(device_index=device_index, sample_rate=sample_rate,
+                                               chunk_size=self.chunk_size)
+        self.ring = deque(maxlen=int(buffer_seconds / chunk_seconds))
+        self.pre_roll_chunks = max(1, int(pre_roll / chunk_seconds))
+        self.hangover_chunks = max(1, int(hangover / chunk_seconds))
+        self.min_speech_chunks = max(1, int(min_speech / chunk_seconds))
+        self.max_utterance_chunks = int(max_utterance / chunk_seconds)
+        self.min_energy = min_energy
+        self.speech_ratio = speech_ratio
+        self.noise_adapt = noise_adapt
+        self.noise_floor = float(min_energy) / speech_ratio
+        self.utterances = queue.Queue(maxsize=8)
+        self._stopped = threading.Event()
+        self._thread = None
+        self.sample_width = None
+        self.last_onset = None  # time.time() the last returned utterance started
+
+    @property
+    def threshold(self):
+        return max(self.min_energy, self.noise_floor * self.speech_ratio)
+
+    def start(self):
+        if self._thread is None:
+            self._source.__enter__()
+            self.sample_width = self._source.SAMPLE_WIDTH
+            self._stopped.clear()
+            self._thread = threading.Thread(target=self._run, name='mic-capture', daemon=True)
+            self._thread.start()
+        return self
+
+    def stop(self):
+        self._stopped.set()
+        if self._thread is not None:
+            self._thread.join()
+            self._thread = None
+            self._source.__exit__(None, None, None)
+
+    def next_utterance(self, timeout=None):
+        # Next complete utterance as sr.AudioData, or None if nobody spoke in time
+        try:
+            started, frames = self.utterances.get(timeout=timeout)
+        except queue.Empty:
+            return None
+        self.last_onset = started
+        return sr.AudioData(b''.join(frames), self.sample_rate, self.sample_width)
+
+    def flush(self):
+        # Drop utterances queued before now (e.g. the wake word itself)
+        while True:
+            try:
+                self.utterances.get_nowait()
+            except queue.Empty:
+                return
+
+    def recent_audio(self, seconds):
+        chunks = list(self.ring)[-max(1, int(seconds / self.chunk_seconds)):]
+        return sr.AudioData(b''.join(chunks), self.sample_rate, self.sample_width)
+
+    def _emit(self, started, frames):
+        try:
+            self.utterances.put_nowait((started, frames))
+        except queue.Full:
+            # Nobody is consuming; keep the newest speech
+            try:
+                self.utterances.get_nowait()
+            except queue.Empty:
+                pass
+            self.utterances.put_nowait((started, frames))
+
+    def _run(self):
+        frames = None  # chunks of the utterance in progress
+        loud = 0
+        quiet = 0
+        started = None
+        stream = self._source.stream
+        while not self._stopped.is_set():
+            try:
+                chunk = stream.read(self.chunk_size)
+            except Exception:
+                traceback.print_exc()
+                time.sleep(0.1)
+                continue
+            if not chunk:
+                continue
+            energy = rms(chunk, self.sample_width)
+            is_speech = energy > self.threshold
+
+            if frames is None:
+                if is_speech:
+                    loud += 1
+                    if loud >= self.min_speech_chunks:
+                        # Start with the pre-roll so the onset of speech is kept
+                        frames = list(self.ring)[-(self.pre_roll_chunks + loud - 1):]
+                        started = time.time() - len(frames) * self.chunk_seconds
+                        quiet = 0
+                else:
+                    loud = 0
+                    # Only quiet audio moves the noise floor
+                    self.noise_floor += self.noise_adapt * (energy - self.noise_floor)
+                self.ring.append(chunk)
+                if frames is not None:
+                    frames.append(chunk)
+                continue
+
+            self.ring.append(chunk)
+            frames.append(chunk)
+            quiet = 0 if is_speech else quiet + 1
+            if quiet >= self.hangover_chunks or len(frames) >= self.max_utterance_chunks:
+                self._emit(started, frames)
+                frames = None
+                loud = 0
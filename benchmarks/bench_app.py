@@ -0,0 +1,309 @@
+import argparse
+import contextlib
+import io
+import json
+import os
+import platform
+import random
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+
+ROOT = os.path.join(os.path.dirname(os.path.abspath(__file__)), '..')
+sys.path.insert(0, ROOT)
+
+import wallclock
+from alarm_engine import AlarmEngine, ShardedAlarmEngine, next_deadline
+
+# Offline benchmarks for the web routes and the alarm scheduler. Nothing here
+# touches the network: the app runs on the Firebase storage code path against
+# fakedb (WAKEUP_STORAGE=fake) and "now" comes from a wallclock.FakeClock.
+#
+#   python benchmarks/bench_app.py                          # everything, summary on stdout
+#   python benchmarks/bench_app.py --only scheduler --sizes 1000 10000 100000
+#   python benchmarks/bench_app.py --output results/1.4.json
+#   python benchmarks/bench_app.py --compare results/1.3.json --tolerance 0.25
+#
+# Results are one JSON document (see --output); --compare exits with status 1
+# when a latency grew, or a throughput shrank, by more than the tolerance.
+
+START = 1760853600  # 2025-10-19 06:00 UTC, so runs are reproducible
+ROUTES = ('/dash', '/get_alarms', '/set_alarm', '/insights')
+
+
+def percentiles(samples, scale=1000.0, unit='ms'):
+    samples = sorted(samples)
+    if not samples:
+        return {}
+    return {
+        f'mean_{unit}': round(sum(samples) / len(samples) * scale, 3),
+        f'p50_{unit}': round(samples[len(samples) // 2] * scale, 3),
+        f'p95_{unit}': round(samples[int(len(samples) * 0.95)] * scale, 3),
+        f'p99_{unit}': round(samples[int(len(samples) * 0.99)] * scale, 3),
+        f'max_{unit}': round(samples[-1] * scale, 3),
+    }
+
+
+# Routes -----------------------------------------------------------------------
+
+def load_app():
+    # voicerec builds its storage and engines at import time, so configure first
+    os.environ['WAKEUP_STORAGE'] = 'fake'
+    os.environ.setdefault('PRESSURE_DIR', tempfile.mkdtemp(prefix='wakeup-bench-'))
+    with contextlib.redirect_stdout(io.StringIO()):
+        import voicerec
+    return voicerec
+
+
+def seed_users(voicerec, users, alarms, sessions, rng):
+    user_ids = []
+    for n in range(users):
+        user_id = f'bench-user-{n:05d}'
+        voicerec.store.create_user(user_id, {'email': f'{user_id}@example.com', 'hardware': {'pressure': 0, 'motor': 0}})
+        records = {}
+        for k in range(alarms):
+            records[f'alarm-{k}'] = {'time': f'{rng.randrange(24):02d}:{rng.randrange(60):02d}:00',
+                                     'status': 'active', 'created_at': wallclock.utcnow().isoformat()}
+        voicerec.store.write_alarms(user_id, records)
+        night = START - sessions * 86400
+        for k in range(sessions):
+            start = night + k * 86400
+            voicerec.store.add_session(user_id, str(start), rng.randrange(240, 540), start)
+        user_ids.append(user_id)
+    return user_ids
+
+
+def bench_routes(requests, users, alarms, sessions, seed):
+    voicerec = load_app()
+    rng = random.Random(seed)
+    previous = wallclock.install(wallclock.FakeClock(START))
+    try:
+        with contextlib.redirect_stdout(io.StringIO()):
+            user_ids = seed_users(voicerec, users, alarms, sessions, rng)
+        clients = []
+        for user_id in user_ids:
+            client = voicerec.app.test_client()
+            with client.session_transaction() as flask_session:
+                flask_session['user_id'] = user_id
+            clients.append(client)
+
+        seconds = iter(range(10 ** 9))
+        calls = {
+            '/dash': lambda client: client.get('/dash'),
+            '/get_alarms': lambda client: client.get('/get_alarms'),
+            # A fresh time every call, so none is rejected as a duplicate
+            '/set_alarm': lambda client: client.post('/set_alarm', json={'time': alarm_time(next(seconds))}),
+            '/insights': lambda client: client.get('/insights'),
+        }
+        results = {}
+        for route in ROUTES:
+            call = calls[route]
+            samples = []
+            statuses = {}
+            # Discarded warm-up: template compilation, first cache fill
+            with contextlib.redirect_stdout(io.StringIO()):
+                for client in clients[:5]:
+                    call(client)
+                started = time.perf_counter()
+                for n in range(requests):
+                    client = clients[n % len(clients)]
+                    t0 = time.perf_counter()
+                    response = call(client)
+                    samples.append(time.perf_counter() - t0)
+                    statuses[response.status_code] = statuses.get(response.status_code, 0) + 1
+                elapsed = time.perf_counter() - started
+            results[route] = dict(requests=requests, rps=round(requests / elapsed, 1),
+                                  statuses={str(k): v for k, v in sorted(statuses.items())},
+                                  **percentiles(samples))
+        return {'users': users, 'alarms_per_user': alarms, 'sessions_per_user': sessions, 'routes': results}
+    finally:
+        wallclock.install(previous)
+
+
+def alarm_time(n):
+    # The n-th second of the day (wrapping) as "HH:MM:SS"
+    minutes, second = divmod(n % 86400, 60)
+    hour, minute = divmod(minutes, 60)
+    return f'{hour:02d}:{minute:02d}:{second:02d}'
+
+
+# Scheduler ---------------------------------------------------------------------
+
+def bench_scheduler(size, alarms_per_user, shards, simulated, seed):
+    # One alarm engine setup for `size` users with random daily alarm times,
+    # then `simulated` seconds of one-second ticks on a fake clock. Tick cost is
+    # the time run_due() takes: popping whatever is due and calling the handler.
+    rng = random.Random(seed)
+    clock = wallclock.FakeClock(START)
+    fired = [0]
+
+    def on_fire(user_id, alarm_id, deadline, lag):
+        fired[0] += 1
+
+    engine = ShardedAlarmEngine(on_fire, shards=shards, clock=clock.time)
+    started = time.perf_counter()
+    for n in range(size):
+        for k in range(alarms_per_user):
+            alarm_time = f'{rng.randrange(24):02d}:{rng.randrange(60):02d}:{rng.randrange(60):02d}'
+            engine.schedule(f'user-{n}', f'alarm-{k}', next_deadline(alarm_time, now=clock.time()))
+    load_seconds = time.perf_counter() - started
+
+    busy, idle = [], []
+    for _ in range(simulated):
+        clock.advance(1)
+        t0 = time.perf_counter()
+        due = engine.run_due()
+        (busy if due else idle).append(time.perf_counter() - t0)
+    return {
+        'users': size,
+        'alarms': engine.pending() + fired[0],
+        'load_ms': round(load_seconds * 1000, 2),
+        'ticks': simulated,
+        'fired': fired[0],
+        'tick': percentiles(busy + idle, 1e6, 'us'),
+        'busy_tick': percentiles(busy, 1e6, 'us'),
+        'idle_tick': percentiles(idle, 1e6, 'us'),
+    }
+
+
+def bench_jitter(alarms, spread, seed):
+    # Real clock and a running engine thread: how late does an alarm fire
+    # relative to its deadline? Deadlines are spread over `spread` seconds.
+    rng = random.Random(seed)
+    lags = []
+    done = threading.Event()
+    lock = threading.Lock()
+
+    def on_fire(user_id, alarm_id, deadline, lag):
+        with lock:
+            lags.append(time.time() - deadline)
+            if len(lags) == alarms:
+                done.set()
+
+    engine = AlarmEngine(on_fire, clock=time.time)
+    engine.start(name='bench-jitter')
+    base = time.time() + 0.2
+    for n in range(alarms):
+        engine.schedule(f'user-{n}', 'alarm', base + rng.random() * spread)
+    done.wait(spread + 10)
+    engine.stop()
+    return dict(alarms=alarms, fired=len(lags), spread_s=spread, **percentiles(lags, 1000.0, 'ms'))
+
+
+# Results ----------------------------------------------------------------------
+
+def git_revision():
+    try:
+        return subprocess.run(['git', 'rev-parse', '--short', 'HEAD'], cwd=ROOT, capture_output=True,
+                              text=True, timeout=5).stdout.strip() or None
+    except Exception:
+        return None
+
+
+def flatten(data, prefix=''):
+    flat = {}
+    for key, value in data.items():
+        name = f'{prefix}.{key}' if prefix else str(key)
+        if isinstance(value, dict):
+            flat.update(flatten(value, name))
+        elif isinstance(value, (int, float)) and not isinstance(value, bool):
+            flat[name] = value
+    return flat
+
+
+def compare(current, baseline, tolerance):
+    # Latencies (_ms/_us) should not grow, throughput (rps) should not shrink
+    regressions = []
+    now, before = flatten(current['results']), flatten(baseline['results'])
+    for name, value in sorted(now.items()):
+        old = before.get(name)
+        if not old:
+            continue
+        if name.endswith(('_ms', '_us')) and value > old * (1 + tolerance):
+            regressions.append((name, old, value))
+        elif name.endswith('rps') and value < old * (1 - tolerance):
+            regressions.append((name, old, value))
+    return regressions
+
+
+def print_summary(results):
+    routes = results.get('routes')
+    if routes:
+        print(f"Routes ({routes['users']} users, {routes['alarms_per_user']} alarms, "
+              f"{routes['sessions_per_user']} sessions each)")
+        for route, stats in routes['routes'].items():
+            print(f"  {route:<12} {stats['rps']:>8.1f} req/s  p50 {stats['p50_ms']:.2f} ms  "
+                  f"p99 {stats['p99_ms']:.2f} ms  {stats['statuses']}")
+    for stats in results.get('scheduler', []):
+        print(f"Scheduler {stats['users']:>7} users: load {stats['load_ms']:.0f} ms, {stats['fired']} fired in "
+              f"{stats['ticks']} ticks, tick mean {stats['tick'].get('mean_us', 0):.1f} us "
+              f"p99 {stats['tick'].get('p99_us', 0):.1f} us max {stats['tick'].get('max_us', 0):.1f} us")
+    jitter = results.get('jitter')
+    if jitter:
+        print(f"Fire jitter ({jitter['fired']}/{jitter['alarms']} alarms): p50 {jitter.get('p50_ms', 0):.2f} ms  "
+              f"p99 {jitter.get('p99_ms', 0):.2f} ms  max {jitter.get('max_ms', 0):.2f} ms")
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Offline route and scheduler benchmarks")
+    parser.add_argument('--only', nargs='+', choices=('routes', 'scheduler', 'jitter'),
+                        default=['routes', 'scheduler', 'jitter'])
+    parser.add_argument('--requests', type=int, default=1000, help="requests per route")
+    parser.add_argument('--users', type=int, default=50, help="users seeded for the route benchmark")
+    parser.add_argument('--alarms', type=int, default=5, help="alarms per seeded user")
+    parser.add_argument('--sessions', type=int, default=60, help="sleep sessions per seeded user")
+    parser.add_argument('--sizes', type=int, nargs='+', default=[1000, 10000, 100000],
+                        help="scheduler user counts")
+    parser.add_argument('--shards', type=int, default=4)
+    parser.add_argument('--simulate', type=int, default=3600, help="simulated scheduler seconds")
+    parser.add_argument('--jitter-alarms', type=int, default=200)
+    parser.add_argument('--jitter-spread', type=float, default=2.0, help="seconds")
+    parser.add_argument('--seed', type=int, default=21)
+    parser.add_argument('--output', help="write the JSON results here")
+    parser.add_argument('--json', action='store_true', help="print the JSON results instead of a summary")
+    parser.add_argument('--compare', metavar='BASELINE', help="JSON results of an earlier run")
+    parser.add_argument('--tolerance', type=float, default=0.2)
+    args = parser.parse_args(argv)
+
+    results = {}
+    if 'routes' in args.only:
+        results['routes'] = bench_routes(args.requests, args.users, args.alarms, args.sessions, args.seed)
+    if 'scheduler' in args.only:
+        results['scheduler'] = [bench_scheduler(size, 1, args.shards, args.simulate, args.seed)
+                                for size in args.sizes]
+    if 'jitter' in args.only:
+        results['jitter'] = bench_jitter(args.jitter_alarms, args.jitter_spread, args.seed)
+
+    report = {
+        'benchmark': 'wakeup-app',
+        'revision': git_revision(),
+        'created_at': time.strftime('%Y-%m-%dT%H:%M:%SZ', time.gmtime()),
+        'python': platform.python_version(),
+        'platform': platform.platform(),
+        'args': vars(args),
+        'results': results,
+    }
+    if args.output:
+        os.makedirs(os.path.dirname(os.path.abspath(args.output)), exist_ok=True)
+        with open(args.output, 'w') as f:
+            json.dump(report, f, indent=2)
+    if args.json:
+        print(json.dumps(report, indent=2))
+    else:
+        print_summary(results)
+
+    if args.compare:
+        with open(args.compare) as f:
+            regressions = compare(report, json.load(f), args.tolerance)
+        for name, old, new in regressions:
+            print(f"REGRESSION {name}: {old} -> {new}")
+        if regressions:
+            return 1
+        print(f"No regressions beyond {args.tolerance:.0%} against {args.compare}")
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,111 @@
+import argparse
+import json
+import os
+import sys
+import time
+from collections import Counter
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+
+import intents
+from intent_corpus import load, generate
+
+# Accuracy and per-utterance cost of intents.parse.
+#
+# The generated golden corpus is built from templates that follow the grammar,
+# so it only catches regressions. Accuracy that means something comes from the
+# hand-written corpus: transcripts written by people, including adversarial
+# ones the grammar does not handle yet. Both are scored and reported apart.
+#
+#   python benchmarks/bench_intents.py                  # committed corpora
+#   python benchmarks/bench_intents.py --show-errors 20
+#   python benchmarks/bench_intents.py --json > results.json
+
+GOLDEN_PATH = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'intents_golden.jsonl')
+HANDWRITTEN_PATH = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'intents_handwritten.jsonl')
+SLOTS = ('time', 'relative_minutes', 'day', 'index', 'repeat')
+
+
+def score(examples):
+    intent_errors = Counter()
+    slot_errors = Counter()
+    failures = []
+    for example in examples:
+        got = intents.parse(example['text'])
+        want = example['expected']
+        wrong = [key for key in ('intent',) + SLOTS if got[key] != want[key]]
+        if got['intent'] != want['intent']:
+            intent_errors[want['intent']] += 1
+        for key in wrong:
+            if key != 'intent':
+                slot_errors[key] += 1
+        if wrong:
+            failures.append({'text': example['text'], 'expected': want, 'got': got})
+    total = len(examples)
+    return {
+        'examples': total,
+        'exact_match': round(1 - len(failures) / total, 4) if total else None,
+        'intent_accuracy': round(1 - sum(intent_errors.values()) / total, 4) if total else None,
+        'intent_errors': dict(intent_errors),
+        'slot_errors': dict(slot_errors),
+    }, failures
+
+
+def timing(examples, repeat=5):
+    texts = [example['text'] for example in examples]
+    samples = []
+    for _ in range(repeat):
+        for text in texts:
+            started = time.perf_counter()
+            intents.parse(text)
+            samples.append(time.perf_counter() - started)
+    samples.sort()
+    return {
+        'calls': len(samples),
+        'mean_us': round(sum(samples) / len(samples) * 1e6, 2),
+        'p50_us': round(samples[len(samples) // 2] * 1e6, 2),
+        'p99_us': round(samples[int(len(samples) * 0.99)] * 1e6, 2),
+        'max_us': round(samples[-1] * 1e6, 2),
+    }
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Benchmark the voice command intent parser")
+    parser.add_argument('--corpus', default=GOLDEN_PATH)
+    parser.add_argument('--handwritten', default=HANDWRITTEN_PATH,
+                        help="hand-written and adversarial transcripts, scored separately")
+    parser.add_argument('--generate', type=int, metavar='N',
+                        help="score a freshly generated corpus of N transcripts instead")
+    parser.add_argument('--seed', type=int, default=12)
+    parser.add_argument('--repeat', type=int, default=5, help="timing passes over the corpus")
+    parser.add_argument('--show-errors', type=int, default=0, metavar='N')
+    parser.add_argument('--json', action='store_true')
+    args = parser.parse_args(argv)
+
+    if args.generate:
+        examples = generate(args.generate, args.seed)
+    else:
+        examples = load(args.corpus)
+    accuracy, failures = score(examples)
+    handwritten, handwritten_failures = score(load(args.handwritten))
+    results = {'accuracy': accuracy, 'handwritten': handwritten, 'timing': timing(examples, args.repeat)}
+
+    if args.json:
+        print(json.dumps(results, indent=2))
+    else:
+        for label, a in (('generated', results['accuracy']), ('hand-written', results['handwritten'])):
+            print(f"{a['examples']} {label} transcripts: exact match {a['exact_match']:.2%}, "
+                  f"intent accuracy {a['intent_accuracy']:.2%}")
+            if a['intent_errors'] or a['slot_errors']:
+                print(f"  intent errors by expected intent: {a['intent_errors']}")
+                print(f"  slot errors: {a['slot_errors']}")
+        t = results['timing']
+        print(f"parse(): mean {t['mean_us']}us, p50 {t['p50_us']}us, p99 {t['p99_us']}us, "
+              f"max {t['max_us']}us over {t['calls']} calls")
+    for failure in (handwritten_failures + failures)[:args.show_errors]:
+        print(json.dumps(failure))
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,213 @@
+import argparse
+import json
+import os
+import random
+import sys
+
+# Deterministic golden corpus for intents.parse. Every transcript is built from
+# a template whose expected intent and slots are known, with the fillers,
+# casing and phrasings that show up in speech-to-text output. The same seed
+# always produces the same file, so the committed corpus can be regenerated
+# and diffed. The templates mirror the grammar in intents.py, so a perfect
+# score here only means nothing regressed; intents_handwritten.jsonl holds
+# hand-written and adversarial transcripts for real accuracy:
+#
+#   python benchmarks/intent_corpus.py --count 4000 > benchmarks/intents_golden.jsonl
+
+DEFAULT_SEED = 12
+DEFAULT_COUNT = 4000
+
+PREFIXES = ['', '', '', 'please ', 'can you ', 'could you ', 'hey ', 'okay ', 'i want you to ', 'um ']
+SUFFIXES = ['', '', '', ' please', ' thanks', ' thank you', ' now']
+SET_PHRASES = ['set an alarm', 'set alarm', 'set the alarm', 'set my alarm', 'create an alarm',
+               'add an alarm', 'make an alarm', 'set a new alarm', 'wake me up', 'wake me']
+CANCEL_VERBS = ['cancel', 'delete', 'remove', 'turn off']
+LIST_PHRASES = ['list alarms', 'list my alarms', 'show alarms', 'show my alarms', 'show me all alarms',
+                'what are my alarms', 'read my alarms', 'list all my alarms']
+HELP_PHRASES = ['help', 'help me', 'i need help', 'what can you do help']
+STOP_PHRASES = ['stop listening', 'go to sleep', 'never mind', 'nevermind']
+NOISE = ['what is the weather', 'i have 3 cats', 'play some music', 'turn on the lights',
+         'how old are you', 'call mom at home', 'the meeting has 12 people', 'order 2 pizzas',
+         'what time is it', 'tell me a joke', 'room 204 is free', 'good morning']
+WEEKDAYS = ['monday', 'tuesday', 'wednesday', 'thursday', 'friday', 'saturday', 'sunday']
+ORDINALS = ['first', 'second', 'third', 'fourth', 'fifth', 'sixth', 'seventh', 'eighth', 'ninth', 'tenth']
+SMALL_NUMBERS = {1: 'one', 2: 'two', 3: 'three', 4: 'four', 5: 'five', 6: 'six', 7: 'seven',
+                 8: 'eight', 9: 'nine', 10: 'ten', 15: 'fifteen', 20: 'twenty', 30: 'thirty'}
+
+
+def expected(intent, time=None, relative_minutes=None, day=None, index=None, repeat=None):
+    return {'intent': intent, 'time': time, 'relative_minutes': relative_minutes, 'day': day,
+            'index': index, 'repeat': repeat}
+
+
+def spoken_time(rng):
+    # (phrase, "HH:MM:SS")
+    style = rng.choice(['12h', '12h', '12h_minutes', '24h', 'oclock', 'bare', 'named', 'military'])
+    hour = rng.randrange(24)
+    minute = rng.choice([0, 5, 10, 15, 20, 30, 40, 45, 50, 55])
+    if style in ('12h', '12h_minutes'):
+        hour12 = rng.randrange(1, 13)
+        period = rng.choice(['am', 'pm'])
+        hour = hour12 % 12 + (12 if period == 'pm' else 0)
+        suffix = rng.choice([period, ' ' + period, ' ' + period[0] + '.m.', ' ' + period[0] + '. m.',
+                             ' ' + period.upper()])
+        if style == '12h_minutes' and minute:
+            separator = rng.choice([':', ':', '.'])
+            return f"{hour12}{separator}{minute:02d}{suffix}", f"{hour:02d}:{minute:02d}:00"
+        return f"{hour12}{suffix}", f"{hour:02d}:00:00"
+    if style == '24h':
+        text = rng.choice([f"{hour}:{minute:02d}", f"{hour:02d}:{minute:02d}"])
+        if hour >= 13 and rng.random() < 0.3:
+            text += ' hours'
+        return text, f"{hour:02d}:{minute:02d}:00"
+    if style == 'oclock':
+        hour = rng.randrange(1, 13)
+        word = rng.choice(['oclock', "o'clock", 'o clock'])
+        return f"{hour} {word}", f"{hour:02d}:00:00"
+    if style == 'bare':
+        return f"{hour}", f"{hour:02d}:00:00"
+    if style == 'named':
+        word = rng.choice(['noon', 'midday', 'midnight'])
+        return word, '00:00:00' if word == 'midnight' else '12:00:00'
+    return f"{hour:02d}{minute:02d} hours", f"{hour:02d}:{minute:02d}:00"
+
+
+def relative_offset(rng):
+    # (phrase, minutes)
+    style = rng.choice(['minutes', 'minutes', 'hours', 'words', 'an_hour', 'hours_and'])
+    if style == 'minutes':
+        minutes = rng.randrange(1, 120)
+        return f"in {minutes} {rng.choice(['minutes', 'minute', 'mins', 'min'])}", minutes
+    if style == 'hours':
+        hours = rng.randrange(1, 13)
+        return f"in {hours} {rng.choice(['hours', 'hour', 'hrs'])}", hours * 60
+    if style == 'words':
+        number = rng.choice(list(SMALL_NUMBERS))
+        return f"in {SMALL_NUMBERS[number]} minutes", number
+    if style == 'an_hour':
+        half = rng.random() < 0.5
+        return "in an hour" + (" and a half" if half else ""), 90 if half else 60
+    hours, minutes = rng.randrange(1, 9), rng.choice([5, 10, 15, 20, 30, 45])
+    return f"in {hours} hours and {minutes} minutes", hours * 60 + minutes
+
+
+def repeat_days(rng):
+    # (phrase, sorted weekday numbers)
+    style = rng.choice(['every_day', 'weekdays', 'weekends', 'list', 'single'])
+    if style == 'every_day':
+        return rng.choice(['every day', 'daily', 'each day', 'every night']), list(range(7))
+    if style == 'weekdays':
+        return rng.choice(['every weekday', 'on weekdays', 'weekdays']), [0, 1, 2, 3, 4]
+    if style == 'weekends':
+        return rng.choice(['every weekend', 'on weekends', 'weekends']), [5, 6]
+    if style == 'single':
+        day = rng.randrange(7)
+        return rng.choice([f"every {WEEKDAYS[day]}", f"on {WEEKDAYS[day]}s"]), [day]
+    days = sorted(rng.sample(range(7), rng.randrange(2, 4)))
+    names = [WEEKDAYS[day] + rng.choice(['', 's']) for day in days]
+    return f"on {', '.join(names[:-1])} and {names[-1]}", days
+
+
+def set_alarm_example(rng):
+    phrase = rng.choice(SET_PHRASES)
+    kind = rng.random()
+    if kind < 0.2:
+        text, minutes = relative_offset(rng)
+        return f"{phrase} {text}", expected('set_alarm', relative_minutes=minutes)
+    text, alarm_time = spoken_time(rng)
+    connector = 'for' if text[0].isdigit() and rng.random() < 0.5 else 'at'
+    if not text[0].isdigit() and text not in ('noon', 'midday', 'midnight'):
+        connector = 'at'
+    if kind < 0.35:
+        day = rng.choice(['tomorrow', 'today', 'tonight'])
+        if rng.random() < 0.5:
+            return (f"{phrase} {day} {connector} {text}",
+                    expected('set_alarm', alarm_time, day='tomorrow' if day == 'tomorrow' else 'today'))
+        return (f"{phrase} {connector} {text} {day}",
+                expected('set_alarm', alarm_time, day='tomorrow' if day == 'tomorrow' else 'today'))
+    if kind < 0.55:
+        days_text, days = repeat_days(rng)
+        return f"{phrase} {connector} {text} {days_text}", expected('set_alarm', alarm_time, repeat=days)
+    return f"{phrase} {connector} {text}", expected('set_alarm', alarm_time)
+
+
+def cancel_alarm_example(rng):
+    verb = rng.choice(CANCEL_VERBS)
+    index = rng.randrange(1, 11)
+    style = rng.choice(['plain', 'number', 'hash', 'ordinal', 'ordinal_suffix', 'last', 'missing'])
+    if style == 'plain':
+        return f"{verb} alarm {index}", expected('cancel_alarm', index=index)
+    if style == 'number':
+        return f"{verb} {rng.choice(['the ', 'my ', ''])}alarm number {index}", expected('cancel_alarm', index=index)
+    if style == 'hash':
+        return f"{verb} alarm #{index}", expected('cancel_alarm', index=index)
+    if style == 'ordinal':
+        return f"{verb} the {ORDINALS[index - 1]} alarm", expected('cancel_alarm', index=index)
+    if style == 'ordinal_suffix':
+        suffix = {1: 'st', 2: 'nd', 3: 'rd'}.get(index, 'th')
+        return f"{verb} the {index}{suffix} alarm", expected('cancel_alarm', index=index)
+    if style == 'last':
+        return f"{verb} the last alarm", expected('cancel_alarm', index=-1)
+    return f"{verb} the alarm", expected('cancel_alarm')
+
+
+# Transcripts the parser once got wrong, appended verbatim after the generated
+# ones so the rest of the corpus stays the same when one is added
+REGRESSIONS = [
+    ("cancel alarm two", expected('cancel_alarm', index=2)),
+    ("delete my alarm ten", expected('cancel_alarm', index=10)),
+    ("remove the alarm three please", expected('cancel_alarm', index=3)),
+]
+
+
+def generate(count=DEFAULT_COUNT, seed=DEFAULT_SEED):
+    rng = random.Random(seed)
+    builders = [
+        (0.45, set_alarm_example),
+        (0.2, cancel_alarm_example),
+        (0.1, lambda rng: (rng.choice(LIST_PHRASES), expected('list_alarms'))),
+        (0.05, lambda rng: (rng.choice(HELP_PHRASES), expected('help'))),
+        (0.05, lambda rng: (rng.choice(STOP_PHRASES), expected('stop_listening'))),
+        (0.15, lambda rng: (rng.choice(NOISE), expected(None))),
+    ]
+    weights = [weight for weight, _ in builders]
+    seen = set()
+    examples = []
+    while len(examples) < count:
+        build = rng.choices([builder for _, builder in builders], weights)[0]
+        text, target = build(rng)
+        text = rng.choice(PREFIXES) + text + rng.choice(SUFFIXES)
+        if rng.random() < 0.15:
+            text = text.capitalize()
+        if text in seen and len(seen) < count * 0.9:
+            continue
+        seen.add(text)
+        examples.append({'text': text, 'expected': target})
+    examples.extend({'text': text, 'expected': target} for text, target in REGRESSIONS)
+    return examples
+
+
+def load(path):
+    with open(path) as f:
+        return [json.loads(line) for line in f if line.strip()]
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Generate the intent parser golden corpus")
+    parser.add_argument('--count', type=int, default=DEFAULT_COUNT)
+    parser.add_argument('--seed', type=int, default=DEFAULT_SEED)
+    parser.add_argument('--output', help="write here instead of stdout")
+    args = parser.parse_args(argv)
+
+    lines = [json.dumps(example, sort_keys=True) for example in generate(args.count, args.seed)]
+    if args.output:
+        os.makedirs(os.path.dirname(args.output) or '.', exist_ok=True)
+        with open(args.output, 'w') as f:
+            f.write('\n'.join(lines) + '\n')
+    else:
+        sys.stdout.write('\n'.join(lines) + '\n')
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
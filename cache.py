@@ -0,0 +1,146 @@
+import copy
+import threading
+import time
+from collections import OrderedDict
+
+# Read-through cache in front of a Storage backend for the per-user documents
+# the dashboard keeps asking for: alarms, profile and hardware. Entries are
+# evicted LRU-first once the cache is full and expire after a per-section TTL.
+# Every write that goes through the wrapper invalidates the affected section.
+
+DEFAULT_TTLS = {
+    'alarms': 60.0,
+    'profile': 300.0,
+    'hardware': 5.0,  # pressure is written by the pillow behind our back
+}
+
+
+class CachedStorage:
+    def __init__(self, backend, max_entries=10000, ttls=None, clock=time.monotonic):
+        self.backend = backend
+        self.max_entries = max_entries
+        self.ttls = dict(DEFAULT_TTLS, **(ttls or {}))
+        self.clock = clock
+        self._entries = OrderedDict()
+        self._generations = {}
+        self._lock = threading.Lock()
+        self.hits = {section: 0 for section in self.ttls}
+        self.misses = {section: 0 for section in self.ttls}
+
+    def __getattr__(self, name):
+        # Anything not cached (sessions, current user, ...) goes straight through
+        return getattr(self.backend, name)
+
+    # Cache mechanics -----------------------------------------------------
+
+    def _read(self, user_id, section, load):
+        key = (user_id, section)
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None and entry[0] > self.clock():
+                self._entries.move_to_end(key)
+                self.hits[section] += 1
+                return copy.deepcopy(entry[1])
+            self.misses[section] += 1
+            generation = self._generations.get(key, 0)
+
+        value = load()
+
+        with self._lock:
+            # Don't cache a value that a concurrent write has already made stale
+            if self._generations.get(key, 0) == generation:
+                self._entries[key] = (self.clock() + self.ttls[section], copy.deepcopy(value))
+                self._entries.move_to_end(key)
+                while len(self._entries) > self.max_entries:
+                    self._entries.popitem(last=False)
+        return value
+
+    def invalidate(self, user_id, section=None):
+        sections = [section] if section else list(self.ttls)
+        with self._lock:
+            for name in sections:
+                key = (user_id, name)
+                self._entries.pop(key, None)
+                self._generations[key] = self._generations.get(key, 0) + 1
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+            self._generations.clear()
+
+    def stats(self):
+        with self._lock:
+            stats = {'entries': len(self._entries), 'max_entries': self.max_entries}
+            for section in self.ttls:
+                hits, misses = self.hits[section], self.misses[section]
+                stats[section] = {
+                    'hits': hits,
+                    'misses': misses,
+                    'hit_rate': round(hits / (hits + misses), 3) if hits + misses else 0.0,
+                }
+            return stats
+
+    # Cached reads --------------------------------------------------------
+
+    def get_alarms(self, user_id):
+        return self._read(user_id, 'alarms', lambda: self.backend.get_alarms(user_id))
+
+    def find_alarms(self, user_id, alarm_time):
+        return {aid: alarm for aid, alarm in self.get_alarms(user_id).items()
+                if alarm.get('time') == alarm_time}
+
+    def get_user(self, user_id):
+        return self._read(user_id, 'profile', lambda: self.backend.get_user(user_id))
+
+    def get_hardware(self, user_id):
+        return self._read(user_id, 'hardware', lambda: self.backend.get_hardware(user_id))
+
+    # Invalidating writes -------------------------------------------------
+
+    def create_user(self, user_id, data):
+        try:
+            return self.backend.create_user(user_id, data)
+        finally:
+            self.invalidate(user_id)
+
+    def update_user(self, user_id, fields):
+        try:
+            return self.backend.update_user(user_id, fields)
+        finally:
+            self.invalidate(user_id, 'profile')
+
+    def add_alarm(self, user_id, alarm, alarm_id=None):
+        try:
+            return self.backend.add_alarm(user_id, alarm, alarm_id)
+        finally:
+            self.invalidate(user_id, 'alarms')
+
+    def update_alarm(self, user_id, alarm_id, fields):
+        try:
+            return self.backend.update_alarm(user_id, alarm_id, fields)
+        finally:
+            self.invalidate(user_id, 'alarms')
+
+    def cancel_alarm(self, user_id, alarm_id):
+        try:
+            return self.backend.cancel_alarm(user_id, alarm_id)
+        finally:
+            self.invalidate(user_id, 'alarms')
+
+    def delete_alarm(self, user_id, alarm_id):
+        try:
+            return self.backend.delete_alarm(user_id, alarm_id)
+        finally:
+            self.invalidate(user_id, 'alarms')
+
+    def write_alarms(self, user_id, alarms):
+        try:
+            return self.backend.write_alarms(user_id, alarms)
+        finally:
+            self.invalidate(user_id, 'alarms')
+
+    def set_hardware(self, user_id, field, value):
+        try:
+            return self.backend.set_hardware(user_id, field, value)
+        finally:
+            self.invalidate(user_id, 'hardware')
@@ -0,0 +1,119 @@
+import queue
+import threading
+import time
+import traceback
+from collections import deque
+from concurrent.futures import Future
+
+import metrics
+
+# In-process queue between speech recognition and the actions it triggers.
+#
+# The voice loop submits a command and goes straight back to the microphone;
+# a small pool of workers runs the registered handler against the alarm
+# service. Each command records how long it waited in the queue and how long
+# the handler ran, per command name.
+
+QUEUE_SIZE = 64
+WORKERS = 2
+LATENCY_SAMPLES = 512
+
+WAIT_SECONDS = metrics.histogram('wakeup_command_wait_seconds', "Time a command waited in the queue", ['command'])
+RUN_SECONDS = metrics.histogram('wakeup_command_run_seconds', "Time a command's handler ran", ['command'])
+
+
+class CommandBus:
+    def __init__(self, workers=WORKERS, queue_size=QUEUE_SIZE, clock=time.perf_counter):
+        self.workers = workers
+        self.clock = clock
+        self._handlers = {}
+        self._queue = queue.Queue(maxsize=queue_size)
+        self._threads = []
+        self._lock = threading.Lock()
+        self._stats = {}
+
+    def register(self, name, handler):
+        self._handlers[name] = handler
+
+    def handler(self, name):
+        # Decorator form of register()
+        def decorate(func):
+            self.register(name, func)
+            return func
+        return decorate
+
+    def submit(self, name, *args, **kwargs):
+        # Returns a Future with the handler's result. Raises queue.Full rather
+        # than blocking the caller when the workers are hopelessly behind.
+        if name not in self._handlers:
+            raise KeyError(f"Unknown command: {name}")
+        future = Future()
+        self._queue.put_nowait((name, args, kwargs, future, self.clock()))
+        return future
+
+    def start(self):
+        while len(self._threads) < self.workers:
+            thread = threading.Thread(target=self._run, name=f'command-worker-{len(self._threads)}',
+                                      daemon=True)
+            self._threads.append(thread)
+            thread.start()
+        return self
+
+    def stop(self, timeout=None):
+        # Let queued commands finish, then shut the workers down
+        for _ in self._threads:
+            self._queue.put((None, None, None, None, None))
+        for thread in self._threads:
+            thread.join(timeout)
+        self._threads = []
+
+    def pending(self):
+        return self._queue.qsize()
+
+    def _run(self):
+        while True:
+            name, args, kwargs, future, queued_at = self._queue.get()
+            if name is None:
+                return
+            if not future.set_running_or_notify_cancel():
+                continue
+            started = self.clock()
+            try:
+                result = self._handlers[name](*args, **kwargs)
+            except Exception as e:
+                traceback.print_exc()
+                self._record(name, started - queued_at, self.clock() - started, failed=True)
+                future.set_exception(e)
+            else:
+                self._record(name, started - queued_at, self.clock() - started)
+                future.set_result(result)
+
+    def _record(self, name, waited, ran, failed=False):
+        WAIT_SECONDS.observe(waited, command=name)
+        RUN_SECONDS.observe(ran, command=name)
+        with self._lock:
+            stats = self._stats.get(name)
+            if stats is None:
+                stats = self._stats[name] = {'count': 0, 'errors': 0, 'wait': deque(maxlen=LATENCY_SAMPLES),
+                                             'run': deque(maxlen=LATENCY_SAMPLES)}
+            stats['count'] += 1
+            stats['errors'] += failed
+            stats['wait'].append(waited)
+            stats['run'].append(ran)
+        print(f"Command {name} {'failed' if failed else 'done'} in {ran * 1000:.1f} ms "
+              f"(queued {waited * 1000:.1f} ms)")
+
+    def stats(self):
+        # Per command: count, errors and wait/run latency percentiles in ms
+        with self._lock:
+            result = {'pending': self.pending()}
+            for name, stats in self._stats.items():
+                result[name] = {'count': stats['count'], 'errors': stats['errors']}
+                for key in ('wait', 'run'):
+                    samples = sorted(stats[key])
+                    result[name][key + '_ms'] = {
+                        'p50': round(samples[len(samples) // 2] * 1000, 2),
+                        'p95': round(samples[int(len(samples) * 0.95)] * 1000, 2),
+                        'max': round(samples[-1] * 1000, 2),
+                    }
+            return result
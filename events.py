@@ -0,0 +1,206 @@
+import copy
+import itertools
+import json
+import threading
+import time
+from collections import deque
+
+# Per-user change feed for the dashboard's Server-Sent Events stream.
+#
+# The bus remembers the last published state of each section ('alarms',
+# 'hardware', 'voice') per user and only emits the keys that actually changed,
+# so the same change reported twice (by a route and again by the Firebase
+# listener) produces a single event. Recent events are kept in a small ring
+# buffer per user so a reconnecting client can resume from Last-Event-ID.
+# Event ids look like "<boot>-<n>": n counts per user, and the boot prefix lets a
+# client that reconnects to a restarted server get a fresh snapshot.
+#
+# A user's channel is dropped once nobody has streamed, waited on or published
+# to it for channel_ttl seconds, so memory follows the users active recently
+# rather than everyone who ever connected. A channel created again later numbers
+# its events past every id an evicted channel handed out, so an old
+# Last-Event-ID gets a fresh snapshot instead of skipping events or resuming
+# against state the new channel never saw.
+
+HEARTBEAT_SECONDS = 15
+BUFFER_SIZE = 256
+CHANNEL_TTL = 600
+SWEEP_SECONDS = 60
+
+
+class _Channel:
+    def __init__(self, buffer_size, first_id=1):
+        self.next_id = itertools.count(first_id)
+        self.base = first_id - 1  # newest id while no event has been published
+        self.events = deque(maxlen=buffer_size)
+        self.state = {}
+        self.primed = set()  # sections whose state came from a full snapshot
+        self.cond = threading.Condition()
+        self.holders = 0  # streams and waits in progress, guarded by EventBus._lock
+        self.touched = time.monotonic()
+
+    def newest(self):
+        return self.events[-1][0] if self.events else self.base
+
+
+class EventBus:
+    def __init__(self, buffer_size=BUFFER_SIZE, heartbeat=HEARTBEAT_SECONDS, channel_ttl=CHANNEL_TTL,
+                 sweep_interval=SWEEP_SECONDS):
+        self.buffer_size = buffer_size
+        self.heartbeat = heartbeat
+        self.channel_ttl = channel_ttl
+        self.sweep_interval = sweep_interval
+        self.boot = format(int(time.time() * 1000), 'x')
+        self._channels = {}
+        self._evicted_id = 0  # highest event id of any evicted channel
+        self._swept = time.monotonic()
+        self._lock = threading.Lock()
+
+    def _channel(self, user_id, hold=False):
+        # hold=True marks the channel in use until _release(), so it is never evicted under a stream
+        with self._lock:
+            now = time.monotonic()
+            if now - self._swept >= self.sweep_interval:
+                self._sweep(now)
+            channel = self._channels.get(user_id)
+            if channel is None:
+                # Start past base = _evicted_id + 1, so no id an evicted channel handed
+                # out can resume here: the client gets a snapshot of the new state
+                channel = self._channels[user_id] = _Channel(self.buffer_size, self._evicted_id + 2)
+            channel.touched = now
+            channel.holders += hold
+            return channel
+
+    def _release(self, channel):
+        with self._lock:
+            channel.holders -= 1
+            channel.touched = time.monotonic()
+
+    def _sweep(self, now):
+        # Caller holds self._lock
+        self._swept = now
+        for user_id, channel in list(self._channels.items()):
+            if not channel.holders and now - channel.touched > self.channel_ttl:
+                self._evicted_id = max(self._evicted_id, channel.newest())
+                del self._channels[user_id]
+
+    def channels(self):
+        with self._lock:
+            return len(self._channels)
+
+    def update_section(self, user_id, section, changes):
+        # changes: {key: new value or None when removed}
+        channel = self._channel(user_id)
+        with channel.cond:
+            current = channel.state.setdefault(section, {})
+            diff = {}
+            for key, value in changes.items():
+                if current.get(key) != value:
+                    diff[key] = copy.deepcopy(value)
+                    if value is None:
+                        current.pop(key, None)
+                    else:
+                        current[key] = copy.deepcopy(value)
+            if not diff:
+                return None
+            event_id = next(channel.next_id)
+            channel.events.append((event_id, section, {'changes': diff}))
+            channel.cond.notify_all()
+            return self.format_id(event_id)
+
+    def replace_section(self, user_id, section, data):
+        # Publish the difference between a full snapshot and what clients last saw
+        data = data or {}
+        channel = self._channel(user_id)
+        with channel.cond:
+            known = channel.state.get(section, {})
+            changes = {key: None for key in known if key not in data}
+            channel.primed.add(section)
+        changes.update(data)
+        return self.update_section(user_id, section, changes)
+
+    def is_primed(self, user_id, section):
+        channel = self._channel(user_id)
+        with channel.cond:
+            return section in channel.primed
+
+    def snapshot(self, user_id):
+        channel = self._channel(user_id)
+        with channel.cond:
+            return channel.newest(), copy.deepcopy(channel.state)
+
+    def last_id(self, user_id):
+        channel = self._channel(user_id)
+        with channel.cond:
+            return channel.newest()
+
+    def wait(self, user_id, cursor, timeout):
+        # Block until this user has an event newer than cursor or the timeout
+        # passes; returns the newest event number
+        channel = self._channel(user_id, hold=True)
+        deadline = time.monotonic() + timeout
+        try:
+            with channel.cond:
+                while True:
+                    newest = channel.newest()
+                    remaining = deadline - time.monotonic()
+                    if newest > cursor or remaining <= 0:
+                        return newest
+                    channel.cond.wait(remaining)
+        finally:
+            self._release(channel)
+
+    def format_id(self, number):
+        return f"{self.boot}-{number}"
+
+    def parse_id(self, event_id):
+        # Per-user event number, or None if the id is from another server run
+        boot, _, number = str(event_id or '').partition('-')
+        if boot != self.boot or not number.isdigit():
+            return None
+        return int(number)
+
+    def subscribe(self, user_id, last_event_id=None, stop=None, max_age=None):
+        # Yields SSE-formatted chunks: a snapshot (or the missed events when
+        # resuming), then each change as it happens, with comment heartbeats.
+        # Ends after max_age seconds if given; the browser reconnects with
+        # Last-Event-ID and resumes without losing events.
+        deadline = time.monotonic() + max_age if max_age else None
+        channel = self._channel(user_id, hold=True)
+        cursor = self.parse_id(last_event_id)
+        try:
+            with channel.cond:
+                newest = channel.newest()
+                oldest = channel.events[0][0] if channel.events else newest + 1
+            if cursor is None or cursor > newest or cursor < oldest - 1:
+                cursor, state = self.snapshot(user_id)
+                yield self.format_event(cursor, 'snapshot', state)
+
+            while stop is None or not stop.is_set():
+                timeout = self.heartbeat
+                if deadline is not None:
+                    timeout = min(timeout, deadline - time.monotonic())
+                    if timeout <= 0:
+                        return
+                with channel.cond:
+                    pending = [event for event in channel.events if event[0] > cursor]
+                    if not pending:
+                        channel.cond.wait(timeout)
+                        pending = [event for event in channel.events if event[0] > cursor]
+                if not pending:
+                    yield ': heartbeat\n\n'
+                    continue
+                if pending[0][0] > cursor + 1:
+                    # Fell behind the ring buffer; start over from a fresh snapshot
+                    cursor, state = self.snapshot(user_id)
+                    yield self.format_event(cursor, 'snapshot', state)
+                    continue
+                for event_id, section, data in pending:
+                    yield self.format_event(event_id, section, data)
+                    cursor = event_id
+        finally:
+            self._release(channel)
+
+    def format_event(self, number, event_type, data):
+        payload = json.dumps(data, separators=(',', ':'))
+        return f"id: {self.format_id(number)}\nevent: {event_type}\ndata: {payload}\n\n"
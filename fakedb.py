@@ -0,0 +1,234 @@
+import copy
+import itertools
+import random
+import string
+import threading
+import time
+
+# In-memory stand-in for firebase_admin.db. It implements the subset of the
+# Reference API the app uses (get/set/update/push/delete/child, ordered
+# equality queries, transactions and streaming listeners) so the app and its
+# helpers can run without network access.
+
+PUSH_CHARS = '-0123456789ABCDEFGHIJKLMNOPQRSTUVWXYZ_abcdefghijklmnopqrstuvwxyz'
+
+
+def _split(path):
+    return [part for part in str(path).split('/') if part]
+
+
+def _clean(value):
+    # Firebase drops empty containers and null leaves
+    if isinstance(value, dict):
+        cleaned = {str(k): _clean(v) for k, v in value.items()}
+        cleaned = {k: v for k, v in cleaned.items() if v is not None}
+        return cleaned or None
+    return value
+
+
+class Event:
+    # Mirrors firebase_admin.db.Event
+    def __init__(self, event_type, path, data):
+        self.event_type = event_type
+        self.path = path
+        self.data = data
+
+
+class ListenerRegistration:
+    def __init__(self, database, listener):
+        self._database = database
+        self._listener = listener
+
+    def close(self):
+        self._database._remove_listener(self._listener)
+
+
+class FakeDatabase:
+    def __init__(self, data=None):
+        self._data = _clean(copy.deepcopy(data)) if data else None
+        self._lock = threading.RLock()
+        self._listeners = []
+        self._push_counter = itertools.count()
+        self.reads = 0
+        self.writes = 0
+
+    def reference(self, path='/'):
+        return FakeReference(self, _split(path))
+
+    # Raw tree access -------------------------------------------------------
+
+    def _get(self, parts):
+        node = self._data
+        for part in parts:
+            if not isinstance(node, dict) or part not in node:
+                return None
+            node = node[part]
+        return node
+
+    def _set(self, parts, value):
+        value = _clean(copy.deepcopy(value))
+        if not parts:
+            self._data = value
+            return
+        if not isinstance(self._data, dict):
+            self._data = {}
+        node = self._data
+        trail = []
+        for part in parts[:-1]:
+            if not isinstance(node.get(part), dict):
+                node[part] = {}
+            trail.append((node, part))
+            node = node[part]
+        if value is None:
+            node.pop(parts[-1], None)
+        else:
+            node[parts[-1]] = value
+        # Prune parents that became empty
+        for parent, part in reversed(trail):
+            if parent[part]:
+                break
+            del parent[part]
+        if not self._data:
+            self._data = None
+
+    def _write(self, parts, value):
+        with self._lock:
+            self.writes += 1
+            self._set(parts, value)
+            pending = self._collect_put(parts)
+        self._deliver(pending)
+
+    def _update(self, parts, values):
+        with self._lock:
+            self.writes += 1
+            for key, value in values.items():
+                self._set(parts + _split(key), value)
+            pending = self._collect_patch(parts, values)
+        self._deliver(pending)
+
+    # Listeners -------------------------------------------------------------
+
+    def _add_listener(self, parts, callback):
+        listener = (tuple(parts), callback)
+        with self._lock:
+            self._listeners.append(listener)
+            initial = copy.deepcopy(self._get(parts))
+        callback(Event('put', '/', initial))
+        return ListenerRegistration(self, listener)
+
+    def _remove_listener(self, listener):
+        with self._lock:
+            if listener in self._listeners:
+                self._listeners.remove(listener)
+
+    def _collect_put(self, parts):
+        pending = []
+        for listen_parts, callback in self._listeners:
+            depth = len(listen_parts)
+            if tuple(parts[:depth]) == listen_parts:
+                relative = '/' + '/'.join(parts[depth:])
+                pending.append((callback, Event('put', relative, copy.deepcopy(self._get(parts)))))
+            elif tuple(listen_parts[:len(parts)]) == tuple(parts):
+                pending.append((callback, Event('put', '/', copy.deepcopy(self._get(list(listen_parts))))))
+        return pending
+
+    def _collect_patch(self, parts, values):
+        pending = []
+        for listen_parts, callback in self._listeners:
+            depth = len(listen_parts)
+            if tuple(parts[:depth]) == listen_parts:
+                relative = '/' + '/'.join(parts[depth:])
+                data = {key: copy.deepcopy(self._get(parts + _split(key))) for key in values}
+                pending.append((callback, Event('patch', relative, data)))
+            elif tuple(listen_parts[:len(parts)]) == tuple(parts):
+                pending.append((callback, Event('put', '/', copy.deepcopy(self._get(list(listen_parts))))))
+        return pending
+
+    def _deliver(self, pending):
+        for callback, event in pending:
+            callback(event)
+
+    def _push_key(self):
+        # Chronologically ordered keys, like Firebase push IDs
+        millis = int(time.time() * 1000)
+        prefix = ''
+        for _ in range(8):
+            prefix = PUSH_CHARS[millis % 64] + prefix
+            millis //= 64
+        suffix = ''.join(random.choice(string.ascii_letters) for _ in range(8))
+        return prefix + f'{next(self._push_counter):04d}' + suffix
+
+
+class FakeQuery:
+    def __init__(self, reference, child_key):
+        self._reference = reference
+        self._child_key = child_key
+        self._equal_to = None
+
+    def equal_to(self, value):
+        self._equal_to = value
+        return self
+
+    def get(self):
+        children = self._reference.get() or {}
+        return {
+            key: value for key, value in children.items()
+            if isinstance(value, dict) and value.get(self._child_key) == self._equal_to
+        }
+
+
+class FakeReference:
+    def __init__(self, database, parts):
+        self._database = database
+        self._parts = parts
+
+    @property
+    def key(self):
+        return self._parts[-1] if self._parts else None
+
+    @property
+    def path(self):
+        return '/' + '/'.join(self._parts)
+
+    @property
+    def parent(self):
+        return FakeReference(self._database, self._parts[:-1]) if self._parts else None
+
+    def child(self, path):
+        return FakeReference(self._database, self._parts + _split(path))
+
+    def get(self, shallow=False):
+        with self._database._lock:
+            self._database.reads += 1
+            value = copy.deepcopy(self._database._get(self._parts))
+        if shallow and isinstance(value, dict):
+            return {k: (True if isinstance(v, dict) else v) for k, v in value.items()}
+        return value
+
+    def set(self, value):
+        self._database._write(self._parts, value)
+
+    def update(self, value):
+        self._database._update(self._parts, value)
+
+    def delete(self):
+        self._database._write(self._parts, None)
+
+    def push(self, value=''):
+        ref = self.child(self._database._push_key())
+        if value:
+            ref.set(value)
+        return ref
+
+    def transaction(self, transaction_update):
+        with self._database._lock:
+            current = copy.deepcopy(self._database._get(self._parts))
+            new_value = transaction_update(current)
+            self._database._write(self._parts, new_value)
+        return new_value
+
+    def order_by_child(self, path):
+        return FakeQuery(self, path)
+
+    def listen(self, callback):
+        return self._database._add_listener(self._parts, callback)
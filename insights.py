@@ -0,0 +1,198 @@
+import copy
+from datetime import datetime, timezone
+
+# Running per-user sleep aggregates. A summary is a small JSON-friendly dict that
+# is updated once per recorded session, so the insights page reads one document
+# instead of re-scanning every session a user has ever recorded.
+
+RECENT_WINDOW = 30  # sessions kept verbatim for the chart and trends
+
+# Bumped whenever the stored shape or ordering changes; an older summary is
+# treated as dirty and rebuilt once from the full history.
+SUMMARY_VERSION = 2
+
+# (minimum minutes, quality score), checked in order
+QUALITY_LEVELS = [(420, 100), (360, 85), (300, 70), (240, 50)]
+LOWEST_QUALITY = 30
+
+
+def calculate_quality(duration):
+    for minimum, quality in QUALITY_LEVELS:
+        if duration >= minimum:
+            return quality
+    return LOWEST_QUALITY  # Less than 4 hours
+
+
+def session_duration(value):
+    return value.get('duration') if isinstance(value, dict) else value
+
+
+def session_start(key, value=None):
+    # Epoch seconds a session started at, or None for legacy keys like "s1".
+    # Newer sessions are keyed by their start time (epoch or ISO format), and a
+    # dict value may carry an explicit 'start'.
+    if isinstance(value, dict) and value.get('start') is not None:
+        try:
+            return float(value['start'])
+        except (TypeError, ValueError):
+            pass
+    key = str(key)
+    if key.isdigit():
+        return float(key)
+    try:
+        parsed = datetime.fromisoformat(key)
+    except ValueError:
+        return None
+    if parsed.tzinfo is None:
+        parsed = parsed.replace(tzinfo=timezone.utc)
+    return parsed.timestamp()
+
+
+def session_order(key, start):
+    # Sort key for sessions. Legacy counter keys ("s1", "s2", ... from the old
+    # firmware) carry no date and all predate dated sessions, so they come first
+    # in counter order ("s9" before "s10"); dated sessions follow by start time.
+    if start is not None:
+        return (1, float(start), str(key))
+    digits = ''.join(ch for ch in str(key) if ch.isdigit())
+    return (0, int(digits) if digits else 0, str(key))
+
+
+def empty_summary():
+    return {
+        'count': 0,
+        'skipped': 0,  # sessions stored without a usable duration
+        'total_minutes': 0,
+        'min_minutes': None,
+        'max_minutes': None,
+        'quality_sum': 0,
+        'quality_histogram': {str(q): 0 for q in [q for _, q in QUALITY_LEVELS] + [LOWEST_QUALITY]},
+        'recent': [],  # [[key, duration, start], ...] in session_order
+        'last_key': None,
+        'last_start': None,
+        'dirty': False,
+        'version': SUMMARY_VERSION,
+    }
+
+
+def normalize_summary(summary):
+    # Firebase drops null and empty values, so fill in anything missing
+    normalized = empty_summary()
+    if summary:
+        summary = copy.deepcopy(summary)
+        normalized['quality_histogram'].update(summary.pop('quality_histogram', None) or {})
+        normalized['version'] = None
+        normalized.update({k: v for k, v in summary.items() if v is not None})
+        # A null start is dropped from Firebase arrays too; derive it from the key
+        normalized['recent'] = [list(item[:2]) + [item[2] if len(item) > 2 else session_start(item[0])]
+                                for item in normalized['recent'] or []]
+        if normalized['version'] != SUMMARY_VERSION:
+            # Written before sessions were ordered by start: rebuild on next read
+            normalized['dirty'] = True
+            normalized['version'] = SUMMARY_VERSION
+    return normalized
+
+
+def apply_session(summary, key, duration, start=None):
+    # Returns the summary updated with one session. Re-recording a key that is
+    # still in the recent window replaces it; anything the running totals cannot
+    # undo (an older session, or replacing the current min/max) marks it dirty so
+    # the next read rebuilds it from the full history.
+    summary = normalize_summary(summary)
+    if duration is None:
+        summary['skipped'] += 1
+        return summary
+    if start is None:
+        start = session_start(key)
+    order = session_order(key, start)
+    last = summary['last_key']
+    last_order = session_order(last, summary['last_start']) if last is not None else None
+    recent = summary['recent']
+    previous = next((item for item in recent if item[0] == key), None)
+
+    if previous is not None:
+        old = previous[1]
+        if old in (summary['min_minutes'], summary['max_minutes']):
+            summary['dirty'] = True
+        summary['count'] -= 1
+        summary['total_minutes'] -= old
+        summary['quality_sum'] -= calculate_quality(old)
+        summary['quality_histogram'][str(calculate_quality(old))] -= 1
+        recent.remove(previous)
+    elif last_order is not None and order <= last_order:
+        summary['dirty'] = True
+
+    quality = calculate_quality(duration)
+    summary['count'] += 1
+    summary['total_minutes'] += duration
+    summary['quality_sum'] += quality
+    summary['quality_histogram'][str(quality)] += 1
+    if summary['min_minutes'] is None or duration < summary['min_minutes']:
+        summary['min_minutes'] = duration
+    if summary['max_minutes'] is None or duration > summary['max_minutes']:
+        summary['max_minutes'] = duration
+
+    recent.append([key, duration, start])
+    recent.sort(key=lambda item: session_order(item[0], item[2]))
+    del recent[:-RECENT_WINDOW]
+    if last_order is None or order > last_order:
+        summary['last_key'], summary['last_start'] = key, start
+    return summary
+
+
+def build_summary(sessions):
+    # Full rebuild, used for backfilling users recorded before aggregation existed
+    summary = empty_summary()
+    dated = [(key, value, session_start(key, value)) for key, value in (sessions or {}).items()]
+    for key, value, start in sorted(dated, key=lambda item: session_order(item[0], item[2])):
+        summary = apply_session(summary, key, session_duration(value), start)
+    summary['dirty'] = False
+    return summary
+
+
+def is_current(summary, session_count):
+    # Whether a stored summary still accounts for every stored session. The
+    # pillow firmware writes sessions straight to the database without
+    # updating the summary, so a count that moved means it must be rebuilt.
+    return (summary is not None and not summary.get('dirty') and summary.get('version') == SUMMARY_VERSION
+            and (summary.get('count') or 0) + (summary.get('skipped') or 0) == session_count)
+
+
+def format_minutes(mins):
+    return f"{int(mins // 60)}h {int(mins % 60)}m"
+
+
+def session_label(key, start, tz=None):
+    # Chart label: the local date a session started, or the raw key for legacy
+    # sessions that carry no date
+    if start is None:
+        return str(key)
+    return datetime.fromtimestamp(start, tz or timezone.utc).strftime('%Y-%m-%d')
+
+
+def render_summary(summary, tz=None):
+    # Shape the stored aggregate for insights.html
+    daily_data = [
+        {'date': session_label(key, start, tz), 'duration': duration, 'quality': calculate_quality(duration)}
+        for key, duration, start in summary['recent']
+    ]
+    count = summary['count']
+    view = {
+        'average_duration': format_minutes(summary['total_minutes'] / count),
+        'max_duration': format_minutes(summary['max_minutes']),
+        'min_duration': format_minutes(summary['min_minutes']),
+        'total_sessions': count,
+        'total_sleep': format_minutes(summary['total_minutes']),
+        'average_quality': round(summary['quality_sum'] / count, 1),
+        'quality_histogram': summary['quality_histogram'],
+        'daily_data': daily_data,
+    }
+
+    def get_change(arr):
+        return round(arr[-1] - arr[-2], 1) if len(arr) >= 2 else 0
+
+    trends = {
+        'duration_change': get_change([day['duration'] for day in daily_data]),
+        'quality_change': get_change([day['quality'] for day in daily_data]),
+    }
+    return view, daily_data, trends
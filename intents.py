@@ -0,0 +1,247 @@
+import re
+from datetime import timedelta
+
+# Single-pass intent parser for voice commands.
+#
+# One precompiled pattern tokenises the transcript into intent phrases and slot
+# values (clock times, relative offsets, day words, weekdays, numbers), and a
+# single walk over those tokens fills in the result. Times can be digits
+# ("7:30", "7 30", "0730 hours"), words ("seven thirty", "seven oh five") or
+# relative to the hour ("ten past seven", "quarter to eight"). parse() returns
+# a dict:
+#
+#   {'intent': 'set_alarm', 'time': '07:30:00', 'relative_minutes': None,
+#    'day': 'tomorrow', 'index': None, 'repeat': [0, 2, 4]}
+#
+# intent is one of set_alarm, cancel_alarm, list_alarms, help, stop_listening
+# or None. repeat holds weekday numbers (Monday is 0) for repeating requests
+# ("every monday", "on weekdays"); day is 'today', 'tomorrow' or a weekday name
+# for a single day ("on monday" is the coming Monday only).
+
+NUMBER_WORDS = {
+    'a': 1, 'an': 1, 'one': 1, 'two': 2, 'three': 3, 'four': 4, 'five': 5, 'six': 6,
+    'seven': 7, 'eight': 8, 'nine': 9, 'ten': 10, 'eleven': 11, 'twelve': 12,
+    'fifteen': 15, 'twenty': 20, 'thirty': 30, 'forty five': 45, 'forty': 40,
+    'fifty': 50, 'half an': 30,
+}
+ORDINALS = {'first': 1, 'second': 2, 'third': 3, 'fourth': 4, 'fifth': 5,
+            'sixth': 6, 'seventh': 7, 'eighth': 8, 'ninth': 9, 'tenth': 10, 'last': -1}
+HOUR_WORDS = {word: number for number, word in enumerate(
+    ['one', 'two', 'three', 'four', 'five', 'six', 'seven', 'eight', 'nine', 'ten', 'eleven', 'twelve'], 1)}
+_UNITS = ['one', 'two', 'three', 'four', 'five', 'six', 'seven', 'eight', 'nine']
+_TEENS = ['ten', 'eleven', 'twelve', 'thirteen', 'fourteen', 'fifteen', 'sixteen', 'seventeen',
+          'eighteen', 'nineteen']
+_TENS = {'twenty': 20, 'thirty': 30, 'forty': 40, 'fifty': 50}
+# Spoken minutes from 1 to 59: "oh five", "ten", "twenty five", ...
+MINUTE_WORDS = dict(
+    [(f'oh {unit}', n) for n, unit in enumerate(_UNITS, 1)]
+    + [(teen, n) for n, teen in enumerate(_TEENS, 10)]
+    + list(_TENS.items())
+    + [(f'{ten} {unit}', value + n) for ten, value in _TENS.items() for n, unit in enumerate(_UNITS, 1)])
+WEEKDAYS = ['monday', 'tuesday', 'wednesday', 'thursday', 'friday', 'saturday', 'sunday']
+DAY_GROUPS = {
+    'day': list(range(7)), 'daily': list(range(7)), 'night': list(range(7)),
+    'weekday': [0, 1, 2, 3, 4], 'weekend': [5, 6],
+}
+
+_number = r'\d+|' + '|'.join(sorted((re.escape(w) for w in NUMBER_WORDS), key=len, reverse=True))
+_ordinal = '|'.join(ORDINALS) + r'|\d+(?:st|nd|rd|th)'
+_weekday = '|'.join(day[:-3] + '(?:day)?' for day in WEEKDAYS)  # "mon", "monday", ...
+_hour_word = '|'.join(sorted(HOUR_WORDS, key=len, reverse=True))
+_units = '|'.join(_UNITS)
+_minute_word = (r'oh[\s-]+(?:' + _units + r')|' + '|'.join(_TEENS) + '|(?:' + '|'.join(_TENS)
+                + r')(?:[\s-]+(?:' + _units + r'))?')  # every key of MINUTE_WORDS
+_not_duration = r'(?!\s*(?:minutes?|mins?|hours?|hrs?)\b)'  # "for ten minutes" is not a time
+
+
+def _ampm(name):
+    return r'(?:\s*(?P<' + name + r'>[ap])\.?\s?m\b\.?)?'
+
+
+TOKEN_PATTERN = re.compile(r"""
+      (?P<set>\b(?:set|create|add|make|schedule)\s+(?:up\s+)?(?:the\s+|an\s+|a\s+|my\s+|new\s+)*alarms?\b
+          |\bwake\s+me(?:\s+up)?\b)
+    | (?P<cancel>\b(?:cancel|delete|remove|turn\s+off)\s+(?:the\s+|my\s+)?(?:(?P<cancel_ord>""" + _ordinal + r""")\s+)?alarms?\b)
+    | (?P<list>\b(?:list|show|read|what\s+are)\s+(?:me\s+)?(?:all\s+)?(?:my\s+|the\s+)?alarms\b)
+    | (?P<stop_listening>\bstop\s+listening\b|\bgo\s+to\s+sleep\b|\bnever\s*mind\b)
+    | (?P<help>\bhelp\b)
+    | (?P<relative>\b(?:in\s+|(?:for\s+)?(?=(?:""" + _number + r""")\s*(?:minutes?|mins?|hours?|hrs?)\b[\w\s]*?\bfrom\s+now\b))
+          (?P<rel_n>""" + _number + r""")\s*(?P<rel_unit>minutes?|mins?|hours?|hrs?)
+          (?:\s+and\s+(?:a\s+)?(?P<rel_half>half)|\s+and\s+(?P<rel_m>\d+)\s*(?:minutes?|mins?))?(?:\s+from\s+now)?\b)
+    | (?P<past>\b(?:(?:at|for)\s+)?(?:a\s+)?(?P<past_m>quarter|half|[0-5]?\d|""" + _minute_word + r""")(?:\s+minutes?)?
+          \s+(?P<past_dir>past|after|to|till|before)\s+(?P<past_h>1[0-2]|0?[1-9]|""" + _hour_word + r""")\b""" + _ampm('past_ampm') + r""")
+    | (?P<spaced>\b(?:at|for)\s+(?P<hsp>[01]?\d|2[0-3])\s+(?P<msp>[0-5]\d)\b""" + _not_duration + _ampm('sp_ampm') + r""")
+    | (?P<worded>\b(?P<w_at>(?:at|for)\s+)?(?P<hw>""" + _hour_word + r""")\b(?:[\s-]+(?P<mw>""" + _minute_word + r""")\b)?
+          (?P<w_oclock>\s+o'?\s?clock\b)?""" + _not_duration + _ampm('w_ampm') + r""")
+    | (?P<clock12>\b(?P<h12>1[0-2]|0?[1-9])(?:(?:[:.]\s?|\s)(?P<m12>[0-5]\d))?\s*(?P<ampm>[ap])\.?\s?m\b\.?)
+    | (?P<clock24>\b(?P<h24>[01]?\d|2[0-3])[:.h](?P<m24>[0-5]\d)\b(?:\s*hours)?)
+    | (?P<oclock>\b(?P<hoc>1[0-2]|0?[1-9])\s+o'?\s?clock\b)
+    | (?P<hours24>\b(?P<hh>[01]?\d|2[0-3])\s+hundred(?:\s+hours)?\b|\b(?P<hh2>1[3-9]|2[0-3])\s+hours\b)
+    | (?P<military>\b(?P<hmil>[01]\d|2[0-3])(?P<mmil>[0-5]\d)\s+hours\b)
+    | (?P<named>\b(?:noon|midday|midnight)\b)
+    | (?P<at_bare>\b(?:at|for)\s+(?P<hbare>1[0-9]|2[0-3]|0?[0-9])\b(?!(?:[:.]\s?|h)?\d|\s*(?:[ap]\.?\s?m\b|o'?\s?clock|hundred|minutes?|mins?|hours?|days?|%)))
+    | (?P<day>\b(?:today|tonight|tomorrow)\b)
+    | (?P<every>\b(?:every|each)\b)
+    | (?P<daily>\b(?:daily|weekdays|weekends)\b)
+    | (?P<weekday>\b(?:""" + _weekday + r""")s?\b)
+    | (?P<group>\b(?:day|night|weekday|weekend)s?\b)
+    | (?P<ordinal>\b(?:""" + _ordinal + r""")\b)
+    | (?P<index>(?:\bnumber|\bno\.|\bid|\#)\s*(?P<idx>\d+|""" + _hour_word + r""")\b)
+    | (?P<number>\b\d+\b)
+""", re.IGNORECASE | re.VERBOSE)
+
+INTENT_GROUPS = ('set', 'cancel', 'list', 'stop_listening', 'help')
+INTENT_NAMES = {'set': 'set_alarm', 'cancel': 'cancel_alarm', 'list': 'list_alarms',
+                'stop_listening': 'stop_listening', 'help': 'help'}
+
+
+def _number_value(text):
+    text = text.lower()
+    return int(text) if text.isdigit() else NUMBER_WORDS[re.sub(r'\s+', ' ', text)]
+
+
+def _ordinal_value(text):
+    text = text.lower()
+    return ORDINALS[text] if text in ORDINALS else int(text[:-2])
+
+
+def _weekday_number(text):
+    text = text.lower().rstrip('s')
+    for number, day in enumerate(WEEKDAYS):
+        if text.startswith(day[:3]):
+            return number
+    return None
+
+
+def _minute_value(text):
+    text = re.sub(r'[\s-]+', ' ', text.lower())
+    if text.isdigit():
+        return int(text)
+    return {'quarter': 15, 'half': 30}.get(text) or MINUTE_WORDS[text]
+
+
+def _clock(hour, minute, ampm=None):
+    if ampm:
+        hour = hour % 12 + (12 if ampm.lower() == 'p' else 0)
+    return f"{hour:02d}:{minute:02d}:00"
+
+
+def parse(transcript):
+    result = {'intent': None, 'time': None, 'relative_minutes': None, 'day': None,
+              'index': None, 'repeat': None}
+    repeat = set()
+    repeat_marker = False
+    pending_number = None
+    cancel_end = None  # where "cancel ... alarm" ended, for "cancel alarm two"
+
+    for match in TOKEN_PATTERN.finditer(transcript or ''):
+        # The outer group of each alternative closes last, so lastgroup names it
+        kind = match.lastgroup
+        groups = match.groupdict()
+
+        if kind in INTENT_GROUPS:
+            if result['intent'] is None:
+                result['intent'] = INTENT_NAMES[kind]
+            if kind == 'cancel':
+                cancel_end = match.end()
+                if groups['cancel_ord']:
+                    result['index'] = _ordinal_value(groups['cancel_ord'])
+        elif kind == 'relative':
+            minutes = _number_value(groups['rel_n'])
+            if groups['rel_unit'].lower().startswith('h'):
+                minutes *= 60
+                if groups['rel_half']:
+                    minutes += 30
+            if groups['rel_m']:
+                minutes += int(groups['rel_m'])
+            result['relative_minutes'] = minutes
+        elif kind == 'past':
+            minutes = _minute_value(groups['past_m'])
+            hour_text = groups['past_h'].lower()
+            hour = HOUR_WORDS[hour_text] if hour_text in HOUR_WORDS else int(hour_text)
+            if groups['past_dir'].lower() in ('to', 'till', 'before'):
+                # "quarter to eight" is 7:45, "ten to one" is 12:50
+                hour, minutes = (hour - 2) % 12 + 1, 60 - minutes
+            if 0 < minutes < 60:
+                result['time'] = _clock(hour, minutes, groups['past_ampm'])
+        elif kind == 'spaced':
+            result['time'] = _clock(int(groups['hsp']), int(groups['msp']), groups['sp_ampm'])
+        elif kind == 'worded':
+            # A lone hour word is a time only after "at"/"for" or with minutes,
+            # o'clock or am/pm; right after "cancel alarm" it is the alarm's number
+            if groups['w_at'] or groups['mw'] or groups['w_oclock'] or groups['w_ampm']:
+                minutes = _minute_value(groups['mw']) if groups['mw'] else 0
+                result['time'] = _clock(HOUR_WORDS[groups['hw'].lower()], minutes, groups['w_ampm'])
+            elif (cancel_end is not None and result['index'] is None
+                  and not transcript[cancel_end:match.start()].strip()):
+                result['index'] = HOUR_WORDS[groups['hw'].lower()]
+        elif kind == 'clock12':
+            hour = int(groups['h12']) % 12
+            if groups['ampm'].lower() == 'p':
+                hour += 12
+            result['time'] = f"{hour:02d}:{groups['m12'] or '00'}:00"
+        elif kind == 'clock24':
+            result['time'] = f"{int(groups['h24']):02d}:{groups['m24']}:00"
+        elif kind == 'oclock':
+            result['time'] = f"{int(groups['hoc']):02d}:00:00"
+        elif kind == 'military':
+            result['time'] = f"{groups['hmil']}:{groups['mmil']}:00"
+        elif kind == 'hours24':
+            result['time'] = f"{int(groups['hh'] or groups['hh2']):02d}:00:00"
+        elif kind == 'named':
+            result['time'] = '00:00:00' if match.group().lower() == 'midnight' else '12:00:00'
+        elif kind == 'at_bare':
+            if result['time'] is None:
+                result['time'] = f"{int(groups['hbare']):02d}:00:00"
+        elif kind == 'day':
+            result['day'] = 'tomorrow' if match.group().lower() == 'tomorrow' else 'today'
+        elif kind == 'every':
+            repeat_marker = True
+        elif kind == 'daily':
+            word = match.group().lower()
+            repeat.update(DAY_GROUPS['day' if word == 'daily' else word.rstrip('s')])
+        elif kind == 'weekday':
+            repeat.add(_weekday_number(match.group()))
+            repeat_marker = repeat_marker or match.group().lower().endswith('s')
+        elif kind == 'group':
+            if repeat_marker:
+                repeat.update(DAY_GROUPS[match.group().lower().rstrip('s')])
+        elif kind == 'ordinal':
+            result['index'] = _ordinal_value(match.group())
+        elif kind == 'index':
+            index = groups['idx'].lower()
+            result['index'] = HOUR_WORDS[index] if index in HOUR_WORDS else int(index)
+        elif kind == 'number':
+            pending_number = int(match.group())
+
+    if result['intent'] == 'cancel_alarm' and result['index'] is None and pending_number is not None:
+        result['index'] = pending_number
+    if repeat and (repeat_marker or len(repeat) > 1):
+        result['repeat'] = sorted(repeat)
+    elif len(repeat) == 1 and result['day'] is None:
+        result['day'] = WEEKDAYS[min(repeat)]
+    return result
+
+
+def resolve_date(parsed, now):
+    # Local date a one-shot set_alarm command is for ("tomorrow", "on monday",
+    # "in 20 minutes"), or None if it names no day. now is the local datetime.
+    if parsed['relative_minutes'] is not None:
+        return (now + timedelta(minutes=parsed['relative_minutes'])).date()
+    if parsed['day'] is None:
+        return None
+    if parsed['day'] == 'today':
+        return now.date()
+    if parsed['day'] == 'tomorrow':
+        return now.date() + timedelta(days=1)
+    ahead = (WEEKDAYS.index(parsed['day']) - now.weekday()) % 7
+    if ahead == 0 and parsed['time'] and parsed['time'] <= now.strftime("%H:%M:%S"):
+        ahead = 7  # "on monday" said on a Monday after that time means next week
+    return now.date() + timedelta(days=ahead)
+
+
+def resolve_time(parsed, now):
+    # Absolute "HH:MM:SS" for a parsed set_alarm command given the local time now
+    if parsed['relative_minutes'] is not None:
+        return (now + timedelta(minutes=parsed['relative_minutes'])).strftime("%H:%M:%S")
+    return parsed['time']
@@ -0,0 +1,135 @@
+import threading
+
+import wallclock
+from alarm_engine import AlarmEngine
+
+# Owns the vibration motor of every pillow.
+#
+# A command is a pattern of (value, seconds) steps, by default one step of
+# (1, duration); the motor is switched off when the pattern ends. Per pillow:
+#   - overlapping commands coalesce: a command that would end no later than
+#     the one already running is absorbed, a longer one replaces it;
+#   - the current value is remembered and a step that would write the same
+#     value again is skipped. Other processes may drive the same motor, so
+#     their writes must be fed back through observe(), and stop() always
+#     writes;
+#   - there is at most one pending timer, the end of the current step.
+# All pillows share one AlarmEngine heap and thread for those timers, so a
+# thousand alarms going off together cost a thousand heap entries, not a
+# thousand scheduler jobs.
+
+DEFAULT_DURATION = 10.0
+RETRY_SECONDS = 5.0
+TIMER_KEY = 'motor'
+
+
+class _Pillow:
+    def __init__(self):
+        self.value = None   # last value written, None until the first write
+        self.steps = []     # pattern steps still to run after the current one
+        self.until = None   # end of the current step, None when idle
+        self.lock = threading.Lock()
+
+
+class MotorController:
+    def __init__(self, write, clock=wallclock.now, default_duration=DEFAULT_DURATION):
+        # write(user_id, value) performs the actual database write
+        self.write = write
+        self.clock = clock
+        self.default_duration = default_duration
+        self._pillows = {}
+        self._lock = threading.Lock()
+        self._timers = AlarmEngine(self._on_timer, on_missed=self._on_timer, clock=clock,
+                                   catch_up_window=float('inf'))
+        self.writes = 0
+        self.skipped = 0
+        self.coalesced = 0
+
+    def _pillow(self, user_id):
+        with self._lock:
+            pillow = self._pillows.get(user_id)
+            if pillow is None:
+                pillow = self._pillows[user_id] = _Pillow()
+            return pillow
+
+    def start(self, user_id, duration=None, pattern=None):
+        # Run a pattern [(value, seconds), ...] or simply vibrate for duration seconds
+        steps = list(pattern or [(1, duration or self.default_duration)])
+        pillow = self._pillow(user_id)
+        with pillow.lock:
+            now = self.clock()
+            ends = now + sum(seconds for _, seconds in steps)
+            if pillow.until is not None:
+                self.coalesced += 1
+                running_end = pillow.until + sum(seconds for _, seconds in pillow.steps)
+                if running_end >= ends:
+                    return False
+            value, seconds = steps[0]
+            pillow.steps = steps[1:]
+            pillow.until = now + seconds
+            # Arm the timer first so the motor still gets switched off if this write fails
+            self._timers.schedule(user_id, TIMER_KEY, pillow.until)
+            self._set(user_id, pillow, value)
+            return True
+
+    def stop(self, user_id):
+        pillow = self._pillow(user_id)
+        with pillow.lock:
+            pillow.steps = []
+            pillow.until = None
+            self._timers.cancel(user_id, TIMER_KEY)
+            # Another process may have turned the motor on since our last write
+            self._set(user_id, pillow, 0, force=True)
+
+    def observe(self, user_id, value):
+        # Record a value read back from the device/database or written by
+        # another process, so the next identical write is skipped and a
+        # different one is not
+        pillow = self._pillow(user_id)
+        with pillow.lock:
+            if pillow.until is None:
+                pillow.value = value
+
+    def is_running(self, user_id):
+        pillow = self._pillow(user_id)
+        with pillow.lock:
+            return pillow.until is not None
+
+    def _set(self, user_id, pillow, value, force=False):
+        # Caller holds pillow.lock, which keeps writes for one pillow in order
+        if pillow.value == value and not force:
+            self.skipped += 1
+            return
+        self.write(user_id, value)
+        pillow.value = value
+        self.writes += 1
+
+    def _on_timer(self, user_id, key, deadline, lag):
+        pillow = self._pillow(user_id)
+        with pillow.lock:
+            if pillow.until is None or pillow.until > deadline:
+                return  # superseded by a newer command
+            if pillow.steps:
+                value, seconds = pillow.steps.pop(0)
+                pillow.until = deadline + seconds
+                self._timers.schedule(user_id, TIMER_KEY, pillow.until)
+                self._set(user_id, pillow, value)
+                return
+            try:
+                self._set(user_id, pillow, 0)
+            except Exception:
+                # Never leave a motor running: try switching it off again shortly
+                pillow.until = self.clock() + RETRY_SECONDS
+                self._timers.schedule(user_id, TIMER_KEY, pillow.until)
+                raise
+            pillow.until = None
+
+    def start_timers(self):
+        self._timers.start(name='motor-timers')
+
+    def close(self):
+        self._timers.stop()
+
+    def stats(self):
+        return {'writes': self.writes, 'skipped': self.skipped, 'coalesced': self.coalesced,
+                'running': self._timers.pending()}
@@ -0,0 +1,407 @@
+import calendar
+import json
+import mmap
+import os
+import re
+import sys
+import threading
+from array import array
+from contextlib import contextmanager
+from datetime import date, datetime, time, timedelta
+
+import recurrence
+
+try:
+    import fcntl
+except ImportError:  # not POSIX: only one process may write a user's files
+    fcntl = None
+
+# Raw force-sensor samples from the pillows, kept as fixed-width time series.
+#
+# Each user gets one directory, and each night one pair of files:
+#   <root>/<user>/<night>.raw  uint16 per sample slot (sample_rate per second)
+#   <root>/<user>/<night>.min  uint16 (min, max, mean, samples) per minute
+# A night runs from noon to noon in the user's timezone so one sleep never
+# straddles two files; across a DST change it is 23 or 25 hours long. Slots are
+# addressed by time, so a range read is one slice of a memory-mapped file, and
+# gaps hold MISSING. At 2 Hz a full night is at most 360 KB raw plus 12 KB of
+# minutes, whatever the reading pattern.
+#
+# The epoch slot 0 of each night stands for is recorded in <root>/<user>/nights.json
+# when the night is first written, so files stay readable after the user changes
+# timezone. Nights written before that index existed opened at noon UTC+1.
+#
+# Files are little-endian. Appends are buffered per night and written out
+# every flush_samples samples, on flush() and on close().
+#
+# Writes to a user's files hold an flock on <root>/<user>/.lock, so the .min
+# read-modify-write stays correct when several processes flush the same user.
+# Buffered samples are only visible to the process holding them until they are
+# flushed, so one worker should own ingestion (see the README).
+#
+# Each user's directory also holds state.json, small JSON state updated under
+# the same lock (the pillow's session detector).
+#
+# User ids become directory names, so anything but [A-Za-z0-9_-] is refused
+# with ValueError before it gets near the filesystem.
+
+MISSING = 0xFFFF
+SAMPLE_RATE = 2.0
+MAX_NIGHT_SECONDS = 25 * 3600  # the night the clocks go back
+NIGHT_START_HOUR = 12
+LEGACY_UTC_OFFSET = 3600
+FLUSH_SAMPLES = 120
+
+_SWAP = sys.byteorder != 'little'
+USER_ID = re.compile(r'[A-Za-z0-9_-]+')
+
+
+def is_valid_user_id(user_id):
+    return isinstance(user_id, str) and USER_ID.fullmatch(user_id) is not None
+
+
+class _Night:
+    # Pending writes for one night file: {slot: value} and {minute: [min, max, sum, count]}
+    def __init__(self):
+        self.samples = {}
+        self.minutes = {}
+
+
+class PressureStore:
+    def __init__(self, root='instance/pressure', sample_rate=SAMPLE_RATE, timezone=None,
+                 flush_samples=FLUSH_SAMPLES):
+        # timezone is the pytz zone for calls that don't pass the user's own
+        self.root = root
+        self.sample_rate = sample_rate
+        self.timezone = timezone or recurrence.timezone()
+        self.flush_samples = flush_samples
+        self._pending = {}  # (user_id, night) -> _Night
+        self._bases = {}  # user_id -> {night: epoch of slot 0}, from nights.json
+        self._user_locks = {}  # user_id -> threading.Lock, taken before the flock
+        self._lock = threading.Lock()  # _pending and _user_locks only, never held for I/O
+
+    # Layout ----------------------------------------------------------------
+
+    @staticmethod
+    def _noon(day, tz):
+        return recurrence.localize(tz, datetime.combine(day, time(NIGHT_START_HOUR))).timestamp()
+
+    def _local_night(self, timestamp, tz):
+        # (day the night containing timestamp starts on, its opening and closing noon) in tz
+        local = datetime.fromtimestamp(timestamp, tz)
+        day = local.date() - timedelta(days=1 if local.hour < NIGHT_START_HOUR else 0)
+        return day, self._noon(day, tz), self._noon(day + timedelta(days=1), tz)
+
+    def night_key(self, timestamp, tz=None):
+        return self._local_night(timestamp, tz or self.timezone)[0].isoformat()
+
+    def night_range(self, user_id, night, tz=None):
+        # [start, end) epoch seconds covered by the night "YYYY-MM-DD"
+        day = date.fromisoformat(night)
+        tz = tz or self.timezone
+        start = self._night_base(user_id, day, tz)
+        return start, min(self._night_base(user_id, day + timedelta(days=1), tz), start + MAX_NIGHT_SECONDS)
+
+    def _load_bases(self, folder):
+        try:
+            with open(os.path.join(folder, 'nights.json')) as f:
+                return json.load(f)
+        except (FileNotFoundError, ValueError):
+            return {}
+
+    def _recorded_base(self, user_id, day):
+        # Epoch of slot 0 for a night already on disk, else None
+        night = day.isoformat()
+        bases = self._bases.setdefault(user_id, {})
+        if night not in bases:
+            # Another process may have started the night since we last looked
+            bases.update(self._load_bases(self._folder(user_id)))
+            if night not in bases and os.path.exists(self._path(user_id, night, 'raw')):
+                bases[night] = (calendar.timegm(day.timetuple()) + NIGHT_START_HOUR * 3600
+                                - LEGACY_UTC_OFFSET)
+        return bases.get(night)
+
+    def _record_base(self, user_id, day, base):
+        # Make base the night's slot 0 unless another writer got there first; returns the winner
+        night = day.isoformat()
+        with self._user_lock(user_id) as folder:
+            bases = self._load_bases(folder)
+            if night not in bases:
+                bases[night] = self._recorded_base(user_id, day) or base
+                path = os.path.join(folder, 'nights.json')
+                with open(path + '.tmp', 'w') as f:
+                    json.dump(bases, f)
+                os.replace(path + '.tmp', path)
+        self._bases.setdefault(user_id, {}).update(bases)
+        return bases[night]
+
+    def _night_base(self, user_id, day, tz):
+        base = self._recorded_base(user_id, day)
+        return self._noon(day, tz) if base is None else base
+
+    def _place(self, user_id, timestamp, tz):
+        # (night key, epoch of its slot 0) for the file timestamp is written to.
+        # Normally the night it falls in locally; right after a timezone change
+        # that night may already be recorded with other bounds, in which case a
+        # neighbouring night that covers timestamp takes it. None if none does.
+        day, noon, _ = self._local_night(timestamp, tz)
+        for candidate in (day, day - timedelta(days=1), day + timedelta(days=1)):
+            base = self._recorded_base(user_id, candidate)
+            if base is None and candidate == day:
+                base = self._record_base(user_id, day, noon)
+            if base is not None and 0 <= timestamp - base < MAX_NIGHT_SECONDS:
+                return candidate.isoformat(), base
+        return None
+
+    def _folder(self, user_id):
+        if not is_valid_user_id(user_id):
+            raise ValueError(f"Invalid user id: {user_id!r}")
+        root = os.path.realpath(self.root)
+        folder = os.path.realpath(os.path.join(root, user_id))
+        # A symlinked user directory must not lead out of root either
+        if os.path.dirname(folder) != root:
+            raise ValueError(f"Invalid user id: {user_id!r}")
+        return folder
+
+    def _path(self, user_id, night, kind):
+        return os.path.join(self._folder(user_id), f'{night}.{kind}')
+
+    @contextmanager
+    def _user_lock(self, user_id):
+        # Exclusive per-user lock across processes and threads; yields the folder
+        folder = self._folder(user_id)
+        os.makedirs(folder, exist_ok=True)
+        with self._lock:
+            thread_lock = self._user_locks.setdefault(user_id, threading.Lock())
+        with thread_lock, open(os.path.join(folder, '.lock'), 'a+b') as f:
+            if fcntl is not None:
+                fcntl.flock(f, fcntl.LOCK_EX)
+            try:
+                yield folder
+            finally:
+                if fcntl is not None:
+                    fcntl.flock(f, fcntl.LOCK_UN)
+
+    def update_state(self, user_id, fn, default=None):
+        # new = fn(current or default) for the user's state.json, atomically
+        # with respect to other processes; returns new
+        with self._user_lock(user_id) as folder:
+            path = os.path.join(folder, 'state.json')
+            try:
+                with open(path) as f:
+                    current = json.load(f)
+            except (FileNotFoundError, ValueError):
+                current = None
+            value = fn(default if current is None else current)
+            with open(path + '.tmp', 'w') as f:
+                json.dump(value, f)
+            os.replace(path + '.tmp', path)
+        return value
+
+    def nights(self, user_id):
+        folder = self._folder(user_id)
+        if not os.path.isdir(folder):
+            return []
+        return sorted(name[:-4] for name in os.listdir(folder) if name.endswith('.raw'))
+
+    # Writes ------------------------------------------------------------------
+
+    def append(self, user_id, start, values, interval=None, tz=None):
+        # values are raw readings, the first taken at epoch start and the rest
+        # every interval seconds (default 1 / sample_rate); tz is the user's zone
+        interval = interval or 1.0 / self.sample_rate
+        tz = tz or self.timezone
+        self._folder(user_id)
+        full = []
+        # Place every sample first: a new night is recorded on disk, which must
+        # not happen while other pillows wait for self._lock
+        samples = []
+        window = None  # (from, to, night, base) while consecutive samples share a night
+        for n, value in enumerate(values):
+            timestamp = start + n * interval
+            if window is None or not window[0] <= timestamp < window[1]:
+                placed = self._place(user_id, timestamp, tz)
+                if placed is None:
+                    continue
+                _, noon, next_noon = self._local_night(timestamp, tz)
+                window = (noon, next_noon) + placed if placed[1] == noon else None
+                night_name, base = placed
+            else:
+                night_name, base = window[2:]
+            samples.append((night_name, timestamp - base, min(max(int(value), 0), MISSING - 1)))
+        with self._lock:
+            for night_name, offset, value in samples:
+                key = (user_id, night_name)
+                night = self._pending.get(key)
+                if night is None:
+                    night = self._pending[key] = _Night()
+                night.samples[int(offset * self.sample_rate)] = value
+                minute = night.minutes.get(int(offset // 60))
+                if minute is None:
+                    night.minutes[int(offset // 60)] = [value, value, value, 1]
+                else:
+                    minute[0] = min(minute[0], value)
+                    minute[1] = max(minute[1], value)
+                    minute[2] += value
+                    minute[3] += 1
+                if len(night.samples) >= self.flush_samples:
+                    full.append(key)
+        for user, night in set(full):
+            self._flush_night(user, night)
+
+    def flush(self, user_id=None):
+        with self._lock:
+            keys = [key for key in self._pending if user_id is None or key[0] == user_id]
+        for user, night in keys:
+            self._flush_night(user, night)
+        if user_id is not None:
+            # Another thread may have popped this user's samples and still be writing them
+            with self._lock:
+                thread_lock = self._user_locks.get(user_id)
+            if thread_lock is not None:
+                with thread_lock:
+                    pass
+
+    def close(self):
+        self.flush()
+
+    def _flush_night(self, user_id, night_key):
+        # Only this user's lock is held during the file I/O. It is taken before
+        # the pop, so flush(user_id) can wait out a flush already under way.
+        with self._user_lock(user_id):
+            with self._lock:
+                night = self._pending.pop((user_id, night_key), None)
+            if night is not None:
+                self._write_slots(self._path(user_id, night_key, 'raw'), night.samples, 1)
+                minutes = {}
+                existing = self._read_minutes_file(self._path(user_id, night_key, 'min'), night.minutes)
+                for index, (low, high, total, count) in night.minutes.items():
+                    previous = existing.get(index)
+                    if previous is not None:
+                        # Merge with the part of this minute written by an earlier flush
+                        old_low, old_high, old_mean, old_count = previous
+                        low, high = min(low, old_low), max(high, old_high)
+                        total += old_mean * old_count
+                        count += old_count
+                    minutes[index] = (low, high, round(total / count), min(count, MISSING - 1))
+                self._write_slots(self._path(user_id, night_key, 'min'), minutes, 4)
+
+    def _read_minutes_file(self, path, indexes):
+        # {minute: (min, max, mean, samples)} for minutes already on disk
+        if not indexes or not os.path.exists(path):
+            return {}
+        first = min(indexes)
+        rows = self._read_slots(path, 4, first, max(indexes) + 1)
+        found = {}
+        for index in indexes:
+            row = rows[(index - first) * 4:(index - first) * 4 + 4]
+            if row[0] != MISSING:
+                found[index] = tuple(row)
+        return found
+
+    @staticmethod
+    def _write_slots(path, slots, width):
+        # Write {slot: value or tuple} into a file of width uint16s per slot,
+        # padding any gap with MISSING
+        if not slots:
+            return
+        mode = 'r+b' if os.path.exists(path) else 'w+b'
+        with open(path, mode) as f:
+            f.seek(0, os.SEEK_END)
+            length = f.tell() // (2 * width)
+            ordered = sorted(slots)
+            # Contiguous runs become a single write
+            run_start = previous = None
+            run = array('H')
+            for slot in ordered + [None]:
+                if slot is not None and previous is not None and slot == previous + 1:
+                    run.extend(slots[slot] if width > 1 else (slots[slot],))
+                    previous = slot
+                    continue
+                if run_start is not None:
+                    if run_start > length:
+                        f.seek(length * 2 * width)
+                        f.write(array('H', [MISSING]) * ((run_start - length) * width))
+                    if _SWAP:
+                        run.byteswap()
+                    f.seek(run_start * 2 * width)
+                    f.write(run.tobytes())
+                    length = max(length, run_start + len(run) // width)
+                if slot is None:
+                    break
+                run_start = previous = slot
+                run = array('H', slots[slot] if width > 1 else (slots[slot],))
+
+    # Reads -------------------------------------------------------------------
+
+    @staticmethod
+    def _read_slots(path, width, first, last):
+        # uint16 values for slots [first, last), MISSING where nothing was written
+        count = max(0, last - first) * width
+        if not os.path.exists(path) or os.path.getsize(path) == 0:
+            return array('H', [MISSING]) * count
+        with open(path, 'rb') as f, mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as mapped:
+            view = memoryview(mapped).cast('H')
+            try:
+                values = array('H', view[first * width:last * width])
+            finally:
+                view.release()
+        if _SWAP:
+            values.byteswap()
+        if len(values) < count:
+            values.extend(array('H', [MISSING]) * (count - len(values)))
+        return values
+
+    def _ranges(self, user_id, start, end, tz):
+        # (night key, night start, night end) for every night overlapping [start, end).
+        # Starts a night early, as one recorded in another timezone may reach further.
+        day = self._local_night(start, tz)[0] - timedelta(days=1)
+        base = self._night_base(user_id, day, tz)
+        while base < end:
+            following = self._night_base(user_id, day + timedelta(days=1), tz)
+            stop = min(following, base + MAX_NIGHT_SECONDS)
+            if stop > max(base, start):
+                yield day.isoformat(), base, stop
+            day += timedelta(days=1)
+            base = following
+
+    def read(self, user_id, start, end, tz=None):
+        # Raw samples in [start, end): (epoch of the first slot, array('H'))
+        self.flush(user_id)
+        step = 1.0 / self.sample_rate
+        first_time = None
+        values = array('H')
+        for night, base, stop in self._ranges(user_id, start, end, tz or self.timezone):
+            first = max(0, int((start - base) * self.sample_rate + 0.999999))
+            last = int((min(end, stop) - base) * self.sample_rate + 0.999999)
+            if first_time is None:
+                first_time = base + first * step
+            else:
+                # Nights of different timezones may leave a gap (pad) or overlap (skip)
+                gap = round((base + first * step - first_time) * self.sample_rate) - len(values)
+                if gap > 0:
+                    values.extend(array('H', [MISSING]) * gap)
+                first -= min(gap, 0)
+            if last > first:
+                values.extend(self._read_slots(self._path(user_id, night, 'raw'), 1, first, last))
+        return (first_time if first_time is not None else start), values
+
+    def read_minutes(self, user_id, start, end, tz=None):
+        # Per-minute [(epoch, min, max, mean)] in [start, end), skipping empty minutes
+        self.flush(user_id)
+        rows = []
+        for night, base, stop in self._ranges(user_id, start, end, tz or self.timezone):
+            first = max(0, int((start - base) // 60))
+            last = int((min(end, stop) - base + 59) // 60)
+            values = self._read_slots(self._path(user_id, night, 'min'), 4, first, last)
+            for n in range(last - first):
+                low, high, mean, _ = values[n * 4:n * 4 + 4]
+                if low != MISSING and (not rows or base + (first + n) * 60 > rows[-1][0]):
+                    rows.append((base + (first + n) * 60, low, high, mean))
+        return rows
+
+    def disk_usage(self, user_id):
+        folder = self._folder(user_id)
+        if not os.path.isdir(folder):
+            return 0
+        return sum(os.path.getsize(os.path.join(folder, name)) for name in os.listdir(folder))
@@ -0,0 +1,143 @@
+import os
+from datetime import date, datetime, time, timedelta
+
+import pytz
+
+# When an alarm goes off next, in the user's own timezone.
+#
+# An alarm is a local wall-clock time ("HH:MM:SS") plus an optional repeat rule;
+# without one it rings every day, as alarms always have:
+#   {'time': '07:00:00', 'repeat': {'weekdays': [0, 1, 2, 3, 4]}}          # Mon-Fri
+#   {'time': '06:30:00', 'repeat': {'every': 2, 'start': '2025-10-20'}}    # every other day
+#   {'time': '07:00:00', 'repeat': {'skip': ['2025-12-25']}}               # daily, not at Christmas
+#   {'time': '07:00:00', 'repeat': {'date': '2025-10-21'}}                 # once, on that day
+# weekdays use Monday = 0 like intents.parse; every N days counts from start;
+# skip lists local dates; date makes a one-shot alarm that never rings again
+# after that day. Rules combine: all of them must allow a day.
+#
+# Times are resolved with pytz, so DST changes are honoured: a time that does
+# not exist on a spring-forward day rings at the same instant as an hour later,
+# and a repeated one on a fall-back day rings the first time round.
+
+DEFAULT_TIMEZONE = os.environ.get('WAKEUP_TIMEZONE', 'Africa/Tunis')
+MAX_EVERY = 365
+MAX_SKIP = 366
+# Longest stretch searched for the next allowed day; a rule that allows none
+# in that window never rings again
+MAX_SEARCH_DAYS = 2 * 366
+
+
+def timezone(name=None):
+    # pytz zone for an IANA name, falling back to DEFAULT_TIMEZONE
+    try:
+        return pytz.timezone(name or DEFAULT_TIMEZONE)
+    except pytz.UnknownTimeZoneError:
+        return pytz.timezone(DEFAULT_TIMEZONE)
+
+
+def is_timezone(name):
+    try:
+        pytz.timezone(name)
+        return True
+    except (pytz.UnknownTimeZoneError, AttributeError):
+        return False
+
+
+def parse_time(alarm_time):
+    # "HH:MM:SS" or "HH:MM" -> datetime.time, or None
+    try:
+        parts = [int(part) for part in str(alarm_time).split(':')]
+        hours, minutes, seconds = (parts + [0, 0])[:3]
+        return time(hours, minutes, seconds)
+    except (TypeError, ValueError):
+        return None
+
+
+def _date(value):
+    try:
+        return date.fromisoformat(str(value))
+    except ValueError:
+        raise ValueError(f"Dates must be YYYY-MM-DD, got {value!r}")
+
+
+def normalize_repeat(repeat, today):
+    # Validate a repeat rule from a client; returns the rule to store, or None
+    # for plain daily alarms. Raises ValueError on anything malformed.
+    if not repeat:
+        return None
+    if not isinstance(repeat, dict):
+        raise ValueError("repeat must be an object")
+    unknown = set(repeat) - {'weekdays', 'every', 'start', 'skip', 'date'}
+    if unknown:
+        raise ValueError(f"Unknown repeat fields: {', '.join(sorted(unknown))}")
+    rule = {}
+
+    weekdays = repeat.get('weekdays')
+    if weekdays is not None:
+        if not isinstance(weekdays, list) or not weekdays or \
+                not all(isinstance(day, int) and 0 <= day <= 6 for day in weekdays):
+            raise ValueError("weekdays must be a non-empty list of 0 (Monday) to 6 (Sunday)")
+        if len(set(weekdays)) < 7:
+            rule['weekdays'] = sorted(set(weekdays))
+
+    every = repeat.get('every', 1)
+    if not isinstance(every, int) or not 1 <= every <= MAX_EVERY:
+        raise ValueError(f"every must be a whole number of days from 1 to {MAX_EVERY}")
+    if every > 1:
+        rule['every'] = every
+        rule['start'] = _date(repeat['start']).isoformat() if repeat.get('start') else today.isoformat()
+
+    skip = repeat.get('skip')
+    if skip:
+        if not isinstance(skip, list) or len(skip) > MAX_SKIP:
+            raise ValueError(f"skip must be a list of at most {MAX_SKIP} dates")
+        rule['skip'] = sorted({_date(day).isoformat() for day in skip})
+
+    if repeat.get('date'):
+        day = _date(repeat['date'])
+        if day < today:
+            raise ValueError(f"date {day.isoformat()} is in the past")
+        rule['date'] = day.isoformat()
+    return rule or None
+
+
+def _allowed(day, rule):
+    if 'date' in rule and day.isoformat() != rule['date']:
+        return False
+    if 'weekdays' in rule and day.weekday() not in rule['weekdays']:
+        return False
+    if 'every' in rule:
+        offset = (day - date.fromisoformat(rule['start'])).days
+        if offset < 0 or offset % rule['every']:
+            return False
+    return day.isoformat() not in rule.get('skip', ())
+
+
+def localize(tz, naive):
+    try:
+        return tz.localize(naive, is_dst=None)
+    except pytz.AmbiguousTimeError:
+        return tz.localize(naive, is_dst=True)
+    except pytz.NonExistentTimeError:
+        return tz.normalize(tz.localize(naive, is_dst=False))
+
+
+def next_fire(alarm, tz, after):
+    # Epoch seconds of the first occurrence strictly after `after`, or None
+    fire_time = parse_time(alarm.get('time'))
+    if fire_time is None:
+        return None
+    rule = alarm.get('repeat') or {}
+    day = datetime.fromtimestamp(after, tz).date()
+    for _ in range(MAX_SEARCH_DAYS):
+        if _allowed(day, rule):
+            deadline = localize(tz, datetime.combine(day, fire_time)).timestamp()
+            if deadline > after:
+                return deadline
+        day += timedelta(days=1)
+    return None
+
+
+def local_now(tz, now):
+    # Naive local datetime for an epoch timestamp
+    return datetime.fromtimestamp(now, tz).replace(tzinfo=None)
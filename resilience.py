@@ -0,0 +1,393 @@
+import copy
+import functools
+import random
+import threading
+import time
+from collections import OrderedDict, deque
+from concurrent.futures import Future, ThreadPoolExecutor, TimeoutError as FutureTimeout
+
+# Keeps a slow or failing backend from stalling the app. ResilientStorage sits
+# in front of a Storage backend and gives every call:
+#
+#   a deadline   the caller stops waiting after `deadline` seconds and gets
+#                DeadlineExceeded. The deadline must be at least the backend's
+#                own request timeout (firebase_admin's httpTimeout), which is
+#                what actually ends an abandoned request;
+#   retries      idempotent calls that failed outright are retried with
+#                full-jitter exponential backoff while the deadline allows. A
+#                call that timed out may still land, so it is never retried;
+#   ordering     writes for one user run one at a time, in the order they were
+#                made, so a slow write can't land after a newer one (motor=1
+#                after motor=0). A write that times out before it started is
+#                dropped;
+#   a breaker    after `failure_threshold` failed calls in a row the circuit
+#                opens for `reset_timeout` seconds: calls fail fast with
+#                StorageUnavailable, except reads, which are answered from the
+#                last value this process read successfully (the newest
+#                `max_last_known` of them). One trial call is let through after
+#                the timeout; success closes the circuit.
+#
+# Alarm writes stamp a new revision from a counter (add_alarm, update_alarm,
+# cancel_alarm, write_alarms). Repeating one would bump the counter twice, and
+# giving up on one would let the next alarm write race it, so they are neither
+# retried nor abandoned: the caller waits for the backend's own timeout.
+#
+# FaultyStorage is the matching stand-in for local testing: it adds latency,
+# latency spikes, random errors and outages in front of any backend.
+#
+#   WAKEUP_FAULTS="latency=0.02,spike_rate=0.05,spike_latency=3,error_rate=0.01,outage_every=120,outage_for=20"
+
+DEADLINE = 3.0
+RETRIES = 2
+BACKOFF = 0.05
+MAX_BACKOFF = 0.5
+WORKERS = 16
+MAX_LAST_KNOWN = 10000
+
+# Mistakes in the request itself: retrying won't help and the backend is fine
+CALLER_ERRORS = (ValueError, TypeError, KeyError, NotImplementedError)
+
+
+class DeadlineExceeded(TimeoutError):
+    pass
+
+
+class StorageUnavailable(ConnectionError):
+    pass
+
+
+class CircuitBreaker:
+    CLOSED, OPEN, HALF_OPEN = 'closed', 'open', 'half_open'
+
+    def __init__(self, failure_threshold=5, reset_timeout=15.0, clock=time.monotonic):
+        self.failure_threshold = failure_threshold
+        self.reset_timeout = reset_timeout
+        self.clock = clock
+        self.state = self.CLOSED
+        self.failures = 0
+        self.opened = 0
+        self._opened_at = 0.0
+        self._trial = False
+        self._lock = threading.Lock()
+
+    def allow(self):
+        # True if a call may go to the backend now
+        with self._lock:
+            if self.state == self.CLOSED:
+                return True
+            if self.state == self.OPEN and self.clock() - self._opened_at >= self.reset_timeout:
+                self.state = self.HALF_OPEN
+                self._trial = False
+            if self.state == self.HALF_OPEN and not self._trial:
+                self._trial = True
+                return True
+            return False
+
+    def record_success(self):
+        with self._lock:
+            self.state = self.CLOSED
+            self.failures = 0
+
+    def record_failure(self):
+        with self._lock:
+            self.failures += 1
+            if self.state == self.HALF_OPEN or self.failures >= self.failure_threshold:
+                if self.state != self.OPEN:
+                    self.opened += 1
+                self.state = self.OPEN
+                self._opened_at = self.clock()
+
+
+class ResilientStorage:
+    def __init__(self, backend, deadline=DEADLINE, retries=RETRIES, backoff=BACKOFF, max_backoff=MAX_BACKOFF,
+                 breaker=None, workers=WORKERS, max_last_known=MAX_LAST_KNOWN):
+        self.backend = backend
+        self.deadline = deadline
+        self.retries = retries
+        self.backoff = backoff
+        self.max_backoff = max_backoff
+        self.breaker = breaker or CircuitBreaker()
+        self.max_last_known = max_last_known
+        self._executor = ThreadPoolExecutor(max_workers=workers, thread_name_prefix='storage')
+        self._last_known = OrderedDict()
+        self._lanes = {}  # user_id -> deque of (fn, future) writes, the first one running
+        self._lock = threading.Lock()
+        self.calls = 0
+        self.retried = 0
+        self.timeouts = 0
+        self.errors = 0
+        self.rejected = 0
+        self.stale = 0
+
+    def __getattr__(self, name):
+        # database (for the StateMirror listener), close, ... go straight through
+        return getattr(self.backend, name)
+
+    def _count(self, counter):
+        with self._lock:
+            setattr(self, counter, getattr(self, counter) + 1)
+
+    # Running calls -----------------------------------------------------------
+
+    def _submit_write(self, lane, fn):
+        # Queue fn behind the lane's earlier writes; returns its future
+        future = Future()
+        with self._lock:
+            queue = self._lanes.get(lane)
+            idle = queue is None
+            if idle:
+                queue = self._lanes[lane] = deque()
+            queue.append((fn, future))
+        if idle:
+            self._executor.submit(self._drain, lane, queue)
+        return future
+
+    def _drain(self, lane, queue):
+        while True:
+            with self._lock:
+                if not queue:
+                    del self._lanes[lane]
+                    return
+                fn, future = queue[0]
+            # False if the caller gave up before the write started
+            if future.set_running_or_notify_cancel():
+                try:
+                    future.set_result(fn())
+                except BaseException as e:
+                    future.set_exception(e)
+            with self._lock:
+                queue.popleft()
+
+    def _attempt(self, name, method, args, timeout, lane):
+        call = functools.partial(method, *args)
+        future = self._executor.submit(call) if lane is None else self._submit_write(lane[0], call)
+        try:
+            return future.result(timeout=None if timeout is None else max(timeout, 0))
+        except FutureTimeout:
+            future.cancel()
+            self._count('timeouts')
+            raise DeadlineExceeded(f"{name} took longer than {self.deadline:.2f}s")
+
+    def _call(self, name, *args, retry=False, lane=None, wait=False):
+        # lane=(user_id,) runs the call in that user's write order; wait=True
+        # waits for the backend however long it takes
+        self._count('calls')
+        if not self.breaker.allow():
+            self._count('rejected')
+            raise StorageUnavailable(f"Storage circuit open, {name} not attempted")
+        method = getattr(self.backend, name)
+        expires = time.monotonic() + self.deadline
+        attempt = 0
+        while True:
+            try:
+                result = self._attempt(name, method, args, None if wait else expires - time.monotonic(), lane)
+            except CALLER_ERRORS:
+                self.breaker.record_success()
+                raise
+            except Exception as e:
+                delay = random.uniform(0, min(self.max_backoff, self.backoff * 2 ** attempt))
+                if not retry or isinstance(e, DeadlineExceeded) or attempt >= self.retries \
+                        or time.monotonic() + delay >= expires:
+                    self._count('errors')
+                    self.breaker.record_failure()
+                    raise
+                attempt += 1
+                self._count('retried')
+                time.sleep(delay)
+                continue
+            self.breaker.record_success()
+            return result
+
+    def _read(self, name, *args):
+        key = (name,) + args
+        try:
+            value = self._call(name, *args, retry=True)
+        except CALLER_ERRORS:
+            raise
+        except Exception as e:
+            with self._lock:
+                if key not in self._last_known:
+                    raise
+                self.stale += 1
+                value = self._last_known[key]
+            print(f"⚠️ Storage degraded ({e}), serving last known {name}")
+            return copy.deepcopy(value)
+        with self._lock:
+            self._last_known[key] = copy.deepcopy(value)
+            self._last_known.move_to_end(key)
+            while len(self._last_known) > self.max_last_known:
+                self._last_known.popitem(last=False)
+        return value
+
+    def _write(self, name, user_id, *args, retry=True):
+        return self._call(name, user_id, *args, retry=retry, lane=(user_id,))
+
+    def _alarm_write(self, name, user_id, *args):
+        # Stamps a new alarm revision: not retried, not abandoned
+        return self._call(name, user_id, *args, lane=(user_id,), wait=True)
+
+    # Reads -----------------------------------------------------------------
+
+    def get_user(self, user_id):
+        return self._read('get_user', user_id)
+
+    def list_user_ids(self):
+        return self._read('list_user_ids')
+
+    def get_alarms(self, user_id):
+        return self._read('get_alarms', user_id)
+
+    def find_alarms(self, user_id, alarm_time):
+        return self._read('find_alarms', user_id, alarm_time)
+
+    def get_hardware(self, user_id):
+        return self._read('get_hardware', user_id)
+
+    def get_insights(self, user_id):
+        return self._read('get_insights', user_id)
+
+    def get_current_user(self):
+        return self._read('get_current_user')
+
+    def get_sessions(self, user_id):
+        # Whole sleep history: too big to keep a copy of, so never served stale
+        return self._call('get_sessions', user_id, retry=True)
+
+    def count_sessions(self, user_id):
+        return self._read('count_sessions', user_id)
+
+    # Writes ----------------------------------------------------------------
+    # Retried when repeating them leaves the same result
+
+    def create_user(self, user_id, data):
+        return self._write('create_user', user_id, data)
+
+    def update_user(self, user_id, fields):
+        return self._write('update_user', user_id, fields)
+
+    def add_alarm(self, user_id, alarm, alarm_id=None):
+        return self._alarm_write('add_alarm', user_id, alarm, alarm_id)
+
+    def update_alarm(self, user_id, alarm_id, fields):
+        return self._alarm_write('update_alarm', user_id, alarm_id, fields)
+
+    def cancel_alarm(self, user_id, alarm_id):
+        return self._alarm_write('cancel_alarm', user_id, alarm_id)
+
+    def delete_alarm(self, user_id, alarm_id):
+        return self._write('delete_alarm', user_id, alarm_id)
+
+    def write_alarms(self, user_id, alarms):
+        return self._alarm_write('write_alarms', user_id, alarms)
+
+    def set_hardware(self, user_id, field, value):
+        return self._write('set_hardware', user_id, field, value)
+
+    def add_session(self, user_id, key, duration, start=None):
+        # Re-recording a session key replaces it in the insights aggregate
+        return self._write('add_session', user_id, key, duration, start)
+
+    def save_insights(self, user_id, summary):
+        return self._write('save_insights', user_id, summary)
+
+    def set_current_user(self, user_id):
+        # The root current-user node gets the lane of user None
+        return self._call('set_current_user', user_id, retry=True, lane=(None,))
+
+    def write_paths(self, user_id, updates):
+        return self._write('write_paths', user_id, updates)
+
+    def close(self):
+        self._executor.shutdown(wait=False)
+        self.backend.close()
+
+    def stats(self):
+        with self._lock:
+            return {
+                'circuit': self.breaker.state,
+                'circuit_opened': self.breaker.opened,
+                'last_known_entries': len(self._last_known),
+                'write_lanes': len(self._lanes),
+                'calls': self.calls,
+                'retried': self.retried,
+                'timeouts': self.timeouts,
+                'errors': self.errors,
+                'rejected': self.rejected,
+                'stale': self.stale,
+            }
+
+
+class InjectedFault(ConnectionError):
+    pass
+
+
+class FaultyStorage:
+    # Every backend call first sleeps `latency` seconds (`spike_latency` instead
+    # with probability `spike_rate`), then fails with probability `error_rate`.
+    # outage() takes the backend down until restore(); outage_every/outage_for
+    # schedule recurring outages of outage_for seconds.
+
+    def __init__(self, backend, latency=0.0, spike_rate=0.0, spike_latency=3.0, error_rate=0.0,
+                 outage_every=0.0, outage_for=0.0, clock=time.monotonic, seed=None):
+        self.backend = backend
+        self.latency = latency
+        self.spike_rate = spike_rate
+        self.spike_latency = spike_latency
+        self.error_rate = error_rate
+        self.outage_every = outage_every
+        self.outage_for = outage_for
+        self.clock = clock
+        self._random = random.Random(seed)
+        self._started = clock()
+        self._down_until = None
+
+    @classmethod
+    def from_spec(cls, backend, spec):
+        # "latency=0.02,error_rate=0.1" -> FaultyStorage(backend, latency=0.02, error_rate=0.1)
+        options = {}
+        for item in filter(None, (part.strip() for part in spec.split(','))):
+            name, _, value = item.partition('=')
+            if name.strip() not in ('latency', 'spike_rate', 'spike_latency', 'error_rate',
+                                    'outage_every', 'outage_for'):
+                raise ValueError(f"Unknown fault option: {name.strip()}")
+            options[name.strip()] = float(value)
+        return cls(backend, **options)
+
+    def outage(self, seconds=None):
+        # Fail every call for `seconds`, or until restore()
+        self._down_until = float('inf') if seconds is None else self.clock() + seconds
+
+    def restore(self):
+        self._down_until = None
+
+    def is_down(self):
+        now = self.clock()
+        if self._down_until is not None and now < self._down_until:
+            return True
+        return bool(self.outage_every) and (now - self._started) % self.outage_every < self.outage_for
+
+    def _inject(self, name):
+        spike = self._random.random() < self.spike_rate
+        delay = self.spike_latency if spike else self.latency
+        if delay:
+            time.sleep(delay)
+        if self.is_down():
+            raise InjectedFault(f"Injected outage during {name}")
+        if self._random.random() < self.error_rate:
+            raise InjectedFault(f"Injected error during {name}")
+
+    def __getattr__(self, name):
+        attribute = getattr(self.backend, name)
+        if name in ('database', 'close') or name.startswith('_') or not callable(attribute):
+            return attribute
+
+        @functools.wraps(attribute)
+        def call(*args, **kwargs):
+            self._inject(name)
+            return attribute(*args, **kwargs)
+        return call
+
+
+def inject_faults(backend, spec):
+    # Wrap backend in a FaultyStorage when spec (WAKEUP_FAULTS) is set
+    return FaultyStorage.from_spec(backend, spec) if spec else backend
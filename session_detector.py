@@ -0,0 +1,98 @@
+# Streaming sleep-session detection from raw pillow readings.
+#
+# One SessionDetector per pillow consumes (timestamp, force) samples and keeps
+# a handful of numbers of state, whatever the length of the night:
+#   - hysteresis: the pillow becomes occupied above on_threshold and only
+#     counts as empty again below off_threshold, so noise around a single
+#     threshold does not flicker;
+#   - gap merge: getting up for less than min_gap seconds (sitting up, a trip
+#     to the bathroom) continues the same session;
+#   - duration filter: sessions shorter than min_duration seconds are dropped;
+#   - silence: if a pillow stops reporting for max_silence seconds the open
+#     session is closed at the last occupied sample.
+# Finished sessions are dicts keyed by their start time, ready for
+# Storage.add_session:
+#   {'key': '1760824800', 'start': 1760824800.0, 'end': 1760851200.0, 'minutes': 440}
+
+ON_THRESHOLD = 350
+OFF_THRESHOLD = 250
+MIN_GAP = 15 * 60
+MIN_DURATION = 20 * 60
+MAX_SILENCE = 30 * 60
+# What changes while samples are fed; state() / restore() carry it between
+# processes (see shared_state.py)
+STATE_FIELDS = ('occupied', 'start', 'last_on', 'last_seen', 'dropped')
+
+
+class SessionDetector:
+    def __init__(self, on_threshold=ON_THRESHOLD, off_threshold=OFF_THRESHOLD, min_gap=MIN_GAP,
+                 min_duration=MIN_DURATION, max_silence=MAX_SILENCE):
+        if off_threshold > on_threshold:
+            raise ValueError("off_threshold must not be above on_threshold")
+        self.on_threshold = on_threshold
+        self.off_threshold = off_threshold
+        self.min_gap = min_gap
+        self.min_duration = min_duration
+        self.max_silence = max_silence
+        self.occupied = False
+        self.start = None      # start of the open session, if any
+        self.last_on = None    # last time the pillow was occupied in that session
+        self.last_seen = None  # timestamp of the previous sample
+        self.dropped = 0       # sessions discarded as too short
+
+    def feed(self, timestamp, value):
+        # Returns the session this sample finished, or None
+        finished = None
+        if self.last_seen is not None and timestamp - self.last_seen > self.max_silence:
+            finished = self._close()
+            self.occupied = False
+        self.last_seen = timestamp
+
+        if self.occupied:
+            self.last_on = timestamp
+            if value < self.off_threshold:
+                self.occupied = False
+        elif value > self.on_threshold:
+            self.occupied = True
+            if self.start is None:
+                self.start = timestamp
+            self.last_on = timestamp
+        elif self.start is not None and timestamp - self.last_on > self.min_gap:
+            finished = self._close() or finished
+        return finished
+
+    def feed_many(self, start, values, interval, skip=None):
+        # Feed evenly spaced samples; values equal to skip (a gap marker) are
+        # ignored. Returns the list of finished sessions.
+        sessions = []
+        for n, value in enumerate(values):
+            if value == skip:
+                continue
+            session = self.feed(start + n * interval, value)
+            if session is not None:
+                sessions.append(session)
+        return sessions
+
+    def state(self):
+        return {field: getattr(self, field) for field in STATE_FIELDS}
+
+    def restore(self, state):
+        for field in STATE_FIELDS:
+            if field in state:
+                setattr(self, field, state[field])
+        return self
+
+    def close(self):
+        # Finish the open session now (end of a replay, pillow shut down)
+        self.occupied = False
+        return self._close()
+
+    def _close(self):
+        start, end = self.start, self.last_on
+        self.start = self.last_on = None
+        if start is None:
+            return None
+        if end - start < self.min_duration:
+            self.dropped += 1
+            return None
+        return {'key': str(int(start)), 'start': start, 'end': end, 'minutes': int(round((end - start) / 60))}
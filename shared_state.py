@@ -0,0 +1,226 @@
+import json
+import os
+import sqlite3
+import threading
+import time
+import traceback
+from contextlib import contextmanager
+
+# Small mutable state that every process serving the app must agree on: who is
+# on the pillow (current user), the voice UI status, logged-in users and "this
+# user's alarms changed" signals for the alarm engine. Keys are strings, values
+# anything JSON-serialisable; a value of None means the key is absent.
+#
+#   shared_state.set('voice_status', 'listening')
+#   shared_state.update('alarms/uid', lambda rev: rev + 1) # atomic read-modify-write
+#   shared_state.pop('current_user')                       # atomic take
+#   shared_state.subscribe(lambda key, value: ...)         # every change
+#
+# LocalState keeps everything in this process (the single-process default).
+# SQLiteState keeps it in a WAL-mode SQLite file shared by every process on
+# the machine: updates run in BEGIN IMMEDIATE transactions, and a watcher
+# thread polls the change log so subscribers hear about other processes'
+# writes within `poll_interval` seconds. A process's own writes are delivered
+# to its subscribers straight away.
+
+
+class LocalState:
+    # True when other processes see this state
+    shared = False
+
+    def __init__(self):
+        self._values = {}
+        self._lock = threading.Lock()
+        self._subscribers = []
+
+    def get(self, key, default=None):
+        with self._lock:
+            value = self._values.get(key)
+        return default if value is None else value
+
+    def items(self, prefix):
+        with self._lock:
+            return {key[len(prefix):]: value for key, value in self._values.items() if key.startswith(prefix)}
+
+    def set(self, key, value):
+        with self._lock:
+            self._store(key, value)
+        self._notify(key, value, remote=False)
+
+    def update(self, key, fn, default=None):
+        # new = fn(current or default), stored atomically; returns new
+        with self._lock:
+            current = self._values.get(key)
+            value = fn(default if current is None else current)
+            self._store(key, value)
+        self._notify(key, value, remote=False)
+        return value
+
+    def pop(self, key, default=None):
+        with self._lock:
+            value = self._values.pop(key, None)
+        if value is not None:
+            self._notify(key, None, remote=False)
+        return default if value is None else value
+
+    def _store(self, key, value):
+        if value is None:
+            self._values.pop(key, None)
+        else:
+            self._values[key] = value
+
+    def subscribe(self, callback, prefix='', remote_only=False):
+        # callback(key, value) after each change to a key starting with prefix;
+        # remote_only subscribers only hear about other processes' writes
+        self._subscribers.append((prefix, remote_only, callback))
+
+    def _notify(self, key, value, remote):
+        for prefix, remote_only, callback in list(self._subscribers):
+            if key.startswith(prefix) and (remote or not remote_only):
+                try:
+                    callback(key, value)
+                except Exception:
+                    traceback.print_exc()
+
+    def start(self):
+        return self
+
+    def close(self):
+        pass
+
+
+SQLITE_SCHEMA = '''
+CREATE TABLE IF NOT EXISTS state (
+    key TEXT PRIMARY KEY,
+    value TEXT,
+    version INTEGER NOT NULL
+);
+CREATE INDEX IF NOT EXISTS state_version ON state (version);
+'''
+
+
+class SQLiteState(LocalState):
+    # Deleted keys stay behind as NULL rows so watchers see the deletion
+    shared = True
+
+    def __init__(self, path='instance/shared_state.db', poll_interval=0.1):
+        super().__init__()
+        if os.path.dirname(path):
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+        self.path = path
+        self.poll_interval = poll_interval
+        self._conn = sqlite3.connect(path, check_same_thread=False, isolation_level=None, timeout=10)
+        with self._lock:
+            self._conn.execute('PRAGMA journal_mode=WAL')
+            self._conn.execute('PRAGMA synchronous=NORMAL')
+            self._conn.executescript(SQLITE_SCHEMA)
+            self._seen = self._conn.execute('SELECT COALESCE(MAX(version), 0) FROM state').fetchone()[0]
+        self._own_versions = set()
+        self._thread = None
+        self._stopped = threading.Event()
+
+    @contextmanager
+    def _transaction(self):
+        with self._lock:
+            self._conn.execute('BEGIN IMMEDIATE')
+            try:
+                yield self._conn
+            except Exception:
+                self._conn.execute('ROLLBACK')
+                raise
+            self._conn.execute('COMMIT')
+
+    def _read(self, conn, key):
+        row = conn.execute('SELECT value FROM state WHERE key = ?', (key,)).fetchone()
+        return json.loads(row[0]) if row and row[0] is not None else None
+
+    def _write(self, conn, key, value):
+        version = conn.execute('SELECT COALESCE(MAX(version), 0) + 1 FROM state').fetchone()[0]
+        conn.execute('INSERT OR REPLACE INTO state (key, value, version) VALUES (?, ?, ?)',
+                     (key, None if value is None else json.dumps(value), version))
+        self._own_versions.add(version)
+
+    def get(self, key, default=None):
+        with self._lock:
+            value = self._read(self._conn, key)
+        return default if value is None else value
+
+    def items(self, prefix):
+        escaped = prefix.replace('\\', '\\\\').replace('%', '\\%').replace('_', '\\_')
+        with self._lock:
+            rows = self._conn.execute("SELECT key, value FROM state WHERE key LIKE ? ESCAPE '\\' "
+                                      "AND value IS NOT NULL", (escaped + '%',)).fetchall()
+        return {key[len(prefix):]: json.loads(value) for key, value in rows}
+
+    def set(self, key, value):
+        with self._transaction() as conn:
+            self._write(conn, key, value)
+        self._notify(key, value, remote=False)
+
+    def update(self, key, fn, default=None):
+        with self._transaction() as conn:
+            current = self._read(conn, key)
+            value = fn(default if current is None else current)
+            self._write(conn, key, value)
+        self._notify(key, value, remote=False)
+        return value
+
+    def pop(self, key, default=None):
+        with self._transaction() as conn:
+            value = self._read(conn, key)
+            if value is not None:
+                self._write(conn, key, None)
+        if value is not None:
+            self._notify(key, None, remote=False)
+        return default if value is None else value
+
+    def changes(self):
+        # Rows written by other processes since the last call, oldest first
+        with self._lock:
+            rows = self._conn.execute('SELECT version, key, value FROM state WHERE version > ? ORDER BY version',
+                                      (self._seen,)).fetchall()
+            if rows:
+                self._seen = rows[-1][0]
+            remote = [row for row in rows if row[0] not in self._own_versions]
+            self._own_versions.difference_update(row[0] for row in rows)
+        return [(key, None if value is None else json.loads(value)) for _, key, value in remote]
+
+    def poll(self):
+        for key, value in self.changes():
+            self._notify(key, value, remote=True)
+
+    def start(self):
+        if self._thread is None:
+            self._stopped.clear()
+            self._thread = threading.Thread(target=self._run, name='shared-state', daemon=True)
+            self._thread.start()
+        return self
+
+    def _run(self):
+        while not self._stopped.wait(self.poll_interval):
+            try:
+                self.poll()
+            except Exception:
+                traceback.print_exc()
+                time.sleep(1)
+
+    def close(self):
+        self._stopped.set()
+        if self._thread is not None:
+            self._thread.join()
+            self._thread = None
+        with self._lock:
+            self._conn.close()
+
+
+def open_shared_state(kind=None):
+    # WAKEUP_SHARED_STATE selects the implementation: local (default, one
+    # process) or sqlite (any number of processes on one machine; the app
+    # picks it itself when its roles run in separate processes)
+    kind = (kind or os.environ.get('WAKEUP_SHARED_STATE', 'local')).lower()
+    if kind == 'local':
+        return LocalState()
+    if kind == 'sqlite':
+        return SQLiteState(os.environ.get('WAKEUP_SHARED_STATE_PATH', 'instance/shared_state.db'),
+                           poll_interval=float(os.environ.get('WAKEUP_SHARED_STATE_POLL_MS', 100)) / 1000)
+    raise ValueError(f"Unknown shared state: {kind}")
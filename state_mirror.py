@@ -0,0 +1,122 @@
+import copy
+import threading
+import traceback
+
+# In-process copy of users/{uid}/hardware and users/{uid}/alarms for the users the
+# app is actively serving. Each section is fed by a Realtime Database streaming
+# listener (Reference.listen), so after the initial snapshot only deltas cross
+# the network and readers never wait on a GET.
+
+SECTIONS = ('hardware', 'alarms')
+
+
+def _split(path):
+    return [part for part in path.split('/') if part]
+
+
+def _apply(tree, path, data):
+    # Apply a 'put' of data at path (relative to the listened section)
+    parts = _split(path)
+    if not parts:
+        return copy.deepcopy(data)
+    if not isinstance(tree, dict):
+        tree = {}
+    node = tree
+    for part in parts[:-1]:
+        if not isinstance(node.get(part), dict):
+            node[part] = {}
+        node = node[part]
+    if data is None:
+        node.pop(parts[-1], None)
+    else:
+        node[parts[-1]] = copy.deepcopy(data)
+    return tree
+
+
+class StateMirror:
+    def __init__(self, database, sections=SECTIONS, on_change=None):
+        # database is firebase_admin.db or anything with the same reference() API
+        self.database = database
+        self.sections = sections
+        self.on_change = on_change
+        self._state = {}
+        self._listeners = {}
+        self._ready = set()
+        self._lock = threading.Lock()
+
+    def track(self, user_id):
+        if self.database is None:
+            return  # local backends are read directly
+        with self._lock:
+            if user_id in self._listeners:
+                return
+            self._listeners[user_id] = []
+            self._state.setdefault(user_id, {})
+        for section in self.sections:
+            ref = self.database.reference(f'users/{user_id}/{section}')
+            registration = ref.listen(
+                lambda event, section=section: self._handle(user_id, section, event))
+            with self._lock:
+                if user_id in self._listeners:
+                    self._listeners[user_id].append(registration)
+                    continue
+            registration.close()  # untracked while we were subscribing
+
+    def untrack(self, user_id):
+        with self._lock:
+            registrations = self._listeners.pop(user_id, [])
+            self._state.pop(user_id, None)
+            self._ready = {key for key in self._ready if key[0] != user_id}
+        for registration in registrations:
+            registration.close()
+
+    def is_tracked(self, user_id):
+        with self._lock:
+            return user_id in self._listeners
+
+    def tracked_users(self):
+        with self._lock:
+            return list(self._listeners)
+
+    def is_ready(self, user_id, section):
+        with self._lock:
+            return (user_id, section) in self._ready
+
+    def get(self, user_id, section, default=None):
+        # Returns None until the listener's initial snapshot has arrived, so callers
+        # can tell "not mirrored" apart from "empty"
+        with self._lock:
+            if (user_id, section) not in self._ready:
+                return default
+            value = self._state.get(user_id, {}).get(section)
+            return copy.deepcopy(value) if value is not None else {}
+
+    def get_hardware(self, user_id):
+        return self.get(user_id, 'hardware')
+
+    def get_alarms(self, user_id):
+        return self.get(user_id, 'alarms')
+
+    def close(self):
+        for user_id in self.tracked_users():
+            self.untrack(user_id)
+
+    def _handle(self, user_id, section, event):
+        try:
+            with self._lock:
+                if user_id not in self._state:
+                    return
+                sections = self._state[user_id]
+                current = sections.get(section)
+                if event.event_type == 'patch':
+                    for key, value in (event.data or {}).items():
+                        current = _apply(current, event.path.rstrip('/') + '/' + key, value)
+                else:
+                    current = _apply(current, event.path, event.data)
+                sections[section] = current
+                self._ready.add((user_id, section))
+                snapshot = copy.deepcopy(current)
+            if self.on_change is not None:
+                self.on_change(user_id, section, snapshot or {})
+        except Exception:
+            traceback.print_exc()
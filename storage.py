@@ -0,0 +1,662 @@
+import copy
+import json
+import os
+import sqlite3
+import threading
+import uuid
+from contextlib import contextmanager
+
+import metrics
+from insights import apply_session, session_duration, session_start
+
+# Storage backends for user, alarm, hardware and session data. The app talks to
+# a Storage object instead of calling db.reference(...) directly, so the same
+# code runs against Firebase, a local SQLite file or plain memory.
+#
+# Data shapes match the Realtime Database layout:
+#   user profile  {'email': ..., 'name': ..., 'created_at': ...}
+#   alarms        {alarm_id: {'time': 'HH:MM:SS', 'status': 'active', 'rev': 7, ...}}
+#   hardware      {'pressure': 0, 'motor': 0}
+#   sessions      {session_key: duration_in_minutes}
+#   insights      running sleep aggregate, see insights.py
+
+# Every alarm write is stamped with the user's next alarm revision ('rev'), and
+# cancelling keeps the alarm as a 'cancelled' tombstone, so the revision of the
+# whole collection is max(rev) and "what changed since rev N" is a filter.
+
+# Subtrees that are stored separately from the scalar profile fields
+NESTED_KEYS = ('alarms', 'hardware', 'sessions', 'insights', 'alarms_rev')
+
+
+def alarms_revision(alarms):
+    return max((alarm.get('rev', 0) for alarm in (alarms or {}).values()), default=0)
+
+
+def session_value(duration, start):
+    # Stored form of a session: a bare duration for legacy sessions without a
+    # start, otherwise the duration with its explicit start time
+    return duration if start is None else {'duration': duration, 'start': start}
+
+
+class Storage:
+    # Set by backends that expose a firebase_admin.db compatible object (used by
+    # the streaming StateMirror)
+    database = None
+
+    def create_user(self, user_id, data):
+        raise NotImplementedError
+
+    def get_user(self, user_id):
+        # Scalar profile fields only, or None if the user does not exist
+        raise NotImplementedError
+
+    def update_user(self, user_id, fields):
+        raise NotImplementedError
+
+    def list_user_ids(self):
+        raise NotImplementedError
+
+    def get_alarms(self, user_id):
+        raise NotImplementedError
+
+    def find_alarms(self, user_id, alarm_time):
+        raise NotImplementedError
+
+    def add_alarm(self, user_id, alarm, alarm_id=None):
+        # Returns the id of the stored alarm
+        raise NotImplementedError
+
+    def update_alarm(self, user_id, alarm_id, fields):
+        # Merge fields into an existing alarm. Returns False, writing nothing,
+        # when the alarm does not exist, so no partial record is created.
+        raise NotImplementedError
+
+    def cancel_alarm(self, user_id, alarm_id):
+        return self.update_alarm(user_id, alarm_id, {'status': 'cancelled'})
+
+    def delete_alarm(self, user_id, alarm_id):
+        # Hard delete, leaves no tombstone for delta sync
+        raise NotImplementedError
+
+    def write_alarms(self, user_id, alarms):
+        # Store several complete alarm records {alarm_id: alarm} in one atomic
+        # write, each stamped with its own new revision. Returns {alarm_id: rev}.
+        raise NotImplementedError
+
+    def get_hardware(self, user_id):
+        raise NotImplementedError
+
+    def set_hardware(self, user_id, field, value):
+        raise NotImplementedError
+
+    def get_sessions(self, user_id):
+        raise NotImplementedError
+
+    def count_sessions(self, user_id):
+        # Number of stored sessions, without reading them
+        raise NotImplementedError
+
+    def add_session(self, user_id, key, duration, start=None):
+        # Also folds the session into the user's insights aggregate. A session
+        # with a known start is stored as {'duration': ..., 'start': epoch} so
+        # ordering never depends on the key string.
+        raise NotImplementedError
+
+    def get_insights(self, user_id):
+        raise NotImplementedError
+
+    def save_insights(self, user_id, summary):
+        raise NotImplementedError
+
+    def get_current_user(self):
+        raise NotImplementedError
+
+    def set_current_user(self, user_id):
+        raise NotImplementedError
+
+    def write_paths(self, user_id, updates):
+        # Apply {path: value} relative to the user's node, or to the root when
+        # user_id is None, e.g. {'hardware/motor': 1, 'hardware/pressure': 0}.
+        # Backends that can do so write everything in a single request.
+        for path, value in updates.items():
+            section, _, field = path.partition('/')
+            if user_id is None and path == 'current-user':
+                self.set_current_user(value)
+            elif user_id is not None and section == 'hardware' and field:
+                self.set_hardware(user_id, field, value)
+            elif user_id is not None and not field and section not in NESTED_KEYS:
+                self.update_user(user_id, {section: value})
+            else:
+                raise ValueError(f"Unsupported path for write_paths: {path}")
+
+    def close(self):
+        pass
+
+
+# Firebase round trips by operation and path pattern, for /metrics
+FIREBASE_SECONDS = metrics.histogram('wakeup_firebase_request_seconds',
+                                     "Firebase Realtime Database request latency", ['op', 'path'])
+FIREBASE_ERRORS = metrics.counter('wakeup_firebase_errors_total', "Failed Firebase requests", ['op', 'path'])
+# Children of these nodes are ids; everything else is a fixed node name
+ID_PARENTS = {'users': '{uid}', 'alarms': '{id}', 'sessions': '{id}'}
+
+
+def path_pattern(path):
+    # 'users/abc/alarms/-Nx1' -> 'users/{uid}/alarms/{id}'
+    segments = [segment for segment in str(path).split('/') if segment]
+    pattern = [segments[0]] if segments else []
+    for parent, segment in zip(segments, segments[1:]):
+        pattern.append(ID_PARENTS.get(parent, segment))
+    return '/'.join(pattern) or '/'
+
+
+class _MeteredRef:
+    # Times every request made through a database reference; anything else
+    # (key, listen, ...) is passed through untouched
+
+    def __init__(self, ref, pattern):
+        self._ref = ref
+        self._pattern = pattern
+
+    def __getattr__(self, name):
+        return getattr(self._ref, name)
+
+    def _request(self, op, method, *args, **kwargs):
+        try:
+            with FIREBASE_SECONDS.time(op=op, path=self._pattern):
+                return method(*args, **kwargs)
+        except Exception:
+            FIREBASE_ERRORS.inc(op=op, path=self._pattern)
+            raise
+
+    def get(self, *args, **kwargs):
+        return self._request('read', self._ref.get, *args, **kwargs)
+
+    def set(self, value):
+        return self._request('write', self._ref.set, value)
+
+    def update(self, value):
+        return self._request('write', self._ref.update, value)
+
+    def delete(self):
+        return self._request('write', self._ref.delete)
+
+    def transaction(self, transaction_update):
+        return self._request('write', self._ref.transaction, transaction_update)
+
+    def push(self, *args, **kwargs):
+        ref = self._request('write', self._ref.push, *args, **kwargs)
+        return _MeteredRef(ref, self._pattern + '/{id}')
+
+    def child(self, path):
+        return _MeteredRef(self._ref.child(path), path_pattern(f'{self._pattern}/{path}'))
+
+    def order_by_child(self, key):
+        return _MeteredQuery(self._ref.order_by_child(key), self._pattern)
+
+
+class _MeteredQuery(_MeteredRef):
+    # order_by_child(...).equal_to(...).get(): filters chain, get() is timed as a query
+    def __getattr__(self, name):
+        attribute = getattr(self._ref, name)
+        if not callable(attribute):
+            return attribute
+        return lambda *args, **kwargs: _MeteredQuery(attribute(*args, **kwargs), self._pattern)
+
+    def get(self, *args, **kwargs):
+        return self._request('query', self._ref.get, *args, **kwargs)
+
+
+CREDENTIALS_PATH = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'credentials.json')
+DATABASE_URL = 'https://wake-up-44e5a-default-rtdb.europe-west1.firebasedatabase.app/'
+# Seconds before firebase_admin gives up on one HTTP request
+HTTP_TIMEOUT = float(os.environ.get('FIREBASE_HTTP_TIMEOUT', 3))
+
+
+def init_firebase():
+    # Initialise the default firebase_admin app once, from FIREBASE_CREDENTIALS
+    # (default credentials.json next to this module, whatever the working
+    # directory), FIREBASE_DATABASE_URL and FIREBASE_HTTP_TIMEOUT
+    import firebase_admin
+    from firebase_admin import credentials
+    try:
+        return firebase_admin.get_app()
+    except ValueError:
+        cred = credentials.Certificate(os.environ.get('FIREBASE_CREDENTIALS', CREDENTIALS_PATH))
+        # Every reference shares the app's keep-alive HTTP session; httpTimeout
+        # bounds each request, so a call ResilientStorage stopped waiting for
+        # ends too
+        return firebase_admin.initialize_app(cred, {
+            'databaseURL': os.environ.get('FIREBASE_DATABASE_URL', DATABASE_URL),
+            'httpTimeout': HTTP_TIMEOUT,
+        })
+
+
+class FirebaseStorage(Storage):
+    def __init__(self, database=None):
+        if database is None:
+            init_firebase()
+            from firebase_admin import db as database
+        self.database = database
+
+    def _ref(self, path):
+        return _MeteredRef(self.database.reference(path), path_pattern(path))
+
+    def create_user(self, user_id, data):
+        self._ref(f'users/{user_id}').set(data)
+
+    def get_user(self, user_id):
+        # A shallow read returns scalar fields without downloading the subtrees
+        data = self._ref(f'users/{user_id}').get(shallow=True)
+        if not data:
+            return None
+        return {k: v for k, v in data.items() if k not in NESTED_KEYS}
+
+    def update_user(self, user_id, fields):
+        self._ref(f'users/{user_id}').update(fields)
+
+    def list_user_ids(self):
+        return list((self._ref('users').get(shallow=True) or {}).keys())
+
+    def get_alarms(self, user_id):
+        return self._ref(f'users/{user_id}/alarms').get() or {}
+
+    def find_alarms(self, user_id, alarm_time):
+        alarms_ref = self._ref(f'users/{user_id}/alarms')
+        return alarms_ref.order_by_child('time').equal_to(alarm_time).get() or {}
+
+    def _next_alarm_rev(self, user_id):
+        return self._ref(f'users/{user_id}/alarms_rev').transaction(lambda rev: (rev or 0) + 1)
+
+    def add_alarm(self, user_id, alarm, alarm_id=None):
+        alarms_ref = self._ref(f'users/{user_id}/alarms')
+        alarm_ref = alarms_ref.child(alarm_id) if alarm_id else alarms_ref.push()
+        alarm_ref.set(dict(alarm, rev=self._next_alarm_rev(user_id)))
+        return alarm_ref.key
+
+    def update_alarm(self, user_id, alarm_id, fields):
+        ref = self._ref(f'users/{user_id}/alarms/{alarm_id}')
+        if ref.get() is None:
+            return False
+        rev = self._next_alarm_rev(user_id)
+        # Leave the path empty if the alarm was deleted since the check above
+        updated = ref.transaction(lambda alarm: dict(alarm, **dict(fields, rev=rev)) if alarm else None)
+        return updated is not None
+
+    def delete_alarm(self, user_id, alarm_id):
+        self._ref(f'users/{user_id}/alarms/{alarm_id}').delete()
+
+    def write_alarms(self, user_id, alarms):
+        if not alarms:
+            return {}
+        # Reserve a block of revisions, then write every alarm in one multi-path update
+        last = self._ref(f'users/{user_id}/alarms_rev').transaction(lambda rev: (rev or 0) + len(alarms))
+        revs = {alarm_id: last - len(alarms) + n for n, alarm_id in enumerate(alarms, 1)}
+        self._ref(f'users/{user_id}/alarms').update(
+            {alarm_id: dict(alarm, rev=revs[alarm_id]) for alarm_id, alarm in alarms.items()})
+        return revs
+
+    def get_hardware(self, user_id):
+        return self._ref(f'users/{user_id}/hardware').get() or {}
+
+    def set_hardware(self, user_id, field, value):
+        self._ref(f'users/{user_id}/hardware/{field}').set(value)
+
+    def get_sessions(self, user_id):
+        return self._ref(f'users/{user_id}/sessions').get() or {}
+
+    def count_sessions(self, user_id):
+        return len(self._ref(f'users/{user_id}/sessions').get(shallow=True) or {})
+
+    def add_session(self, user_id, key, duration, start=None):
+        self._ref(f'users/{user_id}/sessions/{key}').set(session_value(duration, start))
+        self._ref(f'users/{user_id}/insights').transaction(
+            lambda summary: apply_session(summary, key, duration, start))
+
+    def get_insights(self, user_id):
+        return self._ref(f'users/{user_id}/insights').get()
+
+    def save_insights(self, user_id, summary):
+        self._ref(f'users/{user_id}/insights').set(summary)
+
+    def get_current_user(self):
+        return self._ref('current-user').get()
+
+    def set_current_user(self, user_id):
+        self._ref('current-user').set(user_id)
+
+    def write_paths(self, user_id, updates):
+        self._ref(f'users/{user_id}' if user_id is not None else '/').update(updates)
+
+
+class MemoryStorage(Storage):
+    def __init__(self):
+        self._users = {}
+        self._current_user = None
+        self._lock = threading.Lock()
+
+    def _user(self, user_id):
+        return self._users.setdefault(user_id, {'profile': {}, 'alarms': {}, 'hardware': {}, 'sessions': {},
+                                                'insights': None, 'alarms_rev': 0})
+
+    def create_user(self, user_id, data):
+        with self._lock:
+            data = copy.deepcopy(data)
+            self._users[user_id] = {
+                'profile': {k: v for k, v in data.items() if k not in NESTED_KEYS},
+                'alarms': data.get('alarms') or {},
+                'hardware': data.get('hardware') or {},
+                'sessions': data.get('sessions') or {},
+                'insights': data.get('insights'),
+                'alarms_rev': alarms_revision(data.get('alarms')),
+            }
+
+    def get_user(self, user_id):
+        with self._lock:
+            user = self._users.get(user_id)
+            return dict(user['profile']) if user else None
+
+    def update_user(self, user_id, fields):
+        with self._lock:
+            self._user(user_id)['profile'].update(copy.deepcopy(fields))
+
+    def list_user_ids(self):
+        with self._lock:
+            return list(self._users)
+
+    def get_alarms(self, user_id):
+        with self._lock:
+            user = self._users.get(user_id)
+            return copy.deepcopy(user['alarms']) if user else {}
+
+    def find_alarms(self, user_id, alarm_time):
+        return {aid: alarm for aid, alarm in self.get_alarms(user_id).items()
+                if alarm.get('time') == alarm_time}
+
+    def add_alarm(self, user_id, alarm, alarm_id=None):
+        alarm_id = alarm_id or uuid.uuid4().hex
+        with self._lock:
+            user = self._user(user_id)
+            user['alarms_rev'] += 1
+            user['alarms'][alarm_id] = dict(copy.deepcopy(alarm), rev=user['alarms_rev'])
+        return alarm_id
+
+    def update_alarm(self, user_id, alarm_id, fields):
+        with self._lock:
+            user = self._users.get(user_id)
+            if not user or alarm_id not in user['alarms']:
+                return False
+            user['alarms_rev'] += 1
+            user['alarms'][alarm_id].update(copy.deepcopy(fields), rev=user['alarms_rev'])
+            return True
+
+    def delete_alarm(self, user_id, alarm_id):
+        with self._lock:
+            self._user(user_id)['alarms'].pop(alarm_id, None)
+
+    def write_alarms(self, user_id, alarms):
+        revs = {}
+        with self._lock:
+            user = self._user(user_id)
+            for alarm_id, alarm in alarms.items():
+                user['alarms_rev'] += 1
+                revs[alarm_id] = user['alarms_rev']
+                user['alarms'][alarm_id] = dict(copy.deepcopy(alarm), rev=user['alarms_rev'])
+        return revs
+
+    def get_hardware(self, user_id):
+        with self._lock:
+            user = self._users.get(user_id)
+            return dict(user['hardware']) if user else {}
+
+    def set_hardware(self, user_id, field, value):
+        with self._lock:
+            self._user(user_id)['hardware'][field] = value
+
+    def get_sessions(self, user_id):
+        with self._lock:
+            user = self._users.get(user_id)
+            return dict(user['sessions']) if user else {}
+
+    def count_sessions(self, user_id):
+        with self._lock:
+            user = self._users.get(user_id)
+            return len(user['sessions']) if user else 0
+
+    def add_session(self, user_id, key, duration, start=None):
+        with self._lock:
+            user = self._user(user_id)
+            user['sessions'][key] = session_value(duration, start)
+            user['insights'] = apply_session(user['insights'], key, duration, start)
+
+    def get_insights(self, user_id):
+        with self._lock:
+            user = self._users.get(user_id)
+            return copy.deepcopy(user['insights']) if user else None
+
+    def save_insights(self, user_id, summary):
+        with self._lock:
+            self._user(user_id)['insights'] = copy.deepcopy(summary)
+
+    def get_current_user(self):
+        return self._current_user
+
+    def set_current_user(self, user_id):
+        self._current_user = user_id
+
+
+SQLITE_SCHEMA = """
+CREATE TABLE IF NOT EXISTS users (
+    id TEXT PRIMARY KEY,
+    profile TEXT NOT NULL DEFAULT '{}'
+);
+CREATE TABLE IF NOT EXISTS alarms (
+    id TEXT PRIMARY KEY,
+    user_id TEXT NOT NULL,
+    time TEXT,
+    status TEXT,
+    rev INTEGER NOT NULL DEFAULT 0,
+    data TEXT NOT NULL DEFAULT '{}'
+);
+CREATE INDEX IF NOT EXISTS idx_alarms_user_time_status ON alarms (user_id, time, status);
+CREATE TABLE IF NOT EXISTS hardware (
+    user_id TEXT NOT NULL,
+    field TEXT NOT NULL,
+    value TEXT,
+    PRIMARY KEY (user_id, field)
+);
+CREATE TABLE IF NOT EXISTS sessions (
+    user_id TEXT NOT NULL,
+    key TEXT NOT NULL,
+    duration REAL,
+    start REAL,
+    PRIMARY KEY (user_id, key)
+);
+CREATE TABLE IF NOT EXISTS alarm_revisions (
+    user_id TEXT PRIMARY KEY,
+    rev INTEGER NOT NULL
+);
+CREATE TABLE IF NOT EXISTS insights (
+    user_id TEXT PRIMARY KEY,
+    summary TEXT NOT NULL
+);
+CREATE TABLE IF NOT EXISTS meta (
+    key TEXT PRIMARY KEY,
+    value TEXT
+);
+"""
+
+
+class SQLiteStorage(Storage):
+    def __init__(self, path='instance/wakeup.db'):
+        if path != ':memory:' and os.path.dirname(path):
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+        self.path = path
+        self._conn = sqlite3.connect(path, check_same_thread=False, isolation_level=None)
+        self._lock = threading.Lock()
+        with self._lock:
+            self._conn.execute('PRAGMA journal_mode=WAL')
+            self._conn.execute('PRAGMA synchronous=NORMAL')
+            columns = [row[1] for row in self._conn.execute('PRAGMA table_info(alarms)')]
+            if columns and 'rev' not in columns:
+                self._conn.execute('ALTER TABLE alarms ADD COLUMN rev INTEGER NOT NULL DEFAULT 0')
+            columns = [row[1] for row in self._conn.execute('PRAGMA table_info(sessions)')]
+            if columns and 'start' not in columns:
+                self._conn.execute('ALTER TABLE sessions ADD COLUMN start REAL')
+            self._conn.executescript(SQLITE_SCHEMA)
+
+    def _query(self, sql, params=()):
+        with self._lock:
+            return self._conn.execute(sql, params).fetchall()
+
+    def _execute(self, sql, params=()):
+        with self._lock:
+            self._conn.execute(sql, params)
+
+    @contextmanager
+    def _transaction(self):
+        with self._lock:
+            self._conn.execute('BEGIN IMMEDIATE')
+            try:
+                yield self._conn
+            except Exception:
+                self._conn.execute('ROLLBACK')
+                raise
+            self._conn.execute('COMMIT')
+
+    @staticmethod
+    def _alarm_row(row):
+        alarm = json.loads(row[4])
+        alarm['time'] = row[1]
+        alarm['status'] = row[2]
+        alarm['rev'] = row[3]
+        return row[0], alarm
+
+    def create_user(self, user_id, data):
+        profile = {k: v for k, v in data.items() if k not in NESTED_KEYS}
+        with self._transaction() as conn:
+            conn.execute('INSERT OR REPLACE INTO users (id, profile) VALUES (?, ?)',
+                         (user_id, json.dumps(profile)))
+            for field, value in (data.get('hardware') or {}).items():
+                conn.execute('INSERT OR REPLACE INTO hardware VALUES (?, ?, ?)',
+                             (user_id, field, json.dumps(value)))
+        for alarm_id, alarm in (data.get('alarms') or {}).items():
+            self.add_alarm(user_id, alarm, alarm_id)
+        for key, value in (data.get('sessions') or {}).items():
+            self.add_session(user_id, key, session_duration(value), session_start(key, value))
+
+    def get_user(self, user_id):
+        rows = self._query('SELECT profile FROM users WHERE id = ?', (user_id,))
+        return json.loads(rows[0][0]) if rows else None
+
+    def update_user(self, user_id, fields):
+        with self._transaction() as conn:
+            row = conn.execute('SELECT profile FROM users WHERE id = ?', (user_id,)).fetchone()
+            profile = json.loads(row[0]) if row else {}
+            profile.update(fields)
+            conn.execute('INSERT OR REPLACE INTO users (id, profile) VALUES (?, ?)',
+                         (user_id, json.dumps(profile)))
+
+    def list_user_ids(self):
+        return [row[0] for row in self._query('SELECT id FROM users')]
+
+    def get_alarms(self, user_id):
+        rows = self._query('SELECT id, time, status, rev, data FROM alarms WHERE user_id = ?', (user_id,))
+        return dict(self._alarm_row(row) for row in rows)
+
+    def find_alarms(self, user_id, alarm_time):
+        rows = self._query('SELECT id, time, status, rev, data FROM alarms WHERE user_id = ? AND time = ?',
+                           (user_id, alarm_time))
+        return dict(self._alarm_row(row) for row in rows)
+
+    def add_alarm(self, user_id, alarm, alarm_id=None):
+        alarm_id = alarm_id or uuid.uuid4().hex
+        with self._transaction() as conn:
+            self._write_alarm(conn, user_id, alarm_id, alarm)
+        return alarm_id
+
+    @staticmethod
+    def _write_alarm(conn, user_id, alarm_id, alarm):
+        # Must run inside a transaction so the revision bump and the write are atomic
+        conn.execute('INSERT INTO alarm_revisions VALUES (?, 1) '
+                     'ON CONFLICT(user_id) DO UPDATE SET rev = rev + 1', (user_id,))
+        rev = conn.execute('SELECT rev FROM alarm_revisions WHERE user_id = ?', (user_id,)).fetchone()[0]
+        extra = {k: v for k, v in alarm.items() if k not in ('time', 'status', 'rev')}
+        conn.execute('INSERT OR REPLACE INTO alarms (id, user_id, time, status, rev, data) VALUES (?, ?, ?, ?, ?, ?)',
+                     (alarm_id, user_id, alarm.get('time'), alarm.get('status'), rev, json.dumps(extra)))
+        return rev
+
+    def update_alarm(self, user_id, alarm_id, fields):
+        with self._transaction() as conn:
+            row = conn.execute('SELECT id, time, status, rev, data FROM alarms WHERE id = ? AND user_id = ?',
+                               (alarm_id, user_id)).fetchone()
+            if not row:
+                return False
+            alarm = self._alarm_row(row)[1]
+            alarm.update(fields)
+            self._write_alarm(conn, user_id, alarm_id, alarm)
+            return True
+
+    def delete_alarm(self, user_id, alarm_id):
+        self._execute('DELETE FROM alarms WHERE id = ? AND user_id = ?', (alarm_id, user_id))
+
+    def write_alarms(self, user_id, alarms):
+        with self._transaction() as conn:
+            return {alarm_id: self._write_alarm(conn, user_id, alarm_id, alarm)
+                    for alarm_id, alarm in alarms.items()}
+
+    def get_hardware(self, user_id):
+        rows = self._query('SELECT field, value FROM hardware WHERE user_id = ?', (user_id,))
+        return {field: json.loads(value) for field, value in rows}
+
+    def set_hardware(self, user_id, field, value):
+        self._execute('INSERT OR REPLACE INTO hardware VALUES (?, ?, ?)', (user_id, field, json.dumps(value)))
+
+    def get_sessions(self, user_id):
+        rows = self._query('SELECT key, duration, start FROM sessions WHERE user_id = ?', (user_id,))
+        return {key: session_value(duration, start) for key, duration, start in rows}
+
+    def count_sessions(self, user_id):
+        return self._query('SELECT COUNT(*) FROM sessions WHERE user_id = ?', (user_id,))[0][0]
+
+    def add_session(self, user_id, key, duration, start=None):
+        with self._transaction() as conn:
+            conn.execute('INSERT OR REPLACE INTO sessions (user_id, key, duration, start) VALUES (?, ?, ?, ?)',
+                         (user_id, key, duration, start))
+            row = conn.execute('SELECT summary FROM insights WHERE user_id = ?', (user_id,)).fetchone()
+            summary = apply_session(json.loads(row[0]) if row else None, key, duration, start)
+            conn.execute('INSERT OR REPLACE INTO insights VALUES (?, ?)', (user_id, json.dumps(summary)))
+
+    def get_insights(self, user_id):
+        rows = self._query('SELECT summary FROM insights WHERE user_id = ?', (user_id,))
+        return json.loads(rows[0][0]) if rows else None
+
+    def save_insights(self, user_id, summary):
+        self._execute('INSERT OR REPLACE INTO insights VALUES (?, ?)', (user_id, json.dumps(summary)))
+
+    def get_current_user(self):
+        rows = self._query("SELECT value FROM meta WHERE key = 'current-user'")
+        return rows[0][0] if rows else None
+
+    def set_current_user(self, user_id):
+        self._execute("INSERT OR REPLACE INTO meta VALUES ('current-user', ?)", (user_id,))
+
+    def close(self):
+        with self._lock:
+            self._conn.close()
+
+
+def open_storage(backend=None):
+    # WAKEUP_STORAGE selects the backend: firebase (default), sqlite, memory, or
+    # fake (the Firebase code path against the in-memory fakedb, for offline runs)
+    backend = (backend or os.environ.get('WAKEUP_STORAGE', 'firebase')).lower()
+    if backend == 'firebase':
+        return FirebaseStorage()
+    if backend == 'fake':
+        from fakedb import FakeDatabase
+        return FirebaseStorage(FakeDatabase())
+    if backend == 'sqlite':
+        return SQLiteStorage(os.environ.get('WAKEUP_SQLITE_PATH', 'instance/wakeup.db'))
+    if backend == 'memory':
+        return MemoryStorage()
+    raise ValueError(f"Unknown storage backend: {backend}")
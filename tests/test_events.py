@@ -0,0 +1,50 @@
+import os
+import sys
+import threading
+import time
+import unittest
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+
+from events import EventBus
+
+
+class ChannelEvictionTest(unittest.TestCase):
+    def test_idle_channels_are_dropped(self):
+        bus = EventBus(channel_ttl=0.05, sweep_interval=0)
+        for n in range(100):
+            bus.update_section(f'user-{n}', 'hardware', {'motor': 1})
+        self.assertEqual(bus.channels(), 100)
+        time.sleep(0.1)
+        bus.last_id('someone-else')
+        self.assertEqual(bus.channels(), 1)
+
+    def test_channel_with_a_stream_is_kept(self):
+        bus = EventBus(channel_ttl=0.05, sweep_interval=0, heartbeat=0.01)
+        stop = threading.Event()
+        stream = bus.subscribe('u', stop=stop)
+        next(stream)  # snapshot; the stream now holds the channel
+        time.sleep(0.1)
+        bus.last_id('someone-else')
+        self.assertEqual(bus.channels(), 2)
+        stop.set()
+        stream.close()
+        time.sleep(0.1)
+        bus.last_id('someone-else')
+        self.assertEqual(bus.channels(), 1)
+
+    def test_old_event_id_gets_a_snapshot_after_eviction(self):
+        bus = EventBus(channel_ttl=0.05, sweep_interval=0)
+        for n in range(5):
+            event_id = bus.update_section('u', 'hardware', {'motor': n})
+        time.sleep(0.1)
+        bus.last_id('someone-else')  # evicts u
+        for n in range(10):
+            bus.update_section('u', 'hardware', {'pressure': n})
+        first = next(bus.subscribe('u', last_event_id=event_id))
+        self.assertIn('event: snapshot', first)
+        self.assertIn('"pressure":9', first)
+
+
+if __name__ == '__main__':
+    unittest.main()
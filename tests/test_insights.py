@@ -0,0 +1,32 @@
+import os
+import sys
+import unittest
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+
+from insights import build_summary, is_current
+from storage import MemoryStorage
+
+
+class SummaryDriftTest(unittest.TestCase):
+    def test_sessions_written_behind_the_summary_are_noticed(self):
+        store = MemoryStorage()
+        store.create_user('u', {'email': 'u@example.com'})
+        store.add_session('u', 's1', 400)
+        store.add_session('u', 's2', 380)
+        self.assertTrue(is_current(store.get_insights('u'), store.count_sessions('u')))
+        # The pillow firmware writes sessions directly, without the summary
+        store._users['u']['sessions']['s3'] = 420
+        self.assertFalse(is_current(store.get_insights('u'), store.count_sessions('u')))
+        rebuilt = build_summary(store.get_sessions('u'))
+        self.assertEqual(rebuilt['count'], 3)
+        self.assertTrue(is_current(rebuilt, store.count_sessions('u')))
+
+    def test_sessions_without_a_duration_do_not_force_a_rebuild_every_time(self):
+        summary = build_summary({'s1': 400, 's2': {'start': 1760810400}})
+        self.assertEqual(summary['count'], 1)
+        self.assertTrue(is_current(summary, 2))
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,48 @@
+import os
+import sys
+import unittest
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+
+from motor import MotorController
+
+# Two processes driving the same pillow: each has its own MotorController
+# writing to one shared database.
+
+
+class TwoControllersTest(unittest.TestCase):
+    def setUp(self):
+        self.db = {}
+        self.now = 1000.0
+        clock = lambda: self.now
+        self.engine = MotorController(lambda user_id, value: self.db.__setitem__(user_id, value), clock=clock)
+        self.web = MotorController(lambda user_id, value: self.db.__setitem__(user_id, value), clock=clock)
+
+    def test_stop_from_another_controller_turns_the_motor_off(self):
+        self.web.stop('u')  # the web process last saw the motor off
+        self.engine.start('u', 60)
+        self.assertEqual(self.db['u'], 1)
+        self.web.stop('u')
+        self.assertEqual(self.db['u'], 0)
+
+    def test_observed_values_keep_the_next_write(self):
+        # The engine turns the motor on and the web process hears of it
+        self.engine.start('u', 60)
+        self.web.observe('u', 1)
+        # The engine switches it off again; without this observe() the web
+        # process would still think it is on and skip its next start
+        self.engine.stop('u')
+        self.web.observe('u', 0)
+        self.web.start('u', 60)
+        self.assertEqual(self.db['u'], 1)
+
+    def test_observed_value_skips_an_identical_write(self):
+        self.engine.start('u', 60)
+        self.web.observe('u', 1)
+        writes = self.web.writes
+        self.web.start('u', 60)
+        self.assertEqual(self.web.writes, writes)
+        self.assertEqual(self.db['u'], 1)
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,185 @@
+import argparse
+import json
+import os
+import random
+import sys
+import tempfile
+import threading
+import time
+
+# Fake pillows for load-testing /device/sync.
+#
+# Each simulated device samples a force sensor every --sample-ms, buffers the
+# readings and syncs them in batches, long-polling for motor and schedule
+# changes the way the firmware should. Against a running server:
+#
+#   python tools/device_sim.py --url http://127.0.0.1:5000 --devices 2000 --duration 60
+#
+# Without --url the app is imported and driven in-process through Flask's test
+# client on in-memory storage, which measures the endpoint without the network:
+#
+#   python tools/device_sim.py --devices 500 --duration 20 --json
+
+FORCE_ON = (450, 900)   # someone lying on the pillow
+FORCE_OFF = (0, 120)
+
+
+class FakePillow:
+    def __init__(self, user_id, rng, occupied_probability=0.5):
+        self.user_id = user_id
+        self.rng = rng
+        self.occupied = rng.random() < occupied_probability
+        self.motor = None
+        self.rev = None
+        self.buffer = []
+
+    def sample(self):
+        # Occupancy flips rarely, so most batches report no change
+        if self.rng.random() < 0.002:
+            self.occupied = not self.occupied
+        low, high = FORCE_ON if self.occupied else FORCE_OFF
+        self.buffer.append(self.rng.randint(low, high))
+
+    def payload(self, wait, interval_ms):
+        readings, self.buffer = self.buffer, []
+        return {'user': self.user_id, 'readings': readings, 'interval': interval_ms,
+                'motor': self.motor, 'rev': self.rev, 'wait': wait}
+
+    def apply(self, state):
+        motor_changed = self.motor is not None and state.get('motor') != self.motor
+        self.motor = state.get('motor')
+        self.rev = state.get('rev')
+        return motor_changed
+
+
+class HttpTransport:
+    def __init__(self, url, token=None):
+        import requests
+        self.url = url.rstrip('/') + '/device/sync'
+        self.headers = {'X-Device-Token': token} if token else {}
+        self.local = threading.local()
+        self.requests = requests
+
+    def post(self, payload):
+        session = getattr(self.local, 'session', None)
+        if session is None:
+            session = self.local.session = self.requests.Session()  # keep-alive per device thread
+        response = session.post(self.url, json=payload, headers=self.headers, timeout=60)
+        return response.status_code, response.json()
+
+
+class InProcessTransport:
+    def __init__(self, devices, token=None):
+        os.environ.setdefault('WAKEUP_STORAGE', 'memory')
+        os.environ.setdefault('PRESSURE_DIR', os.path.join(tempfile.mkdtemp(prefix='device-sim-'), 'pressure'))
+        # /device/sync refuses requests unless the server has a device token
+        token = os.environ.setdefault('DEVICE_TOKEN', token or 'device-sim')
+        root = os.path.join(os.path.dirname(os.path.abspath(__file__)), '..')
+        sys.path.insert(0, root)
+        import voicerec
+        self.app = voicerec.app
+        self.headers = {'X-Device-Token': token}
+        for n in range(devices):
+            voicerec.store.create_user(f'sim-{n}', {'email': f'sim-{n}@example.com', 'hardware': {'pressure': 0, 'motor': 0}})
+        self.local = threading.local()
+
+    def post(self, payload):
+        client = getattr(self.local, 'client', None)
+        if client is None:
+            client = self.local.client = self.app.test_client()
+        response = client.post('/device/sync', json=payload, headers=self.headers)
+        return response.status_code, response.get_json()
+
+
+def run_device(pillow, transport, args, stop, results):
+    samples_per_batch = max(1, int(args.batch_seconds * 1000 / args.sample_ms))
+    latencies = []
+    requests_sent = errors = readings = motor_changes = 0
+    while not stop.is_set():
+        for _ in range(samples_per_batch):
+            pillow.sample()
+        readings += len(pillow.buffer)
+        started = time.perf_counter()
+        try:
+            status, state = transport.post(pillow.payload(args.wait, args.sample_ms))
+        except Exception:
+            errors += 1
+            stop.wait(1.0)
+            continue
+        latencies.append(time.perf_counter() - started)
+        requests_sent += 1
+        if status != 200:
+            errors += 1
+            continue
+        motor_changes += pillow.apply(state)
+        if not args.wait:
+            # Plain polling: sleep out the batch window
+            stop.wait(args.batch_seconds)
+    results.append({'requests': requests_sent, 'errors': errors, 'readings': readings,
+                    'motor_changes': motor_changes, 'latencies': latencies})
+
+
+def summarize(results, elapsed, devices):
+    latencies = sorted(value for result in results for value in result['latencies'])
+    total = sum(result['requests'] for result in results)
+
+    def percentile(fraction):
+        return round(latencies[min(len(latencies) - 1, int(len(latencies) * fraction))] * 1000, 2) if latencies else None
+
+    return {
+        'devices': devices,
+        'seconds': round(elapsed, 2),
+        'requests': total,
+        'requests_per_second': round(total / elapsed, 1) if elapsed else None,
+        'readings_per_second': round(sum(r['readings'] for r in results) / elapsed, 1) if elapsed else None,
+        'errors': sum(result['errors'] for result in results),
+        'motor_changes': sum(result['motor_changes'] for result in results),
+        'latency_ms': {'p50': percentile(0.5), 'p95': percentile(0.95), 'p99': percentile(0.99),
+                       'max': round(latencies[-1] * 1000, 2) if latencies else None},
+    }
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Simulate pillows syncing with /device/sync")
+    parser.add_argument('--url', help="server base URL; omit to drive the app in-process")
+    parser.add_argument('--devices', type=int, default=100)
+    parser.add_argument('--duration', type=float, default=30.0, help="seconds to run")
+    parser.add_argument('--sample-ms', type=int, default=500, help="force sensor sample interval")
+    parser.add_argument('--batch-seconds', type=float, default=5.0, help="readings per sync request")
+    parser.add_argument('--wait', type=float, default=0.0,
+                        help="long-poll seconds per request (0 polls every --batch-seconds)")
+    parser.add_argument('--token', default=os.environ.get('DEVICE_TOKEN'))
+    parser.add_argument('--seed', type=int, default=1)
+    parser.add_argument('--json', action='store_true')
+    args = parser.parse_args(argv)
+
+    transport = HttpTransport(args.url, args.token) if args.url else InProcessTransport(args.devices, args.token)
+    rng = random.Random(args.seed)
+    pillows = [FakePillow(f'sim-{n}', random.Random(rng.random())) for n in range(args.devices)]
+
+    stop = threading.Event()
+    results = []
+    threads = [threading.Thread(target=run_device, args=(pillow, transport, args, stop, results), daemon=True)
+               for pillow in pillows]
+    started = time.perf_counter()
+    for thread in threads:
+        thread.start()
+    time.sleep(args.duration)
+    stop.set()
+    for thread in threads:
+        thread.join(args.wait + 65)
+    summary = summarize(results, time.perf_counter() - started, args.devices)
+
+    if args.json:
+        print(json.dumps(summary, indent=2))
+    else:
+        latency = summary['latency_ms']
+        print(f"{summary['devices']} devices, {summary['seconds']}s: {summary['requests']} requests "
+              f"({summary['requests_per_second']}/s), {summary['readings_per_second']} readings/s, "
+              f"{summary['errors']} errors, {summary['motor_changes']} motor changes")
+        print(f"latency ms: p50 {latency['p50']}, p95 {latency['p95']}, p99 {latency['p99']}, max {latency['max']}")
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
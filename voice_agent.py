@@ -0,0 +1,210 @@
+import queue
+import time
+
+import speech_recognition as sr
+
+import intents
+import metrics
+from audio_stream import MicrophoneStream
+from wakeword import KeywordSpotter, WAKE_WORDS
+
+# The voice role: the always-open microphone, local wake word spotting, cloud
+# speech recognition and intent parsing. Recognised commands are handed to the
+# app's CommandBus, whose handlers do the actual alarm work. Only processes that
+# run this role import speech_recognition and open the microphone; voicerec
+# imports this module lazily from start_voice().
+
+VOICE_STAGE_SECONDS = metrics.histogram('wakeup_voice_stage_seconds', "Voice pipeline stage duration",
+                                        ['stage'], buckets=(0.001, 0.01, 0.05, 0.1, 0.25, 0.5, 1.0, 2.0,
+                                                            3.0, 5.0, 10.0))
+MAX_CONSECUTIVE_ERRORS = 2
+
+
+class VoiceAgent:
+    def __init__(self, command_bus, current_user, set_status, local_now, sensitivity=0.8, min_energy=300):
+        # current_user() -> the user id commands apply to, or None
+        # set_status(status) publishes 'idle' / 'listening' to the dashboard
+        # local_now(user_id) -> the user's local datetime, for relative times
+        self.command_bus = command_bus
+        self.current_user = current_user
+        self.set_status = set_status
+        self.local_now = local_now
+        self.min_energy = min_energy
+        self.recognizer = sr.Recognizer()
+        # Wake words are spotted locally; sensitivity trades misses for false wakes
+        self.wake_word_spotter = KeywordSpotter(WAKE_WORDS, sensitivity, self.recognizer)
+        self.mic_stream = None
+        self.last_command = ""
+
+    def get_mic_stream(self):
+        if self.mic_stream is None:
+            self.mic_stream = MicrophoneStream(min_energy=self.min_energy).start()
+        return self.mic_stream
+
+    def next_utterance(self, timeout):
+        # The 'capture' stage runs from speech onset until the utterance is
+        # ready; the idle wait for someone to speak is not counted
+        mic = self.get_mic_stream()
+        audio = mic.next_utterance(timeout=timeout)
+        if audio is not None:
+            VOICE_STAGE_SECONDS.observe(max(0.0, time.time() - mic.last_onset), stage='capture')
+        return audio
+
+    def submit(self, name, *args):
+        # The 'action' stage runs from here until the handler has finished on a worker
+        started = time.perf_counter()
+        try:
+            future = self.command_bus.submit(name, *args)
+        except queue.Full:
+            print(f"⚠️ Command queue full, dropping {name}")
+            return
+        future.add_done_callback(
+            lambda _: VOICE_STAGE_SECONDS.observe(time.perf_counter() - started, stage='action'))
+
+    # Function to recognize voice input
+    def get_voice_command(self):
+        try:
+            print("Listening for an alarm command...")
+            audio = self.next_utterance(timeout=5)
+            if audio is None:
+                print("Timeout - No speech detected")
+                return None
+
+            with VOICE_STAGE_SECONDS.time(stage='recognition'):
+                command = self.recognizer.recognize_google(audio).lower()
+            if command:
+                self.last_command = command
+            print(f"Recognized: {command}")
+            return command
+        except sr.UnknownValueError:
+            print("Could not understand audio")
+            return None
+        except sr.RequestError as e:
+            print(f"Speech service error: {e}")
+            return None
+        except Exception as e:
+            print(f"Error in voice recognition: {e}")
+            return None
+
+    def listen_for_wake_word(self):
+        try:
+            audio = self.next_utterance(timeout=3)
+            if audio is None:
+                return False
+
+            # On-device keyword search; no network unless it hits
+            with VOICE_STAGE_SECONDS.time(stage='wake_word'):
+                return self.wake_word_spotter.detect(audio) or False
+
+        except sr.RequestError as e:
+            print(f"❌ Local wake word spotting unavailable (is PocketSphinx installed?): {e}")
+            return False
+        except Exception as e:
+            print(f"Error in wake word detection: {e}")
+            return False
+
+    def handle(self, user_id, voice_command):
+        with VOICE_STAGE_SECONDS.time(stage='parse'):
+            command = intents.parse(voice_command)
+        intent = command['intent']
+
+        if intent == 'set_alarm':
+            now = self.local_now(user_id)
+            alarm_time = intents.resolve_time(command, now)
+            day = None if command['repeat'] else intents.resolve_date(command, now)
+            if not alarm_time:
+                print("❌ Could not extract time. Please include a specific time.")
+            elif day == now.date() and alarm_time <= now.strftime("%H:%M:%S"):
+                print(f"❌ {alarm_time} has already passed today")
+            else:
+                # "every weekday at 7" repeats on weekdays [0..4]; "tomorrow", "on
+                # monday" and "in 20 minutes" ring once on that date; a bare time
+                # is a plain daily alarm
+                if command['repeat']:
+                    repeat = {'weekdays': command['repeat']}
+                    print(f"✅ Setting alarm for {alarm_time} on days {command['repeat']}")
+                elif day is not None:
+                    repeat = {'date': day.isoformat()}
+                    print(f"✅ Setting a one-time alarm for {alarm_time} on {day.isoformat()}")
+                else:
+                    repeat = None
+                    print(f"✅ Setting alarm for {alarm_time}")
+                self.submit('create', user_id, alarm_time, repeat)
+
+        # Cancel alarm commands
+        elif intent == 'cancel_alarm':
+            if command['index'] is not None:
+                self.submit('cancel', user_id, command['index'])
+            else:
+                print("❌ Could not determine which alarm. Please specify like 'Cancel alarm 3'")
+
+        # List alarms command
+        elif intent == 'list_alarms':
+            self.submit('list', user_id)
+
+        # Help command
+        elif intent == 'help':
+            print("\n🔧 Available Voice Commands:")
+            print("Set alarm [time] - Set a new alarm (e.g. 'at 7:30 am', 'in 20 minutes')")
+            print("Cancel alarm [number] - Cancel an existing alarm")
+            print("List alarms - Show all alarms")
+            print("Help - Show this help message")
+
+        # Reset wake word detection if user wants to stop
+        elif intent == 'stop_listening':
+            print("✅ Returning to wake word detection mode")
+
+        else:
+            print("⚠️ Command not recognized. Say 'help' for available commands")
+
+    def run(self):
+        print("Voice recognition system started")
+        consecutive_errors = 0
+        wake_word_detected = False  # Track if wake word was detected
+
+        while True:
+            try:
+                # 1. PRIORITIZE USER CONNECTION CHECK FIRST
+                user_id = self.current_user()
+                if user_id is None:
+                    print("No active user - skipping voice command")
+                    self.set_status("idle")
+                    time.sleep(2)
+                    continue
+
+                # Set alarm commands
+                if not wake_word_detected:
+                    wake_word_detected = self.listen_for_wake_word()
+                    if wake_word_detected and "stop" in wake_word_detected:
+                        print("DETECTED STP")
+                        self.submit('stop_motor', user_id)
+
+                    self.set_status("idle")
+                    if not wake_word_detected:
+                        continue  # next_utterance already blocks until someone speaks
+                    print("Wake word detected! Listening for commands...")
+                    self.set_status("listening")
+                voice_command = self.get_voice_command()
+
+                if voice_command:
+                    print(f"Voice command detected: {voice_command}")
+                    consecutive_errors = 0
+                    self.handle(user_id, voice_command)
+                    wake_word_detected = False
+                    self.set_status("idle")
+
+                else:
+                    consecutive_errors += 1
+                    if consecutive_errors >= MAX_CONSECUTIVE_ERRORS:
+                        print("⚠️ Too many consecutive errors. Resetting voice recognition...")
+                        consecutive_errors = 0
+                        wake_word_detected = False  # Reset wake word detection
+                        self.set_status("idle")
+                        time.sleep(2)
+
+            except Exception as e:
+                print(f"⚠️ Unexpected error: {str(e)}")
+                consecutive_errors += 1
+                wake_word_detected = False  # Reset on error
+                self.set_status("idle")
+                time.sleep(1)
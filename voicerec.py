@@ -1,52 +1,127 @@
-import speech_recognition as sr
-import re
+import argparse
+import hmac
+import math
 import time
 import uuid
-from datetime import datetime, timedelta
-from flask import Flask, jsonify,  request, render_template, redirect, url_for, session
-import firebase_admin
-from firebase_admin import db, auth
-from threading import Lock
+from datetime import datetime
+from flask import Flask, Response, jsonify,  request, render_template, redirect, url_for, session, g
 import threading
 import traceback
 from flask_cors import CORS
 import os
-import requests
-import pytz
-from apscheduler.schedulers.background import BackgroundScheduler
-
-app = Flask(__name__)
-CORS(app)
+from alarm_engine import ShardedAlarmEngine
+from concurrent.futures import ThreadPoolExecutor
+from state_mirror import StateMirror
+from storage import open_storage, alarms_revision, init_firebase, HTTP_TIMEOUT
+from cache import CachedStorage
+from write_buffer import WriteBuffer
+from resilience import ResilientStorage, CircuitBreaker, inject_faults
+from insights import build_summary, is_current, normalize_summary, render_summary
+from events import EventBus
+from motor import MotorController
+from command_bus import CommandBus
+from pressure_store import PressureStore, MISSING as MISSING_SAMPLE, is_valid_user_id
+from session_detector import SessionDetector
+from shared_state import open_shared_state
+import atexit
+import metrics
+import recurrence
+import wallclock
+
+# Importing this module only builds the Flask app and cheap in-memory objects:
+# no threads are started, Firebase is initialised by the storage backend or the
+# account routes when they need it, and the voice stack (speech_recognition, the
+# microphone) is only imported by processes running the voice role. See
+# create_app() at the bottom.
 
 # Initialize Flask app
 app = Flask(__name__)
+CORS(app)
 if os.environ.get("FLASK_ENV") == "production":
     app.config['SESSION_COOKIE_SECURE'] = True
 else:
     app.config['SESSION_COOKIE_SECURE'] = False
-# Initialize Firebase
-cred = firebase_admin.credentials.Certificate('credentials.json')
-firebase_admin.initialize_app(cred, {
-    'databaseURL': 'https://wake-up-44e5a-default-rtdb.europe-west1.firebasedatabase.app/',
-})
 app.secret_key = '98105116'
-# Global variables
-active_timers = {}
-alarm_lock = threading.Lock()
-active_users = {}
-user_lock = Lock()
-current_user_id = None
-is_user_logged_in = False
-last_command = ""
-wake_word_detected=False
-sleep_start = None
-sleep_start_times = {}
-
-# Firebase database reference
-root_ref = db.reference()
+
+# State every worker process has to agree on (WAKEUP_SHARED_STATE=local|sqlite;
+# unset, it is local until create_app() starts only some of the roles):
+#   current_user          who is on the pillow; voice commands and devices act for them
+#   voice_status          'idle' / 'listening', set by the voice role
+#   active_users/<uid>    logged-in users, with their login time
+#   alarms/<uid>          bumped when a user's alarms change, so the engine
+#                         process and other workers' dashboards catch up
+#   hardware/<uid>        latest motor/pressure values written by any process
+shared_state = open_shared_state()
+
+
+def get_current_user_id():
+    return shared_state.get('current_user')
+
+
+# Change feed behind the dashboard's /stream endpoint
+event_bus = EventBus()
+
+
+# Alarm and hardware changes go to this process's event bus straight away and
+# through shared state to the other processes (see on_shared_change)
+def publish(user_id, section, changes):
+    event_bus.update_section(user_id, section, changes)
+    if section == 'hardware':
+        shared_state.update(f'hardware/{user_id}', lambda current: dict(current, **changes), default={})
+    elif section == 'alarms':
+        shared_state.set(f'alarms/{user_id}', wallclock.now())
+
+# Persistence backend (WAKEUP_STORAGE=firebase|sqlite|memory) behind a per-user read cache
+# with small hot-path writes (motor, pressure, current user) batched per user
+# every WAKEUP_WRITE_BUFFER_MS. Every backend call has a WAKEUP_STORAGE_DEADLINE_MS
+# deadline and a circuit breaker (see resilience.py); WAKEUP_FAULTS injects
+# latency and outages underneath for local testing. The deadline is never
+# shorter than Firebase's own request timeout, so a call we stop waiting for
+# doesn't keep running much longer.
+STORAGE_DEADLINE = float(os.environ.get('WAKEUP_STORAGE_DEADLINE_MS', HTTP_TIMEOUT * 1000)) / 1000
+if STORAGE_DEADLINE < HTTP_TIMEOUT:
+    print(f"⚠️ WAKEUP_STORAGE_DEADLINE_MS is below FIREBASE_HTTP_TIMEOUT, using {HTTP_TIMEOUT:.1f}s")
+    STORAGE_DEADLINE = HTTP_TIMEOUT
+resilient_store = ResilientStorage(
+    inject_faults(open_storage(), os.environ.get('WAKEUP_FAULTS')),
+    deadline=STORAGE_DEADLINE,
+    retries=int(os.environ.get('WAKEUP_STORAGE_RETRIES', 2)),
+    breaker=CircuitBreaker(failure_threshold=int(os.environ.get('WAKEUP_BREAKER_FAILURES', 5)),
+                           reset_timeout=float(os.environ.get('WAKEUP_BREAKER_RESET_SECONDS', 15))))
+write_buffer = WriteBuffer(resilient_store, interval=float(os.environ.get('WAKEUP_WRITE_BUFFER_MS', 50)) / 1000)
+store = CachedStorage(write_buffer, max_entries=int(os.environ.get('WAKEUP_CACHE_SIZE', 10000)))
+
+# Served by /metrics; Firebase, scheduler and voice timings are recorded in storage.py,
+# alarm_engine.py and voice_agent.py
+HTTP_REQUEST_SECONDS = metrics.histogram('wakeup_http_request_seconds', "Time to build a response",
+                                         ['route', 'method', 'status'])
+
+
+@app.before_request
+def start_request_timer():
+    g.request_started = time.perf_counter()
+
+
+@app.after_request
+def record_request_time(response):
+    started = g.get('request_started')
+    if started is not None:
+        # Label by route pattern (/cancel_alarm/<alarm_id>), never the raw path
+        route = request.url_rule.rule if request.url_rule is not None else 'unmatched'
+        HTTP_REQUEST_SECONDS.observe(time.perf_counter() - started, route=route, method=request.method,
+                                     status=response.status_code)
+    return response
+
+
+def firebase_auth():
+    # Firebase Authentication, loaded by the account routes on first use
+    init_firebase()
+    from firebase_admin import auth
+    return auth
 
 
 def create_user(email, password):
+    auth = firebase_auth()
     try:
         print("\n[create_user] 1. Starting user creation...")
 
@@ -60,15 +135,14 @@ def create_user(email, password):
         print(f"[create_user] 2. Auth user created - UID: {user.uid}")
 
         # Create initial user data in Realtime DB
-        user_ref = db.reference(f'users/{user.uid}')
         user_data = {
             'email': email,
-            'created_at': datetime.utcnow().isoformat(),
+            'created_at': wallclock.utcnow().isoformat(),
             'alarms': {},
             'hardware': {'pressure': 0, 'motor': 0},
             'sessions': {},
         }
-        user_ref.set(user_data)
+        store.create_user(user.uid, user_data)
         print("[create_user] 3. Database record created")
 
         # ✅ Generate fake sleep sessions
@@ -86,19 +160,24 @@ def create_user(email, password):
 
 def get_user(user_id):
     try:
-        return auth.get_user(user_id)
+        return firebase_auth().get_user(user_id)
     except:
         return None
 
 
 # getting the alarms from the firebase
+# Every alarm record including cancelled tombstones, from the listener-backed
+# mirror when this user is tracked
+def get_alarm_records(user_id):
+    raw_alarms = state_mirror.get_alarms(user_id)
+    if raw_alarms is None:
+        raw_alarms = store.get_alarms(user_id)
+    return raw_alarms
+
+
 def get_all_alarms(user_id):
     try:
-        # Reference to the user's alarms in Firebase
-        alarms_ref = db.reference(f'users/{user_id}/alarms')
-
-        # Retrieve all alarms
-        raw_alarms = alarms_ref.get()
+        raw_alarms = get_alarm_records(user_id)
 
         # Filter and sort alarms
         active_alarms = {
@@ -113,127 +192,272 @@ def get_all_alarms(user_id):
         return {}
 
 
+def alarm_summary(alarm_id, alarm_info):
+    return {
+        'id': alarm_id,
+        'time': alarm_info.get('time'),
+        'status': alarm_info.get('status', 'active'),
+        'repeat': alarm_info.get('repeat'),
+        'next_fire': alarm_info.get('next_fire'),
+        'rev': alarm_info.get('rev', 0),
+    }
+
+
+# Full list, or with ?since=<rev> only the alarms added, changed or cancelled
+# after that revision. The ETag is the collection revision, so an unchanged
+# collection answers If-None-Match with 304 and no body.
 @app.route("/get_alarms", methods=["GET"])
 def get_alarms():
     try:
         user_id = session.get('user_id')
-        alarms_data = get_all_alarms(user_id)
-
-        if not alarms_data:
-            return jsonify({'status': 'error', 'message': 'No alarms found'}), 404
-
-        # Convert dictionary to list of alarms
-        alarms_list = []
-        for alarm_id, alarm_info in alarms_data.items():
-            alarms_list.append({
-                'id': alarm_id,
-                'time': alarm_info.get('time'),
-                'status': alarm_info.get('status', 'active')
-            })
+        if not user_id:
+            return jsonify({"status": "error", "message": "User not authenticated"}), 401
+
+        records = get_alarm_records(user_id)
+        revision = alarms_revision(records)
+        etag = f'alarms-{revision}'
+        if request.if_none_match.contains(etag):
+            response = Response(status=304)
+            response.set_etag(etag)
+            return response
+
+        since = request.args.get('since', type=int)
+        if since is not None:
+            # Delta mode: cancelled alarms are included so clients can drop them
+            alarms_list = [alarm_summary(aid, alarm) for aid, alarm in records.items()
+                           if alarm.get('rev', 0) > since]
+        else:
+            alarms_list = [alarm_summary(aid, alarm) for aid, alarm in records.items()
+                           if alarm.get('status') != 'cancelled']
+        alarms_list.sort(key=lambda alarm: alarm['rev'])
 
-        return jsonify({'status': 'success', 'alarms': alarms_list}), 200
+        response = jsonify({'status': 'success', 'revision': revision, 'since': since, 'alarms': alarms_list})
+        response.set_etag(etag)
+        response.headers['Cache-Control'] = 'no-cache'
+        return response, 200
 
     except Exception as e:
         print(f"Error fetching alarms: {e}")
         return jsonify({'status': 'error', 'message': str(e)}), 500
 
-# Get current time in Tunisia (for comparison)
+# Get current time in the default timezone (for logs)
 def get_tunisia_time():
-    tunisia = pytz.timezone("Africa/Cairo")
-    utc_now = datetime.utcnow()
-    return (datetime.utcnow() + timedelta(hours=1)).strftime("%H:%M:%S")  # Matches DB format: "18:36:50"
-
-# Extract time from user command
-def extract_time(command):
-    # Match "2:30 pm", "14:30", etc.
-    patterns = [
-        r'(?:set|at)?\s*(\d{1,2})(?:[:.](\d{2}))?\s*([ap]\.?m\.?)\b',     # 2:30 pm
-        r'(\d{1,2})(?:[:.](\d{2}))?\s*([ap]\.?m\.?)\b',                   # 2:30 pm no "set"
-        r'(\d{1,2})(?::(\d{2}))?(?:\s*hours)?\b'                          # 14:30 or 14 hours
-    ]
+    return local_now().strftime("%H:%M:%S")  # Matches DB format: "18:36:50"
 
-    for pattern in patterns:
-        match = re.search(pattern, command, re.IGNORECASE)
-        if match:
-            hour = int(match.group(1))
-            minutes = match.group(2) if match.group(2) else '00'
 
-            if len(match.groups()) < 3 or match.group(3) is None:
-                # 24-hour format
-                if 0 <= hour <= 23:
-                    return f"{hour:02d}:{minutes}:00"  # Add seconds
-            else:
-                # 12-hour format
-                period = match.group(3).lower().replace('.', '')
-                if 'p' in period and hour < 12:
-                    hour += 12
-                elif 'a' in period and hour == 12:
-                    hour = 0
-                return f"{hour:02d}:{minutes}:00"  # Add seconds
+# The user's IANA timezone from their profile, or recurrence.DEFAULT_TIMEZONE
+def user_timezone(user_id=None):
+    profile = (store.get_user(user_id) or {}) if user_id else {}
+    return recurrence.timezone(profile.get('timezone'))
+
 
-    return None
+# The user's local time, used for alarm times and spoken relative times
+def local_now(user_id=None):
+    return recurrence.local_now(user_timezone(user_id), wallclock.now())
 
 # Standardize any time input to "HH:MM:SS"
 def standardize_time_format(time_str):
-    try:
-        if 'am' in time_str.lower() or 'pm' in time_str.lower():
-            dt = datetime.strptime(time_str, "%I:%M %p")
-        else:
-            dt = datetime.strptime(time_str, "%H:%M")
-
-        return dt.strftime("%H:%M:%S")
-    except ValueError:
-        return time_str
+    # Canonical "HH:MM:SS" for storage and duplicate checks ("08:00" and
+    # "08:00:00" are the same alarm), or None if the time cannot be parsed
+    time_str = str(time_str).strip()
+    if 'am' in time_str.lower() or 'pm' in time_str.lower():
+        try:
+            return datetime.strptime(time_str, "%I:%M %p").strftime("%H:%M:%S")
+        except ValueError:
+            return None
+    parsed = recurrence.parse_time(time_str)
+    return parsed.strftime("%H:%M:%S") if parsed else None
 
 
-def check_and_activate_motor(user_uid):
+def fire_alarm(user_uid, alarm_id, deadline, lag):
     try:
-        # Reference to user data
-        user_ref = db.reference(f'users/{user_uid}')
-        user_data = user_ref.get()
+        # Queue the next occurrence first; a storage failure must not stop this one
+        try:
+            advance_alarm(user_uid, alarm_id, deadline)
+        except Exception as e:
+            print(f"⚠️ Could not queue the next run of alarm {alarm_id}: {e}")
 
-        if not user_data:
-            print(f"User {user_uid} not found.")
+        pressure = get_hardware_state(user_uid).get('pressure', 0)
+        if pressure != 1:
+            print(f"Alarm {alarm_id} due for user {user_uid} but nobody is on the pillow.")
             return
 
-        hardware = user_data.get('hardware', {})
-        pressure = hardware.get('pressure', 0)
+        print(f"⏰ Alarm triggered at {get_tunisia_time()} for user {user_uid} ({lag:.3f}s late)")
+
+        # Vibrate; an alarm firing while the motor already runs just extends it
+        if motor.start(user_uid):
+            print(f"✅ Motor on for {motor.default_duration:.0f} seconds.")
+
+    except Exception as e:
+        print(f"⚠️ Error during alarm check: {str(e)}")
+
+
+def get_hardware_state(user_id):
+    hardware = state_mirror.get_hardware(user_id)
+    if hardware is None:
+        return store.get_hardware(user_id)
+    # The mirror only hears about buffered writes once they are flushed
+    pending = write_buffer.pending_values(user_id, 'hardware/')
+    return dict(hardware, **pending) if pending else hardware
 
-        alarms = user_data.get('alarms', {})
 
-        # Get current time in HH:MM:SS format (match your alarm time format)
-        now =get_tunisia_time()
-        print(now)
-        for alarm_id, alarm in alarms.items():
-            status = alarm.get('status')
-            alarm_time = alarm.get('time')
+def set_motor(user_id, value):
+    store.set_hardware(user_id, 'motor', value)
+    publish(user_id, 'hardware', {'motor': value})
 
-            # Conditions to check
-            if status == 'active' and pressure == 1 and alarm_time == now:
-                print(f"⏰ Alarm triggered at {now} for user {user_uid}")
 
-                # Update motor to 1
-                user_ref.child('hardware/motor').set(1)
-                print("✅ Motor updated to 1.")
-                # Schedule motor to turn off after 10 seconds
-                scheduler.add_job(lambda: user_ref.child('hardware/motor').set(0),
-                                  'date', run_date=datetime.now() + timedelta(seconds=10))
+# Every pillow's motor goes through the controller, which turns it off again
+motor = MotorController(set_motor, default_duration=float(os.environ.get('MOTOR_SECONDS', 10)))
 
-                print("🕓 Motor will turn OFF in 10 seconds.")
-                break  # Optional: stop after first match
 
+def skip_missed_alarm(user_uid, alarm_id, deadline, lag):
+    advance_alarm(user_uid, alarm_id, wallclock.now())
+
+
+# An alarm due less than this long ago when it is loaded still rings
+ALARM_CATCH_UP = float(os.environ.get('ALARM_CATCH_UP_SECONDS', 300))
+
+alarm_engine = ShardedAlarmEngine(fire_alarm, on_missed=skip_missed_alarm,
+                                  shards=int(os.environ.get('ALARM_SHARDS', 4)),
+                                  catch_up_window=ALARM_CATCH_UP)
+
+
+# Each alarm record carries 'next_fire', the epoch second of its next
+# occurrence, kept up to date as it fires. The engine's heap is the index of
+# what is due; the stored value lets a restarted process catch up on an alarm
+# that came due while it was down, and lets clients show the next ring.
+def next_fire(user_id, alarm, after=None):
+    return recurrence.next_fire(alarm, user_timezone(user_id), wallclock.now() if after is None else after)
+
+
+def schedule_alarm(user_id, alarm_id, alarm):
+    if not alarm or alarm.get('status') != 'active':
+        alarm_engine.cancel(user_id, alarm_id)
+        return
+    deadline = alarm.get('next_fire')
+    if not isinstance(deadline, (int, float)) or deadline < wallclock.now() - ALARM_CATCH_UP:
+        deadline = next_fire(user_id, alarm)
+    if deadline is None:
+        print(f"Skipping alarm {alarm_id} with time {alarm.get('time')!r}: it never rings again")
+        alarm_engine.cancel(user_id, alarm_id)
+        return
+    alarm_engine.schedule(user_id, alarm_id, deadline)
+
+
+# Move an alarm on to its first occurrence after `after` and store it
+def advance_alarm(user_id, alarm_id, after):
+    alarm = get_alarm_records(user_id).get(alarm_id)
+    if not alarm or alarm.get('status') != 'active':
+        return
+    deadline = next_fire(user_id, alarm, after)
+    if deadline is None and (alarm.get('repeat') or {}).get('date'):
+        # A one-shot alarm has rung: retire it like a cancel, leaving a tombstone
+        store.update_alarm(user_id, alarm_id, {'next_fire': None, 'status': 'cancelled'})
+        publish(user_id, 'alarms', {alarm_id: None})
+        return
+    if deadline is not None:
+        alarm_engine.schedule(user_id, alarm_id, deadline)
+    # If this write fails the engine still has the deadline; a later load
+    # recomputes it from the alarm's rule
+    store.update_alarm(user_id, alarm_id, {'next_fire': deadline})
+    publish(user_id, 'alarms', {alarm_id: dict(alarm, next_fire=deadline)})
+
+
+def schedule_user_alarms(user_id, alarms):
+    alarm_engine.cancel_user(user_id)
+    for alarm_id, alarm in (alarms or {}).items():
+        schedule_alarm(user_id, alarm_id, alarm)
+
+
+# Load a user's alarms into the engine; later changes are pushed by the alarm routes
+def sync_user_alarms(user_id):
+    try:
+        schedule_user_alarms(user_id, store.get_alarms(user_id))
     except Exception as e:
-        print(f"⚠️ Error during alarm check: {str(e)}")
+        print(f"Error loading alarms for {user_id}: {str(e)}")
+
+
+# After a timezone change every active alarm rings at its time in the new zone
+def retime_user_alarms(user_id):
+    alarms = {}
+    for alarm_id, alarm in store.get_alarms(user_id).items():
+        if alarm.get('status') == 'active':
+            alarm = dict(alarm)
+            alarm.pop('rev', None)
+            alarm['next_fire'] = next_fire(user_id, alarm)
+            alarms[alarm_id] = alarm
+    if not alarms:
+        return
+    store.write_alarms(user_id, alarms)
+    for alarm_id, alarm in alarms.items():
+        schedule_alarm(user_id, alarm_id, alarm)
+    publish(user_id, 'alarms', alarms)
+
+
+# Alarms written straight to Firebase (dashboard, other clients) reach the engine
+# through the mirror's listener instead of a re-read
+def on_mirror_change(user_id, section, data):
+    store.invalidate(user_id, section)
+    if section == 'alarms':
+        schedule_user_alarms(user_id, data)
+        data = {aid: alarm for aid, alarm in data.items() if alarm.get('status') != 'cancelled'}
+        # Tell an engine running in another process; this one is already up to date
+        if 'web' in started_roles and 'engine' not in started_roles:
+            shared_state.set(f'alarms/{user_id}', wallclock.now())
+    event_bus.replace_section(user_id, section, data)
+
+
+state_mirror = StateMirror(store.database, on_change=on_mirror_change)
+
+
+# Changes made by other processes (only ever called with WAKEUP_SHARED_STATE=sqlite)
+def on_shared_change(key, value):
+    section, _, user_id = key.partition('/')
+    if section == 'alarms':
+        # A timezone change retimes the user's alarms, so the profile may be stale too
+        store.invalidate(user_id, 'alarms')
+        store.invalidate(user_id, 'profile')
+        if 'engine' in started_roles:
+            sync_user_alarms(user_id)
+        if event_bus.is_primed(user_id, 'alarms'):
+            event_bus.replace_section(user_id, 'alarms', get_all_alarms(user_id))
+    elif section == 'hardware' and value:
+        # The writer's buffered store write may land a moment later; the
+        # event carries the new values either way
+        store.invalidate(user_id, 'hardware')
+        event_bus.update_section(user_id, 'hardware', value)
+        if 'motor' in value:
+            # Keep this process's motor controller from skipping its next write
+            motor.observe(user_id, value['motor'])
+    elif key == 'voice_status':
+        user_id = get_current_user_id()
+        if user_id:
+            event_bus.update_section(user_id, 'voice', {'status': value or 'idle'})
+
+
+shared_state.subscribe(on_shared_change, remote_only=True)
+
+
+def use_shared_state(state):
+    # Swap in another shared state store before any role has started
+    global shared_state
+    shared_state = state
+    shared_state.subscribe(on_shared_change, remote_only=True)
+
+
+# Load the alarms of every user once at startup. Only the user ids are listed
+# so sessions and other per-user data are never downloaded here.
+def load_all_alarms():
+    user_ids = store.list_user_ids()
+    with ThreadPoolExecutor(max_workers=8) as pool:
+        list(pool.map(sync_user_alarms, user_ids))
+    print(f"Alarm engine loaded {alarm_engine.pending()} alarms for {len(user_ids)} users")
+
 
-def start_scheduler():
-        global scheduler
-        scheduler = BackgroundScheduler()
-        scheduler.add_job(lambda: check_and_activate_motor(current_user_id), 'interval', seconds=1)
-        scheduler.start()
 # Home
 @app.route('/')
 def index():
-    return render_template('index.html', time=datetime.now().timestamp())
+    return render_template('index.html', time=wallclock.now())
 
 
 # Registration Route - modified to verify the user data in the database
@@ -244,7 +468,7 @@ def register():
         password = request.form.get('password')
 
         print("\n=== DEBUG START ===")
-        print(f"1. Form Data Received - Email: {email}, Password: {password}")
+        print(f"1. Form Data Received - Email: {email}")
 
         if not email or not password:
             print("2. Validation Failed - Empty email or password")
@@ -257,10 +481,9 @@ def register():
             if user:
                 print(f"4. User Created Successfully - UID: {user.uid}")
                 print("5. Verifying database write...")
-                user_data = db.reference(f'users/{user.uid}').get()
-                print('luser data: ', user_data)
+                user_data = store.get_user(user.uid)
                 if user_data:
-                    print(f"6. Database Verification SUCCESS - Data: {user_data}")
+                    print("6. Database Verification SUCCESS")
                     return redirect(url_for('login'))
                 else:
                     print("6. Database Verification FAILED - No data found")
@@ -299,6 +522,7 @@ def login():
             print("ERROR: Missing email or password")
             return render_template('login.html', error="Both fields are required.")
 
+        auth = firebase_auth()
         try:
             # Attempt to get user from Firebase
             print("2. Verifying user with Firebase...")
@@ -312,15 +536,15 @@ def login():
 
             # Update global user tracking
             print("5. Updating global user state...")
-            with user_lock:
-                global current_user_id
-                current_user_id = user.uid
+            shared_state.set('current_user', user.uid)
+            shared_state.set(f'active_users/{user.uid}', wallclock.now())
             try:
                 print("6a. Updating Firebase 'current-user' node...")
-                db.reference('current-user').set(user.uid)
+                store.set_current_user(user.uid)
                 print("6b. Firebase 'current-user' updated successfully.")
             except Exception as e:
                 print(f"ERROR: Failed to update 'current-user' in Firebase - {str(e)}")
+            state_mirror.track(user.uid)
 
             print("6. Login successful - Redirecting to dashboard")
             return redirect(url_for('dash'))
@@ -345,14 +569,11 @@ def dash():
 
     user_id = session['user_id']  # ✅ Now it's safe to access
 
+    state_mirror.track(user_id)
     alarms = get_all_alarms(user_id)
     if alarms is None:
         alarms = {}
 
-    user_ref = db.reference(f'users/{user_id}')
-    user_data = user_ref.get()
-    user_name = user_data.get('name', 'User')
-
     return render_template('dash.html', user_id=user_id, alarms=alarms)
 
 
@@ -364,9 +585,8 @@ def profile():
     if not user_id:
         return redirect(url_for('login'))  # Redirect to login if user is not authenticated
 
-    # Fetch the user's existing profile from Firestore
-    user_ref = db.reference('users').child(user_id)
-    user_data = user_ref.get()
+    # Fetch the user's existing profile (scalar fields only, no alarms or sessions)
+    user_data = store.get_user(user_id)
 
     if user_data:
         user_data = user_data
@@ -376,24 +596,33 @@ def profile():
     # Handle profile update on POST request
     if request.method == 'POST':
         updated_name = request.form.get('name')
-        updated_email = request.form.get('email')
+        # The email field is read-only in the form, so browsers don't post it
+        updated_email = request.form.get('email') or (user_data or {}).get('email')
+        updated_timezone = request.form.get('timezone') or recurrence.DEFAULT_TIMEZONE
 
         # Validate inputs
         if not updated_name or not updated_email:
-            return render_template('profile.html', user=user_data, error="Both fields are required.")
-
-        # Update Firestore document with new values
-        user_ref.update({
+            return render_template('profile.html', user=user_data, default_timezone=recurrence.DEFAULT_TIMEZONE,
+                                   error="Both fields are required.")
+        if not recurrence.is_timezone(updated_timezone):
+            return render_template('profile.html', user=user_data, default_timezone=recurrence.DEFAULT_TIMEZONE,
+                                   error=f"Unknown timezone {updated_timezone!r}, use a name like Europe/Paris.")
+
+        # Update the stored profile with new values
+        store.update_user(user_id, {
             'name': updated_name,
             'email': updated_email,
+            'timezone': updated_timezone,
             # Add more fields for other editable information
         })
+        if updated_timezone != (user_data or {}).get('timezone', recurrence.DEFAULT_TIMEZONE):
+            retime_user_alarms(user_id)
 
         # Optionally, you can return a success message here
         return redirect(url_for('profile'))  # Redirect to refresh the page after saving changes
 
     # Render profile page with current user data
-    return render_template('profile.html', user=user_data)
+    return render_template('profile.html', user=user_data, default_timezone=recurrence.DEFAULT_TIMEZONE)
 
 
 @app.route('/insights', methods=['GET'])
@@ -402,78 +631,20 @@ def insights():
     if not user_id:
         return redirect(url_for('login'))
 
-    # Get user data from Firebase
-    user_ref = db.reference(f'users/{user_id}')
-    user_data = user_ref.get()
-
-    if not user_data or 'sessions' not in user_data:
+    # Read the running aggregate; rebuild it from the full history only when it is
+    # missing (users recorded before aggregation), flagged as out of date, or
+    # missing sessions the pillow firmware wrote directly
+    summary = store.get_insights(user_id)
+    if not is_current(summary, store.count_sessions(user_id)):
+        summary = build_summary(store.get_sessions(user_id))
+        if summary['count']:
+            store.save_insights(user_id, summary)
+    summary = normalize_summary(summary)
+
+    if not summary['count']:
         return "No session data available", 404
 
-    # Check if sessions is a dictionary before attempting to sort
-    if isinstance(user_data['sessions'], dict):
-        sessions = dict(sorted(user_data['sessions'].items()))  # Ensure chronological order
-    else:
-        # Handle the case where sessions might not be a dictionary
-        return "Invalid session data format", 400
-
-    durations = []
-    qualities = []
-    daily_data = []
-
-    # Define your quality calculation based on duration
-    def calculate_quality(duration):
-        if duration >= 420:  # 7 hours in minutes
-            return 100
-        elif duration >= 360:  # 6 hours in minutes
-            return 85
-        elif duration >= 300:  # 5 hours in minutes
-            return 70
-        elif duration >= 240:  # 4 hours in minutes
-            return 50
-        else:
-            return 30  # Less than 4 hours
-
-    for key, session_value in sessions.items():
-        duration = session_value.get('duration') if isinstance(session_value, dict) else session_value
-        quality = calculate_quality(duration)
-
-        durations.append(duration)
-        qualities.append(quality)
-        daily_data.append({
-            'date': key,
-            'duration': duration,
-            'quality': quality
-        })
-
-    if not durations:
-        return "No duration data available", 404
-
-    total_minutes = sum(durations)
-    avg_minutes = total_minutes / len(durations)
-    max_minutes = max(durations)
-    min_minutes = min(durations)
-
-    def format_minutes(mins):
-        return f"{int(mins // 60)}h {int(mins % 60)}m"
-
-    summary = {
-        'average_duration': format_minutes(avg_minutes),
-        'max_duration': format_minutes(max_minutes),
-        'min_duration': format_minutes(min_minutes),
-        'total_sessions': len(durations),
-        'total_sleep': format_minutes(total_minutes),
-        'average_quality': round(sum(qualities) / len(qualities), 1) if qualities else 0,
-        'daily_data': daily_data,
-    }
-
-    def get_change(arr):
-        return round(arr[-1] - arr[-2], 1) if len(arr) >= 2 else 0
-
-    trends = {
-        'duration_change': get_change(durations),
-        'quality_change': get_change(qualities)
-    }
-    print(qualities)
+    summary, daily_data, trends = render_summary(summary, user_timezone(user_id))
 
     recommendations = [
         "Try to go to bed 30 minutes earlier to increase your total sleep time",
@@ -489,30 +660,54 @@ def insights():
         recommendations=recommendations
     )
 
+# JSON sleep analytics over the full history, e.g. /api/insights?start=2025-01-01&end=2025-03-31
+@app.route('/api/insights', methods=['GET'])
+def api_insights():
+    user_id = session.get('user_id')
+    if not user_id:
+        return jsonify({"status": "error", "message": "User not authenticated"}), 401
+
+    try:
+        start = request.args.get('start')
+        end = request.args.get('end')
+        start = datetime.strptime(start, "%Y-%m-%d").date() if start else None
+        end = datetime.strptime(end, "%Y-%m-%d").date() if end else None
+        goal = float(request.args.get('goal', 420))
+    except ValueError:
+        return jsonify({"status": "error", "message": "Dates must be YYYY-MM-DD and goal a number"}), 400
+
+    import analytics  # numpy, only needed here
+    # Each night is bucketed by the user's offset on that date
+    result = analytics.analyze(store.get_sessions(user_id), start=start, end=end, goal_minutes=goal,
+                               tz=user_timezone(user_id))
+    return jsonify({"status": "success", **result}), 200
+
 # Logout route
 @app.route('/logout', methods=['POST'])
 def logout():
-    global current_user_id
-    with user_lock:
-        if current_user_id:
-            session.pop('user_id', None)
-            current_user_id = None
-            return jsonify({'status': 'success', 'message': 'Logged out successfully'})
-        return jsonify({'status': 'error', 'message': 'Not logged in'}), 400
+    # pop() is atomic across workers: only one of two concurrent logouts succeeds
+    user_id = shared_state.pop('current_user')
+    if user_id:
+        session.pop('user_id', None)
+        state_mirror.untrack(user_id)
+        shared_state.pop(f'active_users/{user_id}')
+        return jsonify({'status': 'success', 'message': 'Logged out successfully'})
+    return jsonify({'status': 'error', 'message': 'Not logged in'}), 400
 
 
 # API to set the alarm
-def create_alarm(user_id, alarm_time):
+def create_alarm(user_id, alarm_time, repeat=None):
     try:
         formatted_time = standardize_time_format(alarm_time)
         if not formatted_time:
             return {"status": "error", "message": "Invalid time format"}
-
-        # Get reference to user's alarms
-        alarms_ref = db.reference(f'users/{user_id}/alarms')
+        try:
+            repeat = recurrence.normalize_repeat(repeat, local_now(user_id).date())
+        except ValueError as e:
+            return {"status": "error", "message": str(e)}
 
         # Check for existing active alarms with same time
-        existing_alarms = alarms_ref.order_by_child('time').equal_to(formatted_time).get()
+        existing_alarms = store.find_alarms(user_id, formatted_time)
 
         # Check if any existing alarm is active
         active_alarm = next(
@@ -528,32 +723,32 @@ def create_alarm(user_id, alarm_time):
                 "alarm_id": active_alarm
             }
 
-        # Create new alarm with Firebase push ID
-        new_alarm_ref = alarms_ref.push()
+        # Create new alarm (the backend generates the ID)
         new_alarm_data = {
             'time': formatted_time,
             'status': 'active',
-            'created_at': datetime.utcnow().isoformat()
+            'created_at': wallclock.utcnow().isoformat()
         }
-        new_alarm_ref.set(new_alarm_data)
-
-        # Get the generated alarm ID
-        alarm_id = new_alarm_ref.key
-
-        # Set timer logic (keep your existing timer implementation)
-        # ...
+        if repeat:
+            new_alarm_data['repeat'] = repeat
+        new_alarm_data['next_fire'] = next_fire(user_id, new_alarm_data)
+        alarm_id = store.add_alarm(user_id, new_alarm_data)
+        schedule_alarm(user_id, alarm_id, new_alarm_data)
+        publish(user_id, 'alarms', {alarm_id: new_alarm_data})
 
         return {
             "status": "success",
             "message": "Alarm set",
             "alarm_id": alarm_id,
-            "alarm_time": formatted_time
+            "alarm_time": formatted_time,
+            "repeat": repeat,
+            "next_fire": new_alarm_data['next_fire']
         }
 
     except Exception as e:
-        # Firebase automatically rolls back writes, but we might want to clean up
-        if 'new_alarm_ref' in locals():
-            new_alarm_ref.delete()
+        # Clean up a half-created alarm
+        if 'alarm_id' in locals():
+            store.delete_alarm(user_id, alarm_id)
         return {"status": "error", "message": str(e)}
 
 
@@ -565,6 +760,13 @@ def add_alarm():
 
     if not user_id or not alarm_time:
         return jsonify({'status': 'error', 'message': 'Invalid data'}), 400
+    alarm_time = standardize_time_format(alarm_time)
+    if not alarm_time:
+        return jsonify({'status': 'error', 'message': 'Invalid time format'}), 400
+    try:
+        repeat = recurrence.normalize_repeat(data.get('repeat'), local_now(user_id).date())
+    except ValueError as e:
+        return jsonify({'status': 'error', 'message': str(e)}), 400
 
     try:
         alarm_id = str(uuid.uuid4())
@@ -572,9 +774,13 @@ def add_alarm():
             'time': alarm_time,
             'status': 'active'
         }
+        if repeat:
+            alarm_data['repeat'] = repeat
+        alarm_data['next_fire'] = next_fire(user_id, alarm_data)
 
-        alarms_ref = db.reference(f'users/{user_id}/alarms')
-        alarms_ref.child(alarm_id).set(alarm_data)
+        store.add_alarm(user_id, alarm_data, alarm_id)
+        schedule_alarm(user_id, alarm_id, alarm_data)
+        publish(user_id, 'alarms', {alarm_id: alarm_data})
 
         return jsonify({'status': 'success', 'alarm': {'time': alarm_time, 'status': 'active'}}), 200
 
@@ -604,224 +810,522 @@ def set_alarm_route():
     if not formatted_time:
         return jsonify({"error": "Invalid time format"}), 400
 
-    # Create the alarm in Firebase
-    result = create_alarm(session['user_id'], formatted_time)
+    # Create the alarm in Firebase; 'repeat' is an optional recurrence rule
+    result = create_alarm(session['user_id'], formatted_time, data.get('repeat'))
     status_code = 201 if result['status'] == 'success' else 400
     return jsonify(result), status_code
 
 
-# API to cancel an alarm@app.route('/cancel_alarm/<string:alarm_id>', methods=['POST'])
-@app.route("/cancel_alarm/<alarm_id>", methods=["POST"])
-def cancel_alarm(alarm_id):
-    try:
-        user_id = session.get("user_id")
-        if not user_id:
-            return jsonify({"status": "error", "message": "User not authenticated"}), 403
+MAX_BULK_OPERATIONS = 500
 
-        alarm_ref = db.reference(f'users/{user_id}/alarms/{alarm_id}')
-        alarm_ref.delete()  # Actually remove it from DB to trigger onChildRemoved
-        return jsonify({"status": "success", "message": "Alarm cancelled"})
 
-    except Exception as e:
-        print(f"Error cancelling alarm: {e}")
-        return jsonify({'status': 'error', 'message': str(e)}), 500
+# Create, update and cancel many alarms in one request:
+#   {"operations": [{"op": "create", "time": "07:00", "repeat": {"weekdays": [0, 1, 2, 3, 4]}},
+#                   {"op": "update", "id": "...", "time": "07:30"},
+#                   {"op": "cancel", "id": "..."}]}
+# Operations are checked in order against the user's current alarms, so a
+# duplicate time is caught within the batch too and reported with the id of the
+# alarm it clashes with. Everything accepted is stored in one atomic write, and
+# results[i] reports what happened to operation i.
+@app.route('/api/alarms/bulk', methods=['POST'])
+def bulk_alarms():
+    user_id = session.get('user_id')
+    if not user_id:
+        return jsonify({"status": "error", "message": "User not authenticated"}), 401
+
+    data = request.get_json(silent=True) or {}
+    operations = data.get('operations')
+    if not isinstance(operations, list) or not operations:
+        return jsonify({"status": "error", "message": "operations must be a non-empty list"}), 400
+    if len(operations) > MAX_BULK_OPERATIONS:
+        return jsonify({"status": "error",
+                        "message": f"At most {MAX_BULK_OPERATIONS} operations per request"}), 413
+
+    alarms = store.get_alarms(user_id)
+    today = local_now(user_id).date()
+    active_times = {alarm.get('time'): aid for aid, alarm in alarms.items()
+                    if alarm.get('status') == 'active'}
+    writes = {}
+    results = []
+
+    for index, operation in enumerate(operations):
+        op = operation.get('op') if isinstance(operation, dict) else None
+        alarm_id = operation.get('id') if op else None
+        result = {'index': index, 'op': op, 'id': alarm_id}
+        results.append(result)
+
+        alarm_time = repeat = None
+        if op in ('create', 'update') and 'time' in operation:
+            alarm_time = standardize_time_format(operation['time'])
+            if alarm_time is None:
+                result.update(status='invalid', message="Invalid time format")
+                continue
+        if op in ('create', 'update') and 'repeat' in operation:
+            try:
+                repeat = recurrence.normalize_repeat(operation['repeat'], today)
+            except ValueError as e:
+                result.update(status='invalid', message=str(e))
+                continue
+
+        if op == 'create':
+            if alarm_time is None:
+                result.update(status='invalid', message="Missing time")
+            elif alarm_time in active_times:
+                result.update(status='duplicate', existing_id=active_times[alarm_time], time=alarm_time)
+            else:
+                alarm_id = uuid.uuid4().hex
+                alarms[alarm_id] = writes[alarm_id] = {
+                    'time': alarm_time,
+                    'status': 'active',
+                    'created_at': wallclock.utcnow().isoformat()
+                }
+                if repeat:
+                    writes[alarm_id]['repeat'] = repeat
+                active_times[alarm_time] = alarm_id
+                result.update(status='created', id=alarm_id, time=alarm_time)
+
+        elif op in ('update', 'cancel'):
+            alarm = alarms.get(alarm_id)
+            if alarm is None or alarm.get('status') == 'cancelled':
+                result.update(status='not_found')
+                continue
+            alarm = dict(alarm)
+            alarm.pop('rev', None)
+            if op == 'cancel':
+                alarm['status'] = 'cancelled'
+                if active_times.get(alarm['time']) == alarm_id:
+                    del active_times[alarm['time']]
+                result.update(status='cancelled')
+            else:
+                if 'repeat' in operation:
+                    alarm.pop('repeat', None)
+                    if repeat:
+                        alarm['repeat'] = repeat
+                if alarm_time is None:
+                    if 'repeat' not in operation:
+                        result.update(status='invalid', message="Nothing to update")
+                        continue
+                    alarm_time = alarm['time']
+                if active_times.get(alarm_time, alarm_id) != alarm_id:
+                    result.update(status='duplicate', existing_id=active_times[alarm_time], time=alarm_time)
+                    continue
+                if active_times.get(alarm['time']) == alarm_id:
+                    del active_times[alarm['time']]
+                alarm['time'] = alarm_time
+                active_times[alarm_time] = alarm_id
+                result.update(status='updated', time=alarm_time)
+            alarms[alarm_id] = writes[alarm_id] = alarm
+
+        else:
+            result.update(status='invalid', message="op must be create, update or cancel")
 
+    for alarm in writes.values():
+        if alarm['status'] == 'active':
+            alarm['next_fire'] = next_fire(user_id, alarm)
 
-# Function to recognize voice input
-def get_voice_command():
-    global listening_state, last_command
-    recognizer = sr.Recognizer()
     try:
-        with sr.Microphone() as source:
-            print("Listening for an alarm command...")
-            recognizer.adjust_for_ambient_noise(source, duration=1)
-            recognizer.energy_threshold = 4000
-            recognizer.dynamic_energy_threshold = True
-            audio = recognizer.listen(source, timeout=5, phrase_time_limit=10)
-
-        command = recognizer.recognize_google(audio).lower()
-        if command:
-            last_command = command
-        print(f"Recognized: {command}")
-        return command
-    except sr.WaitTimeoutError:
-        print("Timeout - No speech detected")
-        return None
-    except sr.UnknownValueError:
-        print("Could not understand audio")
-        return None
-    except sr.RequestError as e:
-        print(f"Speech service error: {e}")
-        return None
+        revs = store.write_alarms(user_id, writes) if writes else {}
     except Exception as e:
-        print(f"Error in voice recognition: {e}")
-        return None
-
+        print(f"Error writing alarms: {e}")
+        return jsonify({'status': 'error', 'message': str(e)}), 500
 
+    for alarm_id, alarm in writes.items():
+        schedule_alarm(user_id, alarm_id, alarm)
+    if writes:
+        publish(user_id, 'alarms', {
+            alarm_id: alarm if alarm['status'] != 'cancelled' else None
+            for alarm_id, alarm in writes.items()})
+
+    return jsonify({
+        'status': 'success',
+        'revision': max(revs.values(), default=alarms_revision(alarms)),
+        'written': len(writes),
+        'results': results,
+    }), 200
+
+
+def cancel_user_alarm(user_id, alarm_id):
+    # Keep a 'cancelled' tombstone so delta-syncing clients see the removal.
+    # Returns False if the user has no such alarm.
+    if not store.cancel_alarm(user_id, alarm_id):
+        return False
+    alarm_engine.cancel(user_id, alarm_id)
+    publish(user_id, 'alarms', {alarm_id: None})
+    return True
 
 
-def listen_for_wake_word():
-    recognizer = sr.Recognizer()
+# API to cancel an alarm
+@app.route("/cancel_alarm/<alarm_id>", methods=["POST"])
+def cancel_alarm(alarm_id):
     try:
-        with sr.Microphone() as source:
-            print("🔍 Waiting for wake word (hey alarm, wake up, or alarm system)...")
-            recognizer.adjust_for_ambient_noise(source, duration=0.5)
-            recognizer.energy_threshold = 3000
-            audio = recognizer.listen(source, timeout=3, phrase_time_limit=2)
-
-            transcript = recognizer.recognize_google(audio).lower()
-            wake_words = ["hey alarm", "wake up", "alarm system", "stop"]
+        user_id = session.get("user_id")
+        if not user_id:
+            return jsonify({"status": "error", "message": "User not authenticated"}), 403
 
-            if any(wake_word in transcript for wake_word in wake_words):
-                return transcript
-            return False
+        if not cancel_user_alarm(user_id, alarm_id):
+            return jsonify({"status": "error", "message": "Alarm not found"}), 404
+        return jsonify({"status": "success", "message": "Alarm cancelled"})
 
-    except sr.UnknownValueError:
-        return False
-    except sr.RequestError:
-        print("❌ Speech Recognition service unavailable.")
-        return False
     except Exception as e:
-        return False
+        print(f"Error cancelling alarm: {e}")
+        return jsonify({'status': 'error', 'message': str(e)}), 500
 
-voice_ui_status="idle"
-def listen_for_commands():
-    global voice_ui_status
-    print("Voice recognition system started")
-    consecutive_errors = 0
-    max_consecutive_errors = 2
-    wake_word_detected = False  # Track if wake word was detected
 
-    with app.app_context():
-        while True:
-            try:
-                # 1. PRIORITIZE USER CONNECTION CHECK FIRST
-                with user_lock:
-                    user_id = current_user_id
+# Voice actions run on a small worker pool so the microphone loop never waits
+# on the database. Handlers call the alarm service directly.
+command_bus = CommandBus(workers=int(os.environ.get('VOICE_COMMAND_WORKERS', 2)))
 
 
-                if user_id is None:
-                    print("No active user - skipping voice command")
-                    voice_ui_status = "idle"
-                    time.sleep(2)
-                    continue
-
+def alarms_by_time(user_id):
+    # Active alarms in the order they are read out, so "cancel alarm 2" means
+    # the second one the user heard
+    return sorted(get_all_alarms(user_id).items(), key=lambda item: item[1].get('time', ''))
 
-                # Set alarm commands
-                if not wake_word_detected:
-                    wake_word_detected = listen_for_wake_word()
-                    if wake_word_detected and "stop" in wake_word_detected:
-                        print("DETECTED STP")
-                        user_ref = db.reference(f'users/{current_user_id}')
-                        user_ref.child('hardware/motor').set(0)
-                        print("✅ Motor updated to 0.")
 
-                    voice_ui_status = "idle"
-                    if not wake_word_detected:
-                        time.sleep(0.1)
-                        continue
-                    print("Wake word detected! Listening for commands...")
-                    voice_ui_status = "listening"
-                voice_command=get_voice_command()
-
-
-                if voice_command :
-                    print(f"Voice command detected: {voice_command}")
-                    consecutive_errors = 0
-
-                    if any(phrase in voice_command for phrase in ["set the alarm", "set an alarm", "set alarm"]):
-                        alarm_time = extract_time(voice_command)
-                        if alarm_time:
-                            print(f"✅ Setting alarm for {alarm_time}")
-                            result = create_alarm(user_id, alarm_time)
-                            if 'error' in result.get('status', ''):
-                                print(f"❌ Error: {result.get('message')}")
-                            else:
-                                print(f"✅ Alarm set successfully: {result}")
-                        else:
-                            print("❌ Could not extract time. Please include a specific time.")
-
-                    # Cancel alarm commands
-                    elif "cancel alarm" in voice_command or "delete alarm" in voice_command:
-                        match = re.search(
-                            r'(?:cancel|delete)\s+alarm\s+(?:number\s+|id\s+|#)?(\d+)',
-                            voice_command,
-                            re.IGNORECASE
-                        )
-                        if match:
-                            alarm_id = int(match.group(1))
-                            response = requests.post(f"http://127.0.0.1:5000/cancel_alarm/{alarm_id}")
-                            if response.ok:
-                                print(f"✅ Cancelled alarm {alarm_id}")
-                            else:
-                                print(f"❌ Error: {response.json().get('message', 'Unknown error')}")
-                            if result.get('status') == 'success':
-                                print(f"✅ Cancelled alarm {alarm_id}")
-                            else:
-                                print(f"❌ Error: {result.get('message')}")
-                        else:
-                            print("❌ Could not determine alarm ID. Please specify like 'Cancel alarm 3'")
-
-                    # List alarms command
-                    elif "list alarms" in voice_command or "show alarms" in voice_command:
-                        try:
-                            alarms_ref = db.reference(f'/users/{user_id}/alarms')
-                            alarms_data = alarms_ref.get()
-
-                        except Exception as e:
-                            print(f"❌ Failed to list alarms: {e}")
-
-                    # Help command
-                    elif "help" in voice_command:
-                        print("\n🔧 Available Voice Commands:")
-                        print("Set alarm [time] - Set a new alarm")
-                        print("Cancel alarm [ID] - Cancel an existing alarm")
-                        print("List alarms - Show all alarms")
-                        print("Help - Show this help message")
-
-                    # Reset wake word detection if user wants to stop
-                    elif "stop listening" in voice_command or "go to sleep" in voice_command:
-                        wake_word_detected = False
-                        print("✅ Returning to wake word detection mode")
-
-                    else:
-                        print("⚠️ Command not recognized. Say 'help' for available commands")
-                    wake_word_detected = False
-                    voice_ui_status="idle"
+@command_bus.handler('create')
+def voice_create_alarm(user_id, alarm_time, repeat=None):
+    result = create_alarm(user_id, alarm_time, repeat)
+    if result.get('status') == 'success':
+        print(f"✅ Alarm set successfully: {result}")
+    else:
+        print(f"❌ Error: {result.get('message')}")
+    return result
+
+
+@command_bus.handler('cancel')
+def voice_cancel_alarm(user_id, index):
+    alarms = alarms_by_time(user_id)
+    position = len(alarms) if index == -1 else index
+    if not 1 <= position <= len(alarms):
+        print(f"❌ There is no alarm {index}; you have {len(alarms)} active alarms")
+        return {"status": "error", "message": "No such alarm"}
+    alarm_id, alarm = alarms[position - 1]
+    if not cancel_user_alarm(user_id, alarm_id):
+        print(f"❌ Alarm {position} no longer exists")
+        return {"status": "error", "message": "No such alarm"}
+    print(f"✅ Cancelled alarm {position} ({alarm.get('time')})")
+    return {"status": "success", "alarm_id": alarm_id}
+
+
+@command_bus.handler('list')
+def voice_list_alarms(user_id):
+    alarms = alarms_by_time(user_id)
+    if not alarms:
+        print("No active alarms")
+    for position, (alarm_id, alarm) in enumerate(alarms, 1):
+        print(f"{position}. {alarm.get('time')}")
+    return alarms
+
+
+@command_bus.handler('stop_motor')
+def voice_stop_motor(user_id):
+    motor.stop(user_id)
+    print("✅ Motor stopped.")
+
+
+def set_voice_status(status):
+    if shared_state.get('voice_status') != status:
+        shared_state.set('voice_status', status)
+    user_id = get_current_user_id()
+    if user_id:
+        event_bus.update_section(user_id, 'voice', {'status': status})
+
+
+# Server-Sent Events: alarm, voice and motor/pressure changes as small diffs.
+# Clients resume with the standard Last-Event-ID header after a reconnect.
+# Each open stream holds a worker thread, so a stream is closed after
+# STREAM_MAX_SECONDS and the browser reconnects and resumes.
+STREAM_MAX_SECONDS = float(os.environ.get('WAKEUP_STREAM_MAX_SECONDS', 300))
+
+
+@app.route('/stream')
+def stream():
+    user_id = session.get('user_id')
+    if not user_id:
+        return jsonify({"status": "error", "message": "User not authenticated"}), 401
 
-                else:
-                    consecutive_errors += 1
-                    if consecutive_errors >= max_consecutive_errors:
-                        print("⚠️ Too many consecutive errors. Resetting voice recognition...")
-                        consecutive_errors = 0
-                        wake_word_detected = False  # Reset wake word detection
-                        voice_ui_status = "idle"
-                        time.sleep(2)
+    state_mirror.track(user_id)
+    if not event_bus.is_primed(user_id, 'alarms'):
+        event_bus.replace_section(user_id, 'alarms', get_all_alarms(user_id))
+    if not event_bus.is_primed(user_id, 'hardware'):
+        event_bus.replace_section(user_id, 'hardware', store.get_hardware(user_id))
+    if user_id == get_current_user_id():
+        event_bus.update_section(user_id, 'voice', {'status': shared_state.get('voice_status', 'idle')})
 
-            except Exception as e:
-                print(f"⚠️ Unexpected error: {str(e)}")
-                consecutive_errors += 1
-                wake_word_detected = False  # Reset on error
-                voice_ui_status = "idle"
-                time.sleep(1)
+    last_event_id = request.headers.get('Last-Event-ID') or request.args.get('last_event_id')
+    return Response(event_bus.subscribe(user_id, last_event_id, max_age=STREAM_MAX_SECONDS),
+                    mimetype='text/event-stream',
+                    headers={'Cache-Control': 'no-cache', 'X-Accel-Buffering': 'no'})
 
-            time.sleep(0.5)
 
 @app.route('/voice_status')
 def get_voice_status():
-    global voice_ui_status
-    return jsonify({"status":voice_ui_status})
+    return jsonify({"status": shared_state.get('voice_status', 'idle')})
+
+
+# Pillow firmware sync. One request replaces the device's read-current-user /
+# write-pressure / read-motor cycle:
+#   POST {"user": "...", "readings": [412, 398, ...], "interval": 500, "motor": 0, "rev": 12, "wait": 25}
+#   ->   {"user": "...", "motor": 0, "alarms": ["07:00:00"], "rev": 12, "pressure": 1}
+# readings are the raw force samples buffered since the last sync, oldest first
+# and interval ms apart; the last one was taken just now.
+# motor and rev echo what the device last applied; with "wait" the request is
+# held (up to DEVICE_MAX_WAIT seconds) until the motor command or the alarm
+# schedule differs from that, so an idle pillow makes one request per wait.
+# A waiting request holds a worker thread, like an open /stream.
+# Devices authenticate with the X-Device-Token header; without DEVICE_TOKEN
+# set the endpoint refuses every request.
+DEVICE_MAX_WAIT = float(os.environ.get('WAKEUP_DEVICE_MAX_WAIT', 30))
+DEVICE_TOKEN = os.environ.get('DEVICE_TOKEN')
+
+# Raw readings are kept per user per night for threshold tuning and analytics
+pressure_store = PressureStore(os.environ.get('PRESSURE_DIR', 'instance/pressure'))
+atexit.register(pressure_store.close)
+
+# Sleep sessions are detected here from the readings, one detector per pillow.
+# The detector's state is kept next to the pillow's readings and updated under
+# that user's lock, so consecutive syncs from one pillow can land on different
+# workers without serialising every other pillow. The pressure flag follows
+# the detector's hysteresis state.
+SESSION_ON_THRESHOLD = int(os.environ.get('SESSION_ON_THRESHOLD', 350))
+SESSION_OFF_THRESHOLD = int(os.environ.get('SESSION_OFF_THRESHOLD', 250))
+
+
+def detect_sessions(user_id, start, readings, interval):
+    finished = []
+
+    def feed(state):
+        detector = SessionDetector(SESSION_ON_THRESHOLD, SESSION_OFF_THRESHOLD).restore(state)
+        finished[:] = detector.feed_many(start, readings, interval)
+        return detector.state()
+
+    occupied = pressure_store.update_state(user_id, feed, default={})['occupied']
+    for found in finished:
+        print(f"Sleep session for {user_id}: {found['minutes']} min from {found['key']}")
+        store.add_session(user_id, found['key'], found['minutes'], found['start'])
+    return occupied
+
+
+def device_state(user_id):
+    records = get_alarm_records(user_id)
+    hardware = get_hardware_state(user_id)
+    return {
+        'user': user_id,
+        'motor': hardware.get('motor', 0),
+        'pressure': hardware.get('pressure', 0),
+        'alarms': sorted(alarm.get('time') for alarm in records.values() if alarm.get('status') == 'active'),
+        'rev': alarms_revision(records),
+    }
+
+
+def is_finite_number(value):
+    # JSON numbers only: no strings, booleans, NaN or infinity
+    return isinstance(value, (int, float)) and not isinstance(value, bool) and math.isfinite(value)
+
+
+@app.route('/device/sync', methods=['POST'])
+def device_sync():
+    if not DEVICE_TOKEN:
+        return jsonify({"status": "error", "message": "Device sync is disabled until DEVICE_TOKEN is set"}), 503
+    if not hmac.compare_digest(request.headers.get('X-Device-Token', ''), DEVICE_TOKEN):
+        return jsonify({"status": "error", "message": "Unknown device"}), 401
+
+    data = request.get_json(silent=True)
+    if data is None:
+        data = {}
+    if not isinstance(data, dict):
+        return jsonify({"status": "error", "message": "Body must be a JSON object"}), 400
+    readings = data.get('readings') or []
+    if not isinstance(readings, list) or not all(is_finite_number(value) for value in readings):
+        return jsonify({"status": "error", "message": "readings must be a list of numbers"}), 400
+    interval = data.get('interval') or 500
+    wait = data.get('wait') or 0
+    if not is_finite_number(interval) or interval <= 0:
+        return jsonify({"status": "error", "message": "interval must be a positive number of milliseconds"}), 400
+    if not is_finite_number(wait) or wait < 0:
+        return jsonify({"status": "error", "message": "wait must be a non-negative number of seconds"}), 400
+
+    user_id = data.get('user') or get_current_user_id() or store.get_current_user()
+    if not user_id:
+        return jsonify({"status": "idle", "motor": 0, "alarms": [], "rev": 0}), 200
+    if not is_valid_user_id(user_id):
+        return jsonify({"status": "error", "message": "Invalid user id"}), 400
+
+    if readings:
+        interval = float(interval) / 1000
+        first = wallclock.now() - (len(readings) - 1) * interval
+        pressure_store.append(user_id, first, readings, interval, user_timezone(user_id))
+        pressure = 1 if detect_sessions(user_id, first, readings, interval) else 0
+        # Only touch the database when someone got on or off the pillow
+        if get_hardware_state(user_id).get('pressure') != pressure:
+            store.set_hardware(user_id, 'pressure', pressure)
+            publish(user_id, 'hardware', {'pressure': pressure})
+
+    cursor = event_bus.last_id(user_id)
+    state = device_state(user_id)
+    wait = min(float(wait), DEVICE_MAX_WAIT)
+    deadline = time.monotonic() + wait
+    while state['motor'] == data.get('motor') and state['rev'] == data.get('rev'):
+        remaining = deadline - time.monotonic()
+        if remaining <= 0:
+            break
+        newest = event_bus.wait(user_id, cursor, remaining)
+        if newest == cursor:
+            break
+        cursor = newest
+        state = device_state(user_id)
+    return jsonify(state), 200
+
+
+# Stored force readings for the logged-in user between two epoch timestamps:
+# per-minute min/max/mean by default, or the raw samples with ?resolution=raw
+@app.route('/api/pressure')
+def api_pressure():
+    user_id = session.get('user_id')
+    if not user_id:
+        return jsonify({"status": "error", "message": "User not authenticated"}), 401
+
+    end = request.args.get('end', type=float) or wallclock.now()
+    start = request.args.get('start', type=float) or end - 12 * 3600
+    if end <= start or end - start > 31 * 24 * 3600:
+        return jsonify({"status": "error", "message": "Invalid range"}), 400
+
+    if request.args.get('resolution') == 'raw':
+        if end - start > 24 * 3600:
+            return jsonify({"status": "error", "message": "Raw reads are limited to 24 hours"}), 400
+        first, values = pressure_store.read(user_id, start, end, user_timezone(user_id))
+        return jsonify({'status': 'success', 'start': first, 'interval': 1 / pressure_store.sample_rate,
+                        'missing': MISSING_SAMPLE, 'values': values.tolist()})
+    minutes = pressure_store.read_minutes(user_id, start, end, user_timezone(user_id))
+    return jsonify({'status': 'success', 'thresholds': [SESSION_OFF_THRESHOLD, SESSION_ON_THRESHOLD],
+                    'minutes': [{'t': t, 'min': low, 'max': high, 'mean': mean} for t, low, high, mean in minutes]})
+
+
+# Counters kept by the cache, write buffer, command bus and motor are read at scrape time
+metrics.callback('wakeup_cache_hits_total', "Read cache hits",
+                 lambda: {(section,): value['hits'] for section, value in store.stats().items()
+                          if isinstance(value, dict)}, ['section'], kind='counter')
+metrics.callback('wakeup_cache_misses_total', "Read cache misses",
+                 lambda: {(section,): value['misses'] for section, value in store.stats().items()
+                          if isinstance(value, dict)}, ['section'], kind='counter')
+metrics.callback('wakeup_cache_entries', "Users held in the read cache", lambda: store.stats()['entries'])
+metrics.callback('wakeup_write_buffer_queue_depth', "Buffered writes not yet flushed",
+                 lambda: write_buffer.stats()['queue_depth'])
+metrics.callback('wakeup_write_buffer_events_total', "Write buffer writes, coalesced writes, flushes and errors",
+                 lambda: {(key,): value for key, value in write_buffer.stats().items()
+                          if key in ('writes', 'coalesced', 'flushes', 'errors')}, ['event'], kind='counter')
+metrics.callback('wakeup_command_queue_depth', "Voice commands waiting for a worker", command_bus.pending)
+metrics.callback('wakeup_command_total', "Voice commands handled",
+                 lambda: {(name, result): value[key] for name, value in command_bus.stats().items()
+                          if isinstance(value, dict) for result, key in (('handled', 'count'), ('error', 'errors'))},
+                 ['command', 'result'], kind='counter')
+metrics.callback('wakeup_motor_writes_total', "Motor writes made, skipped as unchanged and coalesced",
+                 lambda: {(key,): value for key, value in motor.stats().items() if key != 'running'},
+                 ['result'], kind='counter')
+metrics.callback('wakeup_motors_running', "Pillows with a motor timer pending", lambda: motor.stats()['running'])
+metrics.callback('wakeup_active_users', "Logged-in users", lambda: len(shared_state.items('active_users/')))
+metrics.callback('wakeup_event_channels', "Users with a live change feed for /stream and /device/sync",
+                 event_bus.channels)
+metrics.callback('wakeup_alarms_scheduled', "Alarms waiting in the scheduler", alarm_engine.pending)
+metrics.callback('wakeup_storage_circuit_open', "1 while the storage circuit breaker is open or half-open",
+                 lambda: int(resilient_store.stats()['circuit'] != 'closed'))
+metrics.callback('wakeup_storage_calls_total', "Storage calls, retries, timeouts, errors, fast failures and stale reads",
+                 lambda: {(key,): value for key, value in resilient_store.stats().items()
+                          if key in ('calls', 'retried', 'timeouts', 'errors', 'rejected', 'stale')},
+                 ['result'], kind='counter')
+
+
+@app.route('/metrics')
+def metrics_endpoint():
+    return Response(metrics.render(), content_type=metrics.CONTENT_TYPE)
+
+
+# Roles. One process can run any combination:
+#   web     serve HTTP (the routes above)
+#   engine  load every user's alarms and fire them, drive the pillow motors
+#   voice   listen to the microphone and run spoken commands
+# e.g. `python voicerec.py --roles engine voice` next to web workers started with
+# `gunicorn 'voicerec:create_app()'` (WAKEUP_ROLES defaults to web there).
+ROLES = ('web', 'engine', 'voice')
+started_roles = set()
+voice_agent = None
+
+
+def start_writes():
+    # Every role writes hardware state; flush buffered writes on a thread and
+    # watch shared state for other processes' changes
+    if 'writes' not in started_roles:
+        started_roles.add('writes')
+        write_buffer.start()
+        atexit.register(write_buffer.close)
+        shared_state.start()
+        atexit.register(shared_state.close)
+
+
+def start_engine():
+    motor.start_timers()
+    load_all_alarms()
+    alarm_engine.start()
+
+
+def start_voice():
+    global voice_agent
+    from voice_agent import VoiceAgent  # speech_recognition and the microphone
+    motor.start_timers()  # 'stop' turns the motor off through the controller
+    command_bus.start()
+    voice_agent = VoiceAgent(command_bus, current_user=get_current_user_id, set_status=set_voice_status,
+                             local_now=local_now,
+                             sensitivity=float(os.environ.get('WAKE_WORD_SENSITIVITY', 0.8)),
+                             min_energy=int(os.environ.get('VOICE_MIN_ENERGY', 300)))
+    threading.Thread(target=voice_agent.run, name='voice-agent', daemon=True).start()
+
+
+ROLE_STARTERS = {'web': lambda: None, 'engine': start_engine, 'voice': start_voice}
+
+
+def create_app(roles=None):
+    # Start the given roles (default: WAKEUP_ROLES, or just web) and return the app.
+    # Each role starts at most once per process. A process running only some
+    # roles relies on others for the rest, which only works when logins,
+    # alarm changes and hardware state reach them through shared state: with
+    # WAKEUP_SHARED_STATE unset that is the SQLite store, and an explicit
+    # 'local' is refused.
+    if roles is None:
+        roles = os.environ.get('WAKEUP_ROLES', 'web').replace(',', ' ').split()
+    unknown = set(roles) - set(ROLES)
+    if unknown:
+        raise ValueError(f"Unknown roles: {', '.join(sorted(unknown))} (choose from {', '.join(ROLES)})")
+    if set(roles) != set(ROLES) and not shared_state.shared:
+        if not os.environ.get('WAKEUP_SHARED_STATE') and 'writes' not in started_roles:
+            print("Running some roles only: sharing state through SQLite (WAKEUP_SHARED_STATE=sqlite)")
+            use_shared_state(open_shared_state('sqlite'))
+    if set(roles) != set(ROLES) and not shared_state.shared:
+        raise RuntimeError(f"Running only the {', '.join(roles)} role(s) needs state shared with the other "
+                           f"processes: set WAKEUP_SHARED_STATE=sqlite, or run all roles in one process")
+    start_writes()
+    for role in ROLES:
+        if role in roles and role not in started_roles:
+            started_roles.add(role)
+            ROLE_STARTERS[role]()
+            print(f"Started {role} role")
+    return app
 
 
 # Main function
-def main():
-    voice_thread = threading.Thread(target=listen_for_commands, daemon=True)
-    voice_thread.start()
-    app.run(port=5000, debug=True, use_reloader=False)
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Wake-Up server")
+    parser.add_argument('--roles', nargs='+', choices=ROLES, default=list(ROLES))
+    parser.add_argument('--port', type=int, default=int(os.environ.get('PORT', 5000)))
+    args = parser.parse_args(argv)
+
+    create_app(args.roles)
+    if 'web' in args.roles:
+        app.run(port=args.port, debug=True, use_reloader=False)
+    else:
+        threading.Event().wait()  # the roles run on daemon threads
 
 
 if __name__ == "__main__":
-    start_scheduler()
     main()
 
 
@@ -0,0 +1,114 @@
+import argparse
+import json
+import os
+import sys
+import time
+
+import speech_recognition as sr
+
+# Local wake-word spotting. Utterances from the microphone stream are checked
+# on-device with PocketSphinx keyword search; the cloud recognizer is only
+# called for the command that follows a local hit.
+#
+# Sensitivity runs from 0 (fewer false accepts, more misses) to 1 (the
+# opposite). Use the eval command on labelled recordings to pick a value:
+#
+#   python wakeword.py eval recordings/ --sensitivity 0.6 0.7 0.8 0.9
+#
+# where recordings/ holds one folder per keyword (spaces as underscores, e.g.
+# recordings/hey_alarm/*.wav) plus recordings/none/*.wav for background audio.
+
+WAKE_WORDS = ["hey alarm", "wake up", "alarm system", "stop"]
+DEFAULT_SENSITIVITY = 0.8
+NEGATIVE_LABEL = 'none'
+
+
+class KeywordSpotter:
+    def __init__(self, keywords=WAKE_WORDS, sensitivity=DEFAULT_SENSITIVITY, recognizer=None):
+        self.keywords = list(keywords)
+        self.sensitivity = sensitivity
+        self.recognizer = recognizer or sr.Recognizer()
+
+    def detect(self, audio):
+        # Returns the spotted keyword or None. Raises sr.RequestError when
+        # PocketSphinx is not installed.
+        try:
+            hypothesis = self.recognizer.recognize_sphinx(
+                audio, keyword_entries=[(keyword, self.sensitivity) for keyword in self.keywords])
+        except sr.UnknownValueError:
+            return None
+        # Sphinx reports the keywords it found, longest phrases first
+        for keyword in sorted(self.keywords, key=len, reverse=True):
+            if keyword in hypothesis:
+                return keyword
+        return None
+
+
+def load_labelled_wavs(directory):
+    samples = []
+    for label in sorted(os.listdir(directory)):
+        folder = os.path.join(directory, label)
+        if not os.path.isdir(folder):
+            continue
+        keyword = None if label == NEGATIVE_LABEL else label.replace('_', ' ')
+        for name in sorted(os.listdir(folder)):
+            if name.lower().endswith('.wav'):
+                samples.append((os.path.join(folder, name), keyword))
+    return samples
+
+
+def evaluate(samples, sensitivity, keywords=WAKE_WORDS):
+    spotter = KeywordSpotter(keywords, sensitivity)
+    positives = negatives = false_rejects = false_accepts = 0
+    negative_seconds = 0.0
+    elapsed = 0.0
+    for path, expected in samples:
+        with sr.AudioFile(path) as source:
+            audio = spotter.recognizer.record(source)
+        started = time.perf_counter()
+        detected = spotter.detect(audio)
+        elapsed += time.perf_counter() - started
+        if expected is None:
+            negatives += 1
+            negative_seconds += len(audio.frame_data) / (audio.sample_rate * audio.sample_width)
+            false_accepts += detected is not None
+        else:
+            positives += 1
+            false_rejects += detected != expected
+    return {
+        'sensitivity': sensitivity,
+        'positives': positives,
+        'negatives': negatives,
+        'false_reject_rate': round(false_rejects / positives, 4) if positives else None,
+        'false_accept_rate': round(false_accepts / negatives, 4) if negatives else None,
+        'false_accepts_per_hour': round(false_accepts / negative_seconds * 3600, 2) if negative_seconds else None,
+        'mean_detect_ms': round(elapsed / len(samples) * 1000, 1) if samples else None,
+    }
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Wake-word spotting tools")
+    commands = parser.add_subparsers(dest='command', required=True)
+    eval_parser = commands.add_parser('eval', help="measure false accept/reject rates on labelled WAV files")
+    eval_parser.add_argument('directory')
+    eval_parser.add_argument('--sensitivity', type=float, nargs='+', default=[DEFAULT_SENSITIVITY])
+    eval_parser.add_argument('--json', action='store_true', help="print machine-readable results")
+    args = parser.parse_args(argv)
+
+    samples = load_labelled_wavs(args.directory)
+    if not samples:
+        print(f"No labelled WAV files found in {args.directory}")
+        return 1
+    results = [evaluate(samples, sensitivity) for sensitivity in args.sensitivity]
+    if args.json:
+        print(json.dumps(results, indent=2))
+    else:
+        print(f"{'sensitivity':>11} {'FRR':>8} {'FAR':>8} {'FA/hour':>8} {'ms':>7}")
+        for r in results:
+            print(f"{r['sensitivity']:>11} {r['false_reject_rate']!s:>8} {r['false_accept_rate']!s:>8} "
+                  f"{r['false_accepts_per_hour']!s:>8} {r['mean_detect_ms']!s:>7}")
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,74 @@
+import threading
+import time
+from datetime import datetime, timedelta
+
+# The one place the app reads the wall clock. Code asks wallclock.now() (epoch
+# seconds) or wallclock.utcnow() instead of time.time()/datetime.utcnow(), so
+# benchmarks and tools can install a FakeClock and move time by hand:
+#
+#   fake = wallclock.FakeClock(start=1760853600)
+#   previous = wallclock.install(fake)
+#   fake.advance(60)         # a minute passes, instantly
+#   wallclock.install(previous)
+#
+# Durations (latencies, timeouts) keep using time.perf_counter() and
+# time.monotonic() directly; only "what time is it" goes through here.
+
+EPOCH = datetime(1970, 1, 1)
+
+
+class SystemClock:
+    def time(self):
+        return time.time()
+
+    def sleep(self, seconds):
+        time.sleep(seconds)
+
+
+class FakeClock:
+    # Time only moves when advance() or sleep() is called
+    def __init__(self, start=None):
+        self._now = time.time() if start is None else float(start)
+        self._lock = threading.Lock()
+
+    def time(self):
+        return self._now
+
+    def advance(self, seconds):
+        with self._lock:
+            self._now += seconds
+            return self._now
+
+    def sleep(self, seconds):
+        self.advance(seconds)
+
+    def set(self, timestamp):
+        with self._lock:
+            self._now = float(timestamp)
+
+
+_clock = SystemClock()
+
+
+def install(clock):
+    # Use clock from now on; returns the previous one so it can be restored
+    global _clock
+    previous, _clock = _clock, clock
+    return previous
+
+
+def current():
+    return _clock
+
+
+def now():
+    return _clock.time()
+
+
+def utcnow():
+    # Naive UTC datetime, like datetime.utcnow()
+    return EPOCH + timedelta(seconds=_clock.time())
+
+
+def sleep(seconds):
+    _clock.sleep(seconds)
@@ -0,0 +1,174 @@
+import threading
+import time
+import traceback
+from collections import deque
+
+import metrics
+
+# Write-behind buffer in front of a Storage backend for the small, frequent
+# writes on the hot path: hardware fields (motor, pressure) and the current
+# user. Pending writes are grouped per user and flushed as one multi-path
+# Storage.write_paths() call every `interval` seconds, or straight away once a
+# user has `max_writes` pending. A second write to the same path before the
+# flush replaces the first.
+#
+# Reads through the buffer see pending values (read-your-writes for this
+# process); other processes see them after the flush. Everything else passes
+# straight through to the backend.
+
+FLUSH_INTERVAL = 0.05
+# Wait between flushes while the backend is failing
+RETRY_INTERVAL = 1.0
+MAX_WRITES = 50
+LATENCY_SAMPLES = 512
+
+FLUSH_SECONDS = metrics.histogram('wakeup_write_buffer_flush_seconds',
+                                  "Time to write one user's buffered writes to storage", ['result'])
+
+
+class WriteBuffer:
+    def __init__(self, backend, interval=FLUSH_INTERVAL, max_writes=MAX_WRITES):
+        self.backend = backend
+        self.interval = interval
+        self.max_writes = max_writes
+        self._pending = {}   # user_id (None for root paths) -> {path: value}
+        self._inflight = {}  # same shape, being written right now
+        self._cond = threading.Condition()
+        self._flush_lock = threading.Lock()
+        self._thread = None
+        self._stopped = False
+        self.writes = 0
+        self.coalesced = 0
+        self.flushes = 0
+        self.errors = 0
+        self._latencies = deque(maxlen=LATENCY_SAMPLES)
+
+    def __getattr__(self, name):
+        return getattr(self.backend, name)
+
+    # Buffered writes -------------------------------------------------------
+
+    def _enqueue(self, user_id, path, value):
+        with self._cond:
+            pending = self._pending.setdefault(user_id, {})
+            if path in pending:
+                self.coalesced += 1
+            pending[path] = value
+            self.writes += 1
+            if len(pending) >= self.max_writes:
+                self._cond.notify()
+            # Not started (tests, tools): behave like a write-through store
+            write_through = self._thread is None
+        if write_through:
+            self.flush()
+
+    def set_hardware(self, user_id, field, value):
+        self._enqueue(user_id, f'hardware/{field}', value)
+
+    def set_current_user(self, user_id):
+        self._enqueue(None, 'current-user', user_id)
+
+    # Reads that see pending writes -------------------------------------------
+
+    def pending_values(self, user_id, prefix=''):
+        # {path without prefix: value} for this user's not-yet-stored writes
+        with self._cond:
+            merged = dict(self._inflight.get(user_id, {}))
+            merged.update(self._pending.get(user_id, {}))
+        return {path[len(prefix):]: value for path, value in merged.items() if path.startswith(prefix)}
+
+    def get_hardware(self, user_id):
+        hardware = self.backend.get_hardware(user_id)
+        overlay = self.pending_values(user_id, 'hardware/')
+        if overlay:
+            hardware = dict(hardware or {}, **overlay)
+        return hardware
+
+    def get_current_user(self):
+        overlay = self.pending_values(None)
+        if 'current-user' in overlay:
+            return overlay['current-user']
+        return self.backend.get_current_user()
+
+    # Flushing ----------------------------------------------------------------
+
+    def flush(self):
+        # Write everything pending now; safe to call from any thread. Returns
+        # False if anything had to be put back for a retry.
+        ok = True
+        with self._flush_lock:
+            with self._cond:
+                batch, self._pending = self._pending, {}
+                self._inflight = batch
+            for user_id, updates in batch.items():
+                started = time.perf_counter()
+                try:
+                    self.backend.write_paths(user_id, updates)
+                except Exception as e:
+                    FLUSH_SECONDS.observe(time.perf_counter() - started, result='error')
+                    if isinstance(e, (ConnectionError, TimeoutError)):
+                        print(f"⚠️ Flush for {user_id} failed, will retry: {e}")
+                    else:
+                        traceback.print_exc()
+                    ok = False
+                    with self._cond:
+                        self.errors += 1
+                        # Retry next time, without overwriting anything newer
+                        retry = self._pending.setdefault(user_id, {})
+                        for path, value in updates.items():
+                            retry.setdefault(path, value)
+                    continue
+                elapsed = time.perf_counter() - started
+                FLUSH_SECONDS.observe(elapsed, result='ok')
+                with self._cond:
+                    self.flushes += 1
+                    self._latencies.append(elapsed)
+            with self._cond:
+                self._inflight = {}
+        return ok
+
+    def start(self):
+        # An interval of 0 keeps the buffer write-through
+        if self._thread is None and self.interval > 0:
+            self._stopped = False
+            self._thread = threading.Thread(target=self._run, name='write-buffer', daemon=True)
+            self._thread.start()
+        return self
+
+    def close(self):
+        with self._cond:
+            self._stopped = True
+            self._cond.notify()
+        if self._thread is not None:
+            self._thread.join()
+            self._thread = None
+        self.flush()
+        self.backend.close()
+
+    def _run(self):
+        wait = self.interval
+        while True:
+            with self._cond:
+                if self._stopped:
+                    return
+                self._cond.wait(wait)
+                if not self._pending:
+                    continue
+            wait = self.interval if self.flush() else RETRY_INTERVAL
+
+    def stats(self):
+        with self._cond:
+            latencies = sorted(self._latencies)
+            return {
+                'queue_depth': sum(len(updates) for updates in self._pending.values()),
+                'users_pending': len(self._pending),
+                'writes': self.writes,
+                'coalesced': self.coalesced,
+                'flushes': self.flushes,
+                'errors': self.errors,
+                'flush_ms': {
+                    'p50': round(latencies[len(latencies) // 2] * 1000, 2),
+                    'p95': round(latencies[int(len(latencies) * 0.95)] * 1000, 2),
+                    'max': round(latencies[-1] * 1000, 2),
+                } if latencies else None,
+            }